@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Stand-in for the `dropbox` CLI implementing `dropbox exclude list|add|remove`
+
+Excluded paths are kept in the file named by FAKE_DROPBOX_STATE, every call sleeps FAKE_DROPBOX_LATENCY seconds
+before answering. Paths added are also appended with a timestamp to FAKE_DROPBOX_LOG, so the latency of exclusions
+can be measured.
+"""
+import fcntl
+import os
+import os.path as p
+import sys
+import time
+
+
+def main() -> None:
+    if len(sys.argv) < 3 or sys.argv[1] != 'exclude' or sys.argv[2] not in ('list', 'add', 'remove'):
+        print('usage: dropbox exclude list|add|remove [PATH...]', file=sys.stderr)
+        sys.exit(1)
+
+    state_path = os.environ['FAKE_DROPBOX_STATE']
+    log_path = os.environ.get('FAKE_DROPBOX_LOG')
+    time.sleep(float(os.environ.get('FAKE_DROPBOX_LATENCY', '0')))
+
+    command, paths = sys.argv[2], [p.relpath(p.abspath(path)) for path in sys.argv[3:]]
+    with open(state_path, 'a+') as state_file:
+        fcntl.flock(state_file, fcntl.LOCK_EX)
+        state_file.seek(0)
+        excluded = [line for line in state_file.read().split('\n') if line]
+
+        if command == 'list':
+            print('Excluded:')
+            for excluded_path in excluded:
+                print(excluded_path)
+            return
+
+        if command == 'add':
+            excluded.extend(path for path in paths if path not in excluded)
+        else:
+            excluded = [excluded_path for excluded_path in excluded if excluded_path not in paths]
+        state_file.seek(0)
+        state_file.truncate()
+        state_file.write(''.join(f'{excluded_path}\n' for excluded_path in excluded))
+
+    if command == 'add' and log_path:
+        with open(log_path, 'a') as log_file:
+            log_file.write(''.join(f'{time.time()} {path}\n' for path in paths))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""Benchmark of dropboxignore on synthetic directory trees with a fake Dropbox CLI
+
+Measures parsing of rules, matching throughput of every engine, the combined regex against per-rule matching, wall
+time of the initial scan and latency between creating an ignored directory and its exclusion. Results are written as
+JSON, so they can be compared across versions.
+
+    python benchmarks/run.py --directories 100000 --rules 500 --latency 0.05 --output results.json
+"""
+from typing import Dict, List
+import argparse
+import contextlib
+import json
+import os
+import os.path as p
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, p.dirname(p.dirname(p.abspath(__file__))))
+
+import pyinotify  # noqa: E402
+import dropboxignore  # noqa: E402
+from dropboxignore import (ENGINES, WATCHED_EVENTS, EventHandler, ExclusionIndex, ExclusionQueue,  # noqa: E402
+                           ExclusionWorkers, RuleCache, initial_excludes, parse_dropboxignore)
+
+# Names matched by generated rules, EVENT_PREFIX is used by directories created during the event benchmark
+IGNORED_NAMES = ['node_modules', '__pycache__', '.mypy_cache', 'build', 'dist']
+EVENT_PREFIX = 'ignored_event_'
+
+
+def generate_rules(count: int, seed: int = 0) -> List[str]:
+    """Return count lines of .dropboxignore mixing literal, glob, anchored and negated rules"""
+    rng = random.Random(seed)
+    lines = [f'{name}\n' for name in IGNORED_NAMES] + [f'{EVENT_PREFIX}*\n']
+    while len(lines) < count:
+        number = len(lines)
+        kind = rng.random()
+        if kind < 0.4:
+            lines.append(f'literal_{number}\n')
+        elif kind < 0.7:
+            lines.append(f'*.glob_{number}\n')
+        elif kind < 0.9:
+            lines.append(f'project_{number}/**/out_{number}\n')
+        else:
+            lines.append(f'!keep_{number}\n')
+    return lines[:count]
+
+
+def generate_tree(root: str, directories: int, fanout: int = 10, ignored_ratio: float = 0.02,
+                  seed: int = 0) -> List[str]:
+    """Create directories below root breadth-first, ignored_ratio of them named by ignored names
+
+    :return: relative paths of created directories
+    :rtype: List[str]
+    """
+    rng = random.Random(seed)
+    relpaths: List[str] = []
+    parents = ['']
+    while len(relpaths) < directories:
+        next_parents = []
+        for parent in parents:
+            for number in range(fanout):
+                if len(relpaths) >= directories:
+                    break
+                ignored = rng.random() < ignored_ratio
+                name = rng.choice(IGNORED_NAMES) if ignored else f'd{number}'
+                relpath = dropboxignore.join_relpath(parent, name)
+                if relpath in relpaths[-fanout:]:
+                    continue
+                os.mkdir(p.join(root, relpath))
+                relpaths.append(relpath)
+                if not ignored:
+                    next_parents.append(relpath)
+        if not next_parents:
+            break
+        parents = next_parents
+    return relpaths
+
+
+def install_fake_dropbox(workdir: str, latency: float) -> Dict[str, str]:
+    """Put fake `dropbox` executable on PATH of this process and return paths of its state and log files"""
+    bin_path = p.join(workdir, 'bin')
+    os.makedirs(bin_path, exist_ok=True)
+    executable = p.join(bin_path, 'dropbox')
+    fake_dropbox = p.join(p.dirname(p.abspath(__file__)), 'fake_dropbox.py')
+    with open(executable, 'w') as executable_file:
+        executable_file.write(f'#!/bin/sh\nexec "{sys.executable}" "{fake_dropbox}" "$@"\n')
+    os.chmod(executable, 0o755)
+
+    files = {'state': p.join(workdir, 'excluded.txt'), 'log': p.join(workdir, 'excluded.log')}
+    os.environ['PATH'] = f'{bin_path}{os.pathsep}{os.environ.get("PATH", "")}'
+    os.environ['FAKE_DROPBOX_STATE'] = files['state']
+    os.environ['FAKE_DROPBOX_LOG'] = files['log']
+    os.environ['FAKE_DROPBOX_LATENCY'] = str(latency)
+    reset_fake_dropbox(files)
+    return files
+
+
+def reset_fake_dropbox(files: Dict[str, str]) -> None:
+    for path in files.values():
+        open(path, 'w').close()
+
+
+def read_log(log_path: str) -> Dict[str, float]:
+    logged = {}
+    with open(log_path, 'r') as log_file:
+        for line in log_file:
+            timestamp, path = line.rstrip('\n').split(' ', 1)
+            logged[path] = float(timestamp)
+    return logged
+
+
+def best_of(repeat: int, function) -> float:
+    """Return the shortest of repeat wall times of function"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_parse(lines: List[str], repeat: int, cache_path: str) -> Dict[str, dict]:
+    cache = RuleCache(cache_path)
+    cache.entries(lines)
+    return {engine: {'seconds': best_of(repeat, lambda: parse_dropboxignore(lines, engine)),
+                     'cached_seconds': best_of(repeat, lambda: parse_dropboxignore(lines, engine, cache=cache))}
+            for engine in ENGINES}
+
+
+def bench_match(lines: List[str], relpaths: List[str], repeat: int) -> Dict[str, dict]:
+    results = {}
+    for engine in ENGINES:
+        rules = parse_dropboxignore(lines, engine)
+        seconds = best_of(repeat, lambda: [dropboxignore.test_if_ignored(relpath, rules) for relpath in relpaths])
+        results[engine] = {'paths': len(relpaths), 'seconds': seconds,
+                           'paths_per_second': len(relpaths) / seconds if seconds else None}
+    return results
+
+
+def bench_combined(lines: List[str], relpaths: List[str], repeat: int) -> Dict[str, dict]:
+    """Compare glob rules matched by the combined regex of RegexMatcher with matching them one by one"""
+    glob_lines = [line for line in lines if '*' in line and not line.startswith('!')]
+    rules = parse_dropboxignore(glob_lines)
+    patterns = [rule.regex.compiled() for rule in rules.entries]
+    combined = rules.matcher.glob_ignored
+    results = {'rules': len(glob_lines), 'paths': len(relpaths)}
+    if combined is not None:
+        results['combined_seconds'] = best_of(repeat, lambda: [combined.match(relpath) for relpath in relpaths])
+        results['per_rule_seconds'] = best_of(repeat, lambda: [any(pattern.match(relpath) for pattern in patterns)
+                                                               for relpath in relpaths])
+    return results
+
+
+def bench_initial_excludes(root: str, lines: List[str], engine: str, jobs: List[int], files: Dict[str, str],
+                           flush_size: int, flush_interval: float) -> Dict[str, dict]:
+    results = {}
+    rules = parse_dropboxignore(lines, engine)
+    for job_count in jobs:
+        reset_fake_dropbox(files)
+        index = ExclusionIndex(root)
+        queue = ExclusionQueue(root, index, flush_size, flush_interval)
+        start = time.perf_counter()
+        stats = initial_excludes(root, rules, index, queue, job_count)
+        queue.flush()
+        seconds = time.perf_counter() - start
+        results[str(job_count)] = {'seconds': seconds, 'directories': stats.directories, 'ignored': stats.ignored,
+                                   'directories_per_second': stats.directories / seconds if seconds else None}
+    return results
+
+
+def bench_events(root: str, lines: List[str], engine: str, events: int, interval: float, coalesce_window: float,
+                 files: Dict[str, str], flush_size: int, flush_interval: float, timeout: float = 60.0) -> dict:
+    """Create ignored directories one by one in a watched tree and measure time until each is excluded"""
+    reset_fake_dropbox(files)
+    rules = parse_dropboxignore(lines, engine)
+    index = ExclusionIndex(root)
+    queue = ExclusionQueue(root, index, flush_size, flush_interval)
+    workers = ExclusionWorkers()
+    wm = pyinotify.WatchManager()
+    handler = EventHandler(root, rules, index, queue, wm, coalesce_window, workers)
+    notifier = pyinotify.Notifier(wm, handler, timeout=int(coalesce_window * 1000) or 100)
+    stop = threading.Event()
+
+    def tick(_) -> bool:
+        handler.poll()
+        return stop.is_set()
+
+    handler.watch(WATCHED_EVENTS)
+    thread = threading.Thread(target=notifier.loop, kwargs={'callback': tick}, daemon=True)
+    thread.start()
+
+    created: Dict[str, float] = {}
+    for number in range(events):
+        relpath = f'{EVENT_PREFIX}{number}'
+        created[relpath] = time.time()
+        os.mkdir(p.join(root, relpath))
+        time.sleep(interval)
+
+    deadline = time.monotonic() + timeout
+    logged = read_log(files['log'])
+    while not set(created).issubset(logged) and time.monotonic() < deadline:
+        time.sleep(0.05)
+        logged = read_log(files['log'])
+
+    stop.set()
+    thread.join()
+    workers.close()
+    queue.flush()
+
+    latencies = sorted(logged[relpath] - created[relpath] for relpath in created if relpath in logged)
+    result = {'events': events, 'excluded': len(latencies)}
+    if latencies:
+        result.update({
+            'mean': statistics.mean(latencies),
+            'p50': latencies[len(latencies) // 2],
+            'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            'max': latencies[-1],
+        })
+    return result
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL,
+                                       cwd=p.dirname(p.abspath(__file__))).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(args: argparse.Namespace) -> dict:
+    workdir = tempfile.mkdtemp(prefix='dropboxignore-bench-')
+    environ = dict(os.environ)
+    try:
+        files = install_fake_dropbox(workdir, args.latency)
+        root = p.join(workdir, 'Dropbox')
+        os.mkdir(root)
+        lines = generate_rules(args.rules, args.seed)
+        with open(p.join(root, '.dropboxignore'), 'w') as rules_file:
+            rules_file.writelines(lines)
+
+        generation_start = time.perf_counter()
+        relpaths = generate_tree(root, args.directories, args.fanout, args.ignored_ratio, args.seed)
+        generation_seconds = time.perf_counter() - generation_start
+
+        results: Dict[str, dict] = {'tree': {'directories': len(relpaths), 'seconds': generation_seconds}}
+        # Tool reports every excluded path, which is not part of the measurement
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results['parse'] = bench_parse(lines, args.repeat, p.join(workdir, 'rules'))
+            results['match'] = bench_match(lines, relpaths, args.repeat)
+            results['combined'] = bench_combined(lines, relpaths, args.repeat)
+            results['initial_excludes'] = bench_initial_excludes(root, lines, args.engine, args.jobs, files,
+                                                                 args.flush_size, args.flush_interval)
+            if args.events:
+                results['events'] = bench_events(root, lines, args.engine, args.events, args.event_interval,
+                                                 args.coalesce_window, files, args.flush_size, args.flush_interval)
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': results,
+    }
+
+
+def parse_arguments(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark dropboxignore on a synthetic directory tree')
+    parser.add_argument('--directories', type=int, default=10000, help='directories in generated tree')
+    parser.add_argument('--fanout', type=int, default=10, help='subdirectories of every generated directory')
+    parser.add_argument('--ignored-ratio', type=float, default=0.02, help='share of ignored directories')
+    parser.add_argument('--rules', type=int, default=100, help='lines of generated .dropboxignore')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='regex',
+                        help='engine used by scan and event benchmarks')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 4], help='scan thread counts to measure')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds every fake dropbox call takes')
+    parser.add_argument('--events', type=int, default=100, help='ignored directories created while watching')
+    parser.add_argument('--event-interval', type=float, default=0.01, help='seconds between created directories')
+    parser.add_argument('--coalesce-window', type=float, default=0.1, help='coalesce window of event handler')
+    parser.add_argument('--flush-size', type=int, default=100, help='paths excluded by one fake dropbox call')
+    parser.add_argument('--flush-interval', type=float, default=1.0, help='seconds matched path waits for its batch')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions of parse and match benchmarks')
+    parser.add_argument('--seed', type=int, default=0, help='seed of generated tree and rules')
+    parser.add_argument('--output', help='file receiving JSON results (default: standard output)')
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = parse_arguments(sys.argv[1:])
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -28,14 +28,32 @@ dropboxignore
 @contact: michal.p.karol@gmail.com
 """
 
-from typing import List, Pattern, NamedTuple
+__version__ = '0.2.0'
 
+from typing import (Any, AsyncIterator, Callable, Deque, Dict, Iterable, Iterator, List, Match, Optional, Pattern,
+                    NamedTuple, Set, Tuple, TYPE_CHECKING)
+
+import abc
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import json
 import os
 import os.path as p
 import pyinotify
 import re
+import socket
 import subprocess
 import sys
+import threading
+import time
+from queue import Queue
+from stat import S_ISDIR
+
+if TYPE_CHECKING:
+    import http.server
 
 
 class RETURN_CODES(object):
@@ -46,47 +64,1258 @@ class RETURN_CODES(object):
     CANNOT_WATCH_PATH = 5
     PARSING_ERROR = 6
     SCANNING_ERROR = 7
+    CANNOT_SERVE_METRICS = 8
+    CHECK_USAGE_ERROR = 128  # `dropboxignore check` uses 0 and 1 for verdicts, like git check-ignore
 
 
 class ParsingException(Exception):
     pass
 
 
+class BackendException(Exception):
+    pass
+
+
+WATCHED_EVENTS = pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM
+DROPBOXIGNORE_EVENTS = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_DELETE_SELF
+# Start of regex of rules matching at any depth
+FLOATING_PREFIX = r'(?:^|.*\/)'
+
+
+class ArgumentParser(argparse.ArgumentParser):
+    """Argument parser exiting with dropboxignore return code on wrong arguments"""
+
+    def __init__(self, *args, error_code: int = RETURN_CODES.WRONG_NUMBER_OF_ARGS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.error_code = error_code
+
+    def error(self, message):
+        print(f'USAGE: {self.format_usage().strip()[len("usage: "):]}')
+        print(message)
+        sys.exit(self.error_code)
+
+
+class Metrics(object):
+    """Registry of counters, gauges and histograms rendered in Prometheus text format
+
+    Gauges can be given as functions, so values like queue depth are read only when metrics are rendered.
+    """
+
+    def __init__(self, described: Dict[str, Tuple[str, str, Tuple[float, ...]]]):
+        """
+        :param described: type, help and histogram buckets of every metric by its name
+        :type described: Dict[str, Tuple[str, str, Tuple[float, ...]]]
+        """
+        self.described = described
+        self._values: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = collections.defaultdict(dict)
+        self._functions: Dict[str, Dict[Tuple[Tuple[str, str], ...], Callable[[], float]]] = \
+            collections.defaultdict(dict)
+        self._histograms: Dict[str, Dict[Tuple[Tuple[str, str], ...], List[float]]] = collections.defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+            self._functions.clear()
+            self._histograms.clear()
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._values[name]
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[name][tuple(sorted(labels.items()))] = value
+
+    def set_function(self, name: str, function: Callable[[], float], **labels: str) -> None:
+        """Report value returned by function as gauge name"""
+        with self._lock:
+            self._functions[name][tuple(sorted(labels.items()))] = function
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        buckets = self.described[name][2]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # Counts of buckets followed by sum and count of observations
+            histogram = self._histograms[name].get(key)
+            if histogram is None:
+                histogram = self._histograms[name][key] = [0] * len(buckets) + [0.0, 0]
+            for position, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[position] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def value(self, name: str, **labels: str) -> Optional[float]:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            function = self._functions[name].get(key)
+            return function() if function is not None else self._values[name].get(key)
+
+    @staticmethod
+    def format_labels(key: Tuple[Tuple[str, str], ...], *extra: Tuple[str, str]) -> str:
+        labels = key + extra
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+    def render(self) -> str:
+        with self._lock:
+            values = {name: dict(series) for name, series in self._values.items()}
+            functions = {name: dict(series) for name, series in self._functions.items()}
+            histograms = {name: {key: list(histogram) for key, histogram in series.items()}
+                          for name, series in self._histograms.items()}
+
+        lines = []
+        for name, (kind, description, buckets) in sorted(self.described.items()):
+            series = dict(values.get(name, {}))
+            for key, function in functions.get(name, {}).items():
+                try:
+                    series[key] = function()
+                except Exception:
+                    continue
+            if not series and not histograms.get(name):
+                continue
+
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(series.items()):
+                lines.append(f'{name}{self.format_labels(key)} {value}')
+            for key, histogram in sorted(histograms.get(name, {}).items()):
+                for bound, count in zip(buckets, histogram):
+                    lines.append(f'{name}_bucket{self.format_labels(key, ("le", str(bound)))} {count}')
+                lines.append(f'{name}_bucket{self.format_labels(key, ("le", "+Inf"))} {histogram[-1]}')
+                lines.append(f'{name}_sum{self.format_labels(key)} {histogram[-2]}')
+                lines.append(f'{name}_count{self.format_labels(key)} {histogram[-1]}')
+        return ''.join(f'{line}\n' for line in lines)
+
+
+MATCH_BUCKETS = (0.000001, 0.00001, 0.0001, 0.001, 0.01, 0.1)
+EXCLUSION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+RECOVERY_BUCKETS = (0.1, 1.0, 10.0, 60.0, 600.0)
+METRICS = Metrics({
+    'dropboxignore_events_total': ('counter', 'Inotify events received by type', ()),
+    'dropboxignore_events_dropped_total': ('counter', 'Events dropped before matching by reason', ()),
+    'dropboxignore_match_seconds': ('histogram', 'Time of matching one path against rules', MATCH_BUCKETS),
+    'dropboxignore_exclusion_seconds': ('histogram', 'Time of one call of Dropbox by command', EXCLUSION_BUCKETS),
+    'dropboxignore_exclusion_calls_total': ('counter', 'Calls of Dropbox by command and result', ()),
+    'dropboxignore_exclusion_queue_depth': ('gauge', 'Matched paths waiting for their batch', ()),
+    'dropboxignore_worker_queue_depth': ('gauge', 'Exclusions waiting for worker threads', ()),
+    'dropboxignore_watched_directories': ('gauge', 'Inotify watches', ()),
+    'dropboxignore_scan_directories': ('gauge', 'Directories checked by the initial scan', ()),
+    'dropboxignore_scan_ignored': ('gauge', 'Ignored directories found by the initial scan', ()),
+    'dropboxignore_scan_seconds': ('gauge', 'Duration of the initial scan', ()),
+    'dropboxignore_scan_running': ('gauge', '1 while the initial scan runs', ()),
+    'dropboxignore_overflows_total': ('counter', 'Overflows of inotify event queue', ()),
+    'dropboxignore_sweep_directories_total': ('counter', 'Directories visited by background sweeps', ()),
+    'dropboxignore_sweep_ignored_total': ('counter', 'Ignored directories found by background sweeps', ()),
+    'dropboxignore_sweep_passes_total': ('counter', 'Finished passes of background sweep', ()),
+    'dropboxignore_overflow_recovery_seconds': ('histogram', 'Time of scans recovering lost events after overflow',
+                                                RECOVERY_BUCKETS),
+})
+
+
+def serve_metrics(port: int, host: str = '127.0.0.1') -> 'http.server.HTTPServer':
+    """Serve metrics in Prometheus text format from a daemon thread"""
+    # Imported only when metrics are served, http.server is slow to import
+    import http.server
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        """HTTP handler serving METRICS on any path"""
+
+        def do_GET(self):
+            body = METRICS.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.HTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='dropboxignore-metrics', daemon=True).start()
+    return server
+
+
+def write_stats(stats_path: str, interval: float, stop: threading.Event) -> threading.Thread:
+    """Write metrics to stats_path every interval seconds from a daemon thread, last time when stop is set"""
+    def dump() -> None:
+        temporary_path = f'{stats_path}.tmp'
+        try:
+            with open(temporary_path, 'w') as stats_file:
+                stats_file.write(METRICS.render())
+            os.replace(temporary_path, stats_path)
+        except OSError as err:
+            print(f'Cannot write stats file: {err}')
+
+    def write() -> None:
+        dump()
+        while not stop.wait(interval):
+            dump()
+        dump()
+
+    thread = threading.Thread(target=write, name='dropboxignore-stats', daemon=True)
+    thread.start()
+    return thread
+
+
+class LazyPattern(object):
+    """Regex of one rule compiled on its first match, matchers combining rules into one regex read only its pattern"""
+    __slots__ = ('pattern', '_compiled')
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self._compiled: Optional[Pattern[str]] = None
+
+    def compiled(self) -> Pattern[str]:
+        if self._compiled is None:
+            self._compiled = re.compile(self.pattern)
+        return self._compiled
+
+    def match(self, string: str, *args) -> Optional[Match[str]]:
+        return self.compiled().match(string, *args)
+
+    def search(self, string: str, *args) -> Optional[Match[str]]:
+        return self.compiled().search(string, *args)
+
+    def fullmatch(self, string: str, *args) -> Optional[Match[str]]:
+        return self.compiled().fullmatch(string, *args)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, LazyPattern) and other.pattern == self.pattern
+
+    def __hash__(self) -> int:
+        return hash(self.pattern)
+
+    def __repr__(self) -> str:
+        return f'LazyPattern({self.pattern!r})'
+
+
 # Typedefing
-Rules = NamedTuple('Rules', [('ignored', List[Pattern[str]]), ('excluded', List[Pattern[str]])])
+class Rule(NamedTuple):
+    source: str  # Line as written in .dropboxignore
+    lineno: int
+    glob: str  # Pattern with negation and escapes resolved
+    negated: bool
+    literal: Optional[str]  # Set for rules matching a single path component by name
+    regex: LazyPattern
+
+
+class Rules(NamedTuple):
+    ignored: List[LazyPattern]
+    excluded: List[LazyPattern]
+    entries: Tuple[Rule, ...] = ()
+    matcher: Optional['Matcher'] = None
+
+
+class ExclusionBackend(abc.ABC):
+    """Selective sync of Dropbox: listing, adding and removing excluded paths of one Dropbox directory"""
+
+    def __init__(self, dropbox_path: str, home: Optional[str] = None):
+        """
+        :param home: home directory of Dropbox daemon of dropbox_path, current one if not given
+        :type home: Optional[str]
+        """
+        self.dropbox_path = dropbox_path
+        self.home = home
+
+    def command_options(self) -> Dict[str, Any]:
+        """Return keyword arguments of subprocess calls running `dropbox` command for dropbox_path"""
+        options: Dict[str, Any] = {'cwd': self.dropbox_path}
+        if self.home is not None:
+            options['env'] = dict(os.environ, HOME=self.home)
+        return options
+
+    @abc.abstractmethod
+    def list(self) -> List[str]:
+        """Return excluded paths relative to dropbox_path"""
+
+    @abc.abstractmethod
+    def add(self, paths: List[str]) -> bool:
+        """Exclude absolute paths, return False if Dropbox refused them"""
+
+    @abc.abstractmethod
+    def remove(self, paths: List[str]) -> bool:
+        """Bring back absolute paths, return False if Dropbox refused them"""
+
+    def close(self) -> None:
+        pass
+
+
+class CliBackend(ExclusionBackend):
+    """Backend running `dropbox exclude` command for every request
+
+    Command runs in dropbox_path, so paths relative to the current directory are made absolute first.
+    """
+
+    def list(self) -> List[str]:
+        already_excluded = subprocess.check_output(['dropbox', 'exclude', 'list'],
+                                                   **self.command_options()).decode("utf-8")
+        return already_excluded.split('\n')[1:-1]
+
+    def add(self, paths: List[str]) -> bool:
+        return subprocess.call(['dropbox', 'exclude', 'add'] + [p.abspath(path) for path in paths],
+                               **self.command_options()) == 0
+
+    def remove(self, paths: List[str]) -> bool:
+        return subprocess.call(['dropbox', 'exclude', 'remove'] + [p.abspath(path) for path in paths],
+                               **self.command_options()) == 0
+
+
+class CommandSocketBackend(ExclusionBackend):
+    """Backend sending requests over one persistent connection to the command socket of the Dropbox daemon
+
+    The socket speaks the protocol of the `dropbox` CLI: a command name line, argument lines of tab separated values
+    and "done", answered by "ok" or "notok", result lines and "done". Broken connection is opened again once.
+    """
+
+    def __init__(self, dropbox_path: str, socket_path: Optional[str] = None, timeout: float = 10.0,
+                 home: Optional[str] = None):
+        """
+        :param socket_path: path of command socket (default: ~/.dropbox/command_socket)
+        :type socket_path: Optional[str]
+        :param timeout: seconds to wait for the daemon
+        :type timeout: float
+        """
+        super().__init__(dropbox_path, home)
+        self.socket_path = socket_path or p.join(home or p.expanduser('~'), '.dropbox', 'command_socket')
+        self.timeout = timeout
+        self._socket: Optional[socket.socket] = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def connect(self) -> None:
+        command_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        command_socket.settimeout(self.timeout)
+        try:
+            command_socket.connect(self.socket_path)
+        except OSError:
+            command_socket.close()
+            raise
+        self._socket, self._file = command_socket, command_socket.makefile('rwb')
+
+    def close(self) -> None:
+        with self._lock:
+            self._disconnect()
+
+    def _disconnect(self) -> None:
+        if self._socket is not None:
+            try:
+                self._file.close()
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = self._file = None
+
+    def _send(self, command: str, arguments: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        if self._socket is None:
+            self.connect()
+        request = [command] + ['\t'.join([key] + values) for key, values in arguments.items()] + ['done']
+        self._file.write(''.join(f'{line}\n' for line in request).encode('utf-8'))
+        self._file.flush()
+
+        status = self._file.readline().decode('utf-8').rstrip('\n')
+        if not status:
+            raise ConnectionResetError('Dropbox closed command socket')
+        result: Dict[str, List[str]] = {}
+        for line in iter(self._file.readline, b''):
+            line = line.decode('utf-8').rstrip('\n')
+            if line == 'done':
+                break
+            key, *values = line.split('\t')
+            result[key] = values
+        else:
+            raise ConnectionResetError('Dropbox closed command socket')
+
+        if status != 'ok':
+            raise BackendException(f'Dropbox refused {command}: {result}')
+        return result
+
+    def command(self, command: str, **arguments: List[str]) -> Dict[str, List[str]]:
+        """Send command and return its result, reconnecting once if the connection was broken"""
+        with self._lock:
+            try:
+                return self._send(command, arguments)
+            except BackendException:
+                raise
+            except OSError:
+                self._disconnect()
+            try:
+                return self._send(command, arguments)
+            except OSError as err:
+                self._disconnect()
+                raise BackendException(f'Cannot talk to Dropbox at {self.socket_path}: {err}')
+
+    def list(self) -> List[str]:
+        return [p.relpath(path, self.dropbox_path) for path in self.command('get_ignore_set').get('ignore_set', [])]
+
+    def add(self, paths: List[str]) -> bool:
+        try:
+            self.command('ignore_set_add', paths=paths)
+        except BackendException as err:
+            print(err)
+            return False
+        return True
+
+    def remove(self, paths: List[str]) -> bool:
+        try:
+            self.command('ignore_set_remove', paths=paths)
+        except BackendException as err:
+            print(err)
+            return False
+        return True
+
+
+class FakeBackend(ExclusionBackend):
+    """In-process backend keeping excluded paths in a set, for tests and benchmarks"""
+
+    def __init__(self, dropbox_path: str, excluded: Iterable[str] = (), latency: float = 0.0):
+        super().__init__(dropbox_path)
+        self.excluded: Set[str] = set(excluded)
+        self.latency = latency
+        self.calls: List[Tuple[str, List[str]]] = []
+
+    def request(self, command: str, paths: List[str]) -> None:
+        self.calls.append((command, paths))
+        if self.latency:
+            time.sleep(self.latency)
+
+    def list(self) -> List[str]:
+        self.request('list', [])
+        return sorted(self.excluded)
+
+    def add(self, paths: List[str]) -> bool:
+        self.request('add', paths)
+        self.excluded.update(p.relpath(path, self.dropbox_path) for path in paths)
+        return True
+
+    def remove(self, paths: List[str]) -> bool:
+        self.request('remove', paths)
+        self.excluded.difference_update(p.relpath(path, self.dropbox_path) for path in paths)
+        return True
+
+
+BACKENDS = {
+    'cli': CliBackend,
+    'socket': CommandSocketBackend,
+}
+
+
+class ExclusionIndex(object):
+    """In-memory copy of `dropbox exclude list` stored as a tree of lowercased path components"""
+
+    LEAF = None  # Key under which a node stores the excluded path as listed by Dropbox
+
+    def __init__(self, dropbox_path: str, max_age: float = 300.0, backend: Optional[ExclusionBackend] = None):
+        """
+        :param dropbox_path: path synchronized by dropbox
+        :type dropbox_path: str
+        :param max_age: seconds after which the index is reloaded from Dropbox
+        :type max_age: float
+        :param backend: backend talking to Dropbox, used also for exclusions of paths of this index
+        :type backend: Optional[ExclusionBackend]
+        """
+        self.dropbox_path = dropbox_path
+        self.max_age = max_age
+        self.backend = backend if backend is not None else CliBackend(dropbox_path)
+        self._tree: Dict = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.RLock()
+
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+
+    def refresh(self) -> None:
+        with self._lock:
+            self.replace(self.backend.list())
+
+    def load(self, already_excluded: str) -> None:
+        """Replace index by output of `dropbox exclude list`"""
+        self.replace(already_excluded.split('\n')[1:-1])
+
+    def replace(self, already_excluded_paths: List[str]) -> None:
+        """Replace index by excluded paths"""
+        tree: Dict = {}
+        for already_excluded_path in already_excluded_paths:
+            self._insert(already_excluded_path, tree)
+        self._tree = tree
+        self._loaded_at = time.monotonic()
+
+    def _insert(self, excluded_path: str, tree: Optional[Dict] = None) -> None:
+        node = self._tree if tree is None else tree
+        for component in excluded_path.lower().split(p.sep):
+            node = node.setdefault(component, {})
+        node[self.LEAF] = excluded_path
+
+    def add(self, excluded_path: str) -> None:
+        """Record path excluded by a successful `dropbox exclude add`"""
+        with self._lock:
+            if self.is_stale():
+                self.refresh()
+            else:
+                self._insert(excluded_path)
+
+    def remove(self, excluded_path: str) -> None:
+        """Forget path after a successful `dropbox exclude remove`"""
+        with self._lock:
+            node = self._tree
+            for component in excluded_path.lower().split(p.sep):
+                node = node.get(component)
+                if node is None:
+                    return
+            node.pop(self.LEAF, None)
+
+    def paths(self) -> List[str]:
+        """Return all excluded paths as listed by Dropbox"""
+        with self._lock:
+            if self.is_stale():
+                self.refresh()
+            paths, stack = [], [self._tree]
+            while stack:
+                node = stack.pop()
+                for component, child in node.items():
+                    if component is self.LEAF:
+                        paths.append(child)
+                    else:
+                        stack.append(child)
+        return paths
+
+    def find(self, path: str) -> Optional[str]:
+        """Return excluded path covering path (path itself or one of its ancestors)
+
+        :param path: path relative to dropbox_path
+        :type path: str
+        :return: excluded path as listed by Dropbox or None
+        :rtype: Optional[str]
+        """
+        if self.is_stale():
+            with self._lock:
+                if self.is_stale():
+                    self.refresh()
+
+        node = self._tree
+        for component in path.lower().split(p.sep):
+            node = node.get(component)
+            if node is None:
+                return None
+            if self.LEAF in node:
+                return node[self.LEAF]
+        return None
+
+
+def is_subpath(path: str, ancestor: str) -> bool:
+    """Case-insensitive test if path is equal to ancestor or lies inside it"""
+    path, ancestor = path.lower(), ancestor.lower()
+    return path == ancestor or path.startswith(f'{ancestor}{p.sep}')
+
+
+def call_backend(request: Callable[[List[str]], bool], command: str, paths: List[str]) -> bool:
+    """Call request of backend with paths, observing its duration and result"""
+    start = time.perf_counter()
+    succeeded = request(paths)
+    METRICS.observe('dropboxignore_exclusion_seconds', time.perf_counter() - start, command=command)
+    METRICS.inc('dropboxignore_exclusion_calls_total', command=command, result='ok' if succeeded else 'failed')
+    return succeeded
+
+
+def dropbox_exclude_add(ignore_paths: List[str], dropbox_path: str, index: ExclusionIndex) -> None:
+    """Exclude all paths with a single `dropbox exclude add` call"""
+    absolute_ignore_paths = [p.join(dropbox_path, ignore_path) for ignore_path in ignore_paths]
+    for absolute_ignore_path in absolute_ignore_paths:
+        print(f'Path {absolute_ignore_path} excluded')
+
+    if call_backend(index.backend.add, 'add', absolute_ignore_paths):
+        for ignore_path in ignore_paths:
+            index.add(ignore_path)
+    else:
+        index.invalidate()
+
 
+def dropbox_exclude_remove(excluded_paths: List[str], dropbox_path: str, index: ExclusionIndex) -> None:
+    """Bring back excluded paths with a single `dropbox exclude remove` call"""
+    absolute_excluded_paths = [p.join(dropbox_path, excluded_path) for excluded_path in excluded_paths]
+    for absolute_excluded_path in absolute_excluded_paths:
+        print(f'Path {absolute_excluded_path} no longer excluded')
 
-def dropbox_exclude(ignore_path: str, dropbox_path: str):
-    already_excluded = subprocess.check_output(['dropbox', 'exclude', 'list'], cwd=dropbox_path).decode("utf-8")
-    already_excluded_list = already_excluded.split('\n')[1:-1]
+    if call_backend(index.backend.remove, 'remove', absolute_excluded_paths):
+        for excluded_path in excluded_paths:
+            index.remove(excluded_path)
+    else:
+        index.invalidate()
 
-    for already_exclued_path in already_excluded_list:
-        if ignore_path.lower() == already_exclued_path or ignore_path.lower().startswith(f'{already_exclued_path}{p.sep}'):
-            print(f'Path {ignore_path} already excluded by {already_exclued_path}')
+
+class ExclusionQueue(object):
+    """Queue of paths waiting to be excluded, flushed as one `dropbox exclude add` call
+
+    Queue is flushed when it holds flush_size paths or flush_interval seconds after the first path was queued,
+    whichever comes first. Paths lying inside an already queued path are dropped.
+    """
+
+    def __init__(self, dropbox_path: str, index: ExclusionIndex, flush_size: int = 100, flush_interval: float = 1.0):
+        self.dropbox_path = dropbox_path
+        self.index = index
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending: List[str] = []
+        self._lock = threading.RLock()
+        self._timer: Optional[threading.Timer] = None
+        METRICS.set_function('dropboxignore_exclusion_queue_depth', self.__len__, root=dropbox_path)
+
+    def find(self, path: str) -> Optional[str]:
+        """Return queued path covering path (path itself or one of its ancestors)"""
+        with self._lock:
+            for queued_path in self._pending:
+                if is_subpath(path, queued_path):
+                    return queued_path
+        return None
+
+    def put(self, ignore_path: str) -> None:
+        with self._lock:
+            queued_path = self.find(ignore_path)
+            if queued_path is not None:
+                print(f'Path {ignore_path} already excluded by {queued_path}')
+                return
+
+            self._pending = [queued_path for queued_path in self._pending if not is_subpath(queued_path, ignore_path)]
+            self._pending.append(ignore_path)
+
+            if len(self._pending) >= self.flush_size:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            ignore_paths, self._pending = self._pending, []
+            if ignore_paths:
+                dropbox_exclude_add(ignore_paths, self.dropbox_path, self.index)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+
+def exclusion_index(index: Optional[ExclusionIndex], queue: Optional[ExclusionQueue]) -> Optional[ExclusionIndex]:
+    """Return index of excluded paths given directly or the one of the queue, None without both"""
+    if index is not None:
+        return index
+    return queue.index if queue is not None else None
+
+
+def dropbox_exclude(ignore_path: str, dropbox_path: str, index: Optional[ExclusionIndex] = None,
+                    queue: Optional[ExclusionQueue] = None):
+    index = exclusion_index(index, queue)
+    if index is None:
+        index = ExclusionIndex(dropbox_path)
+
+    already_excluded_path = index.find(ignore_path)
+    if already_excluded_path is not None:
+        print(f'Path {ignore_path} already excluded by {already_excluded_path}')
+        return
+
+    if queue is not None:
+        queue.put(ignore_path)
+    else:
+        dropbox_exclude_add([ignore_path], dropbox_path, index)
+
+
+class ExclusionWorkers(object):
+    """Pool of threads running exclusions submitted through a bounded queue
+
+    Submitting blocks while the queue is full, which keeps the notifier from reading more events than the pool can
+    handle. The deepest queue seen is kept in high_water.
+    """
+
+    def __init__(self, workers: int = 2, maxsize: int = 1000):
+        self.jobs: Queue = Queue(maxsize)
+        self.high_water = 0
+        self.blocked = 0
+        self.threads = [threading.Thread(target=self._run, name=f'dropboxignore-worker-{number}', daemon=True)
+                        for number in range(workers)]
+        METRICS.set_function('dropboxignore_worker_queue_depth', self.jobs.qsize)
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, function: Callable, *args) -> None:
+        if self.jobs.full():
+            self.blocked += 1
+        self.jobs.put((function, args))
+        self.high_water = max(self.high_water, self.jobs.qsize())
+
+    def _run(self) -> None:
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                function, args = job
+                function(*args)
+            except Exception as err:
+                print(f'Exception during excluding path: {err}')
+            finally:
+                self.jobs.task_done()
+
+    def join(self) -> None:
+        """Wait until all submitted jobs are done"""
+        self.jobs.join()
+
+    def close(self) -> None:
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class Matcher(abc.ABC):
+    """Base of matching engines built from parsed rules"""
+
+    @abc.abstractmethod
+    def verdict(self, path: str) -> Optional[bool]:
+        """Return False if negated rule matches path, True if other rule matches it and None if no rule matches"""
+
+    def test(self, path: str) -> bool:
+        """Test if path relative to the root of rules is ignored and not excluded by negated rule"""
+        return self.verdict(path) is True
+
+
+class RegexMatcher(Matcher):
+    """Matcher checking literal rules by a set lookup per path component and glob rules by one combined regex"""
+
+    def __init__(self, entries: Tuple[Rule, ...]):
+        self.literal_ignored: Set[str] = set()
+        self.literal_excluded: Set[str] = set()
+        glob_ignored: List[LazyPattern] = []
+        glob_excluded: List[LazyPattern] = []
+
+        for rule in entries:
+            if rule.literal is not None:
+                (self.literal_excluded if rule.negated else self.literal_ignored).add(rule.literal)
+            else:
+                (glob_excluded if rule.negated else glob_ignored).append(rule.regex)
+
+        self.glob_ignored = self.combine(glob_ignored)
+        self.glob_excluded = self.combine(glob_excluded)
+
+    @staticmethod
+    def combine(regexes: List[LazyPattern]) -> Optional[Pattern[str]]:
+        if not regexes:
+            return None
+        # Prefix shared by floating rules is matched once instead of once per rule
+        floating = [regex.pattern[len(FLOATING_PREFIX):] for regex in regexes
+                    if regex.pattern.startswith(FLOATING_PREFIX)]
+        alternatives = [f'(?:{regex.pattern})' for regex in regexes if not regex.pattern.startswith(FLOATING_PREFIX)]
+        if floating:
+            alternatives.insert(0, FLOATING_PREFIX + '(?:' + r'|'.join(f'(?:{pattern})' for pattern in floating) + ')')
+        return re.compile(r'|'.join(alternatives))
+
+    @staticmethod
+    def match(path: str, components: List[str], literals: Set[str], combined: Optional[Pattern[str]]) -> bool:
+        if literals and not literals.isdisjoint(components):
+            return True
+        return combined is not None and combined.match(path) is not None
+
+    def verdict(self, path: str) -> Optional[bool]:
+        components = path.split('/')
+        if self.match(path, components, self.literal_excluded, self.glob_excluded):
+            return False
+        return True if self.match(path, components, self.literal_ignored, self.glob_ignored) else None
+
+
+class TrieNode(object):
+    __slots__ = ('literals', 'suffixes', 'globs', 'glob_alternations', 'double_star', 'loop', 'ignored', 'excluded')
+
+    def __init__(self, loop: bool = False):
+        self.literals: Dict[str, 'TrieNode'] = {}
+        self.suffixes: Dict[str, 'TrieNode'] = {}  # Segments "*suffix" by their literal suffix
+        self.globs: List[Tuple[Pattern[str], 'TrieNode']] = []
+        # Globs from index combined into one regex, group N matches globs[index + N - 1]
+        self.glob_alternations: Dict[int, Pattern[str]] = {}
+        self.double_star: Optional['TrieNode'] = None  # Node entered by "**" without consuming component
+        self.loop = loop  # Node consuming any number of components ("**")
+        self.ignored = False
+        self.excluded = False
+
+
+class TrieMatcher(Matcher):
+    """Matcher walking path components once against a trie of rules split into segment matchers
+
+    Every component is matched against the set of active trie nodes, which is bounded by the size of the trie,
+    so matching time is linear in the path length and does not depend on the number of literal rules. Segments
+    like "*.log" are looked up by suffix of the component, other glob segments of one node are tried by a single
+    combined regex, which is repeated after the first matching segment only.
+    """
+
+    def __init__(self, entries: Tuple[Rule, ...]):
+        self.anchored = TrieNode()
+        self.floating = TrieNode()
+        self.has_floating = False
+
+        for rule in entries:
+            self.add(rule)
+        self.combine(self.anchored)
+        self.combine(self.floating)
+
+    @staticmethod
+    def prepare_segment(segment: str):
+        """Return segment as literal string or regex matching one path component"""
+        if not re.search(r'[\\*?\[]', segment):
+            return segment
+
+        regex = []
+        position = 0
+        while position < len(segment):
+            char = segment[position]
+            if char == '\\' and position + 1 < len(segment):
+                position += 1
+                regex.append(re.escape(segment[position]))
+            elif char == '*':
+                while position + 1 < len(segment) and segment[position + 1] == '*':
+                    position += 1
+                regex.append(r'[^/]*')
+            elif char == '?':
+                regex.append(r'[^/]')
+            elif char == '[' and ']' in segment[position + 2:]:
+                end = segment.index(']', position + 2)
+                chars = segment[position + 1:end]
+                if chars.startswith('!'):
+                    chars = f'^{chars[1:]}'
+                regex.append(f'[{chars}]')
+                position = end
+            else:
+                regex.append(re.escape(char))
+            position += 1
+        return re.compile(r''.join(regex))
+
+    def add(self, rule: Rule) -> None:
+        glob = re.sub(r'(?<!\\)\s+$', '', rule.glob)
+        glob = glob.rstrip('/')
+        if not glob:
             return
 
-    absolute_ignore_path = p.join(dropbox_path, ignore_path)
-    print(f'Path {absolute_ignore_path} excluded')
-    subprocess.call(f'dropbox exclude add \'{absolute_ignore_path}\'', shell=True)
+        # A pattern containing a slash is matched relative to the root, otherwise it matches at any depth
+        anchored = '/' in glob
+        node = self.anchored if anchored else self.floating
+        self.has_floating = self.has_floating or not anchored
+
+        for segment in glob.lstrip('/').split('/'):
+            if segment == '**':
+                if node.double_star is None:
+                    node.double_star = TrieNode(loop=True)
+                node = node.double_star
+                continue
+
+            suffix = segment.lstrip('*')
+            if suffix != segment and not re.search(r'[\\*?\[]', suffix):
+                node = node.suffixes.setdefault(suffix, TrieNode())
+                continue
+
+            prepared = self.prepare_segment(segment)
+            if isinstance(prepared, str):
+                node = node.literals.setdefault(prepared, TrieNode())
+            else:
+                for pattern, child in node.globs:
+                    if pattern.pattern == prepared.pattern:
+                        node = child
+                        break
+                else:
+                    child = TrieNode()
+                    node.globs.append((prepared, child))
+                    node = child
+
+        if rule.negated:
+            node.excluded = True
+        else:
+            node.ignored = True
 
+    @staticmethod
+    def alternation(node: TrieNode, start: int) -> Pattern[str]:
+        """Return glob segments of node from index start compiled into one alternation with a group per segment"""
+        alternation = node.glob_alternations.get(start)
+        if alternation is None:
+            alternation = re.compile(r'|'.join(f'({pattern.pattern})' for pattern, _ in node.globs[start:]))
+            node.glob_alternations[start] = alternation
+        return alternation
 
-def parse_dropboxignore(dropboxignore: List[str]) -> Rules:
-    rules: Rules = Rules([], [])
+    @classmethod
+    def combine(cls, root: TrieNode) -> None:
+        """Compile alternation of all glob segments of every node"""
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node.globs:
+                cls.alternation(node, 0)
+            stack.extend(node.literals.values())
+            stack.extend(node.suffixes.values())
+            stack.extend(child for _, child in node.globs)
+            if node.double_star is not None:
+                stack.append(node.double_star)
+
+    @staticmethod
+    def closure(nodes: List[TrieNode]) -> List[TrieNode]:
+        """Add nodes reachable through "**" matching zero components"""
+        result = []
+        seen = set()
+        stack = list(nodes)
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            result.append(node)
+            if node.double_star is not None:
+                stack.append(node.double_star)
+        return result
+
+    def verdict(self, path: str) -> Optional[bool]:
+        ignored = excluded = False
+        active = self.closure([self.anchored])
+        floating = self.closure([self.floating]) if self.has_floating else []
+
+        # Rule matching a directory matches everything inside, so verdict is collected after every component
+        for component in path.split('/'):
+            following = []
+            for node in active + floating:
+                if node.loop:
+                    following.append(node)
+                child = node.literals.get(component)
+                if child is not None:
+                    following.append(child)
+                if node.suffixes:
+                    for index in range(len(component) + 1):
+                        child = node.suffixes.get(component[index:])
+                        if child is not None:
+                            following.append(child)
+                # Alternatives are tried in order, so globs before the first matching group do not match
+                start = 0
+                while start < len(node.globs):
+                    match = self.alternation(node, start).fullmatch(component)
+                    if match is None:
+                        break
+                    start += match.lastindex
+                    following.append(node.globs[start - 1][1])
+
+            active = self.closure(following)
+            for node in active:
+                ignored = ignored or node.ignored
+                excluded = excluded or node.excluded
+            if excluded or (not active and not floating):
+                break
+
+        if excluded:
+            return False
+        return True if ignored else None
+
+
+class RuleStats(object):
+    __slots__ = ('evaluations', 'hits', 'total', 'maximum')
+
+    def __init__(self):
+        self.evaluations = 0
+        self.hits = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+
+class ProfilingMatcher(Matcher):
+    """Matcher evaluating every rule separately by its own matcher of engine and recording cost and hits of each
+
+    All rules are evaluated for every path, so rules which never match are found as well. Verdicts are the same
+    as verdicts of the engine, matching is slower.
+    """
+
+    def __init__(self, entries: Tuple[Rule, ...], engine: str = 'regex'):
+        self.engine = engine
+        self.profiles: List[Tuple[Rule, Matcher, RuleStats]] = [
+            (rule, ENGINES[engine]((rule,)), RuleStats()) for rule in entries]
+        self._lock = threading.Lock()
+
+    def verdict(self, path: str) -> Optional[bool]:
+        ignored = excluded = False
+        timings = []
+        for rule, matcher, _ in self.profiles:
+            start = time.perf_counter()
+            verdict = matcher.verdict(path)
+            timings.append((time.perf_counter() - start, verdict is not None))
+            if verdict is not None:
+                excluded = excluded or rule.negated
+                ignored = ignored or not rule.negated
+
+        with self._lock:
+            for (_, _, stats), (elapsed, hit) in zip(self.profiles, timings):
+                stats.evaluations += 1
+                stats.hits += hit
+                stats.total += elapsed
+                stats.maximum = max(stats.maximum, elapsed)
+
+        if excluded:
+            return False
+        return True if ignored else None
+
+
+class RuleLayers(Matcher):
+    """Matcher applying rules of .dropboxignore files in subdirectories on top of rules of the root one
+
+    Like .gitignore, rules of a nested file are matched against paths relative to its directory and apply only
+    inside it. The deepest file with a rule matching the path decides. Layers are read and compiled lazily when
+    a path inside their directory is tested first and stay cached until their file changes. Directories without
+    .dropboxignore are remembered only up to max_missing, the oldest are forgotten and read again when needed.
+    """
+
+    def __init__(self, dropbox_path: str, rules: Rules, engine: str = 'regex', profile: bool = False,
+                 cache: Optional['RuleCache'] = None, max_missing: int = 10000):
+        """
+        :param dropbox_path: directory of the root .dropboxignore
+        :type dropbox_path: str
+        :param rules: rules of the root .dropboxignore
+        :type rules: Rules
+        :param engine: engine compiling nested .dropboxignore files
+        :type engine: str
+        :param profile: profile rules of nested .dropboxignore files
+        :type profile: bool
+        :param cache: cache of parsed nested .dropboxignore files
+        :type cache: Optional[RuleCache]
+        :param max_missing: number of remembered directories without .dropboxignore
+        :type max_missing: int
+        """
+        self.dropbox_path = dropbox_path
+        self.engine = engine
+        self.profile = profile
+        self.cache = cache
+        self.max_missing = max_missing
+        self.on_layer: Optional[Callable[[str], None]] = None  # Called with directory of every nested file read
+        self._layers: Dict[str, Rules] = {'': rules}
+        # Directories without .dropboxignore in order of reading, bounded so memory does not grow with the tree
+        self._missing: 'collections.OrderedDict[str, None]' = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def layer(self, relpath: str) -> Optional[Rules]:
+        """Return rules of .dropboxignore in directory relpath, reading it when it was not read yet"""
+        rules = self._layers.get(relpath)
+        if rules is not None or relpath in self._missing:
+            return rules
+
+        with self._lock:
+            if relpath in self._missing:
+                return None
+            if relpath in self._layers:
+                return self._layers[relpath]
+            try:
+                rules = parse_dropboxignore(read_dropboxignore(p.join(self.dropbox_path, relpath, '.dropboxignore')),
+                                            self.engine, profile=self.profile, cache=self.cache)
+            except (FileNotFoundError, NotADirectoryError):
+                rules = None
+            except (OSError, ParsingException) as err:
+                print(f'Cannot read {p.join(relpath, ".dropboxignore")}: {err}')
+                rules = None
+            if rules is not None:
+                self._layers[relpath] = rules
+            else:
+                self._missing[relpath] = None
+                if len(self._missing) > self.max_missing:
+                    self._missing.popitem(last=False)
+
+        if rules is not None and self.on_layer is not None:
+            self.on_layer(relpath)
+        return rules
+
+    def layers(self) -> List[str]:
+        """Return directories of nested .dropboxignore files read so far"""
+        return [relpath for relpath in list(self._layers) if relpath]
+
+    def replaced(self, relpath: str, rules: Optional[Rules] = None) -> 'RuleLayers':
+        """Return copy of layers with rules of directory relpath replaced, or read again when rules are not given"""
+        layers = RuleLayers(self.dropbox_path, self._layers[''], self.engine, self.profile, self.cache,
+                            self.max_missing)
+        layers.on_layer = self.on_layer
+        with self._lock:
+            layers._layers.update(self._layers)
+            layers._missing.update(self._missing)
+        layers._missing.pop(relpath, None)
+        if rules is None and relpath:
+            layers._layers.pop(relpath, None)
+        else:
+            layers._layers[relpath] = rules
+        return layers
+
+    def decide(self, path: str, root_test: bool) -> Optional[bool]:
+        """Return verdict of path, with root_test the root layer only tells if path is ignored, nothing lies outside"""
+        components = path.split('/')
+        for depth in range(len(components) - 1, -1, -1):
+            rules = self.layer('/'.join(components[:depth]))
+            if rules is None:
+                continue
+            subpath = '/'.join(components[depth:])
+            if rules.matcher is not None and not (root_test and depth == 0):
+                verdict = rules.matcher.verdict(subpath)
+            else:
+                verdict = True if test_if_ignored(subpath, rules) else None
+            if verdict is not None:
+                return verdict
+        return None
+
+    def verdict(self, path: str) -> Optional[bool]:
+        return self.decide(path, False)
+
+    def test(self, path: str) -> bool:
+        return self.decide(path, True) is True
+
+
+class AdaptiveRule(object):
+    __slots__ = ('rule', 'static_cost', 'evaluations', 'hits', 'timed', 'cost')
+
+    def __init__(self, rule: Rule):
+        self.rule = rule
+        # Estimate used before any cost is measured and in deterministic mode, set lookup is the cheapest
+        self.static_cost = 1.0 if rule.literal is not None else 2.0 + len(rule.regex.pattern) / 16
+        self.evaluations = 0
+        self.hits = 0
+        self.timed = 0
+        self.cost = 0.0
+
+    def match(self, path: str, components: List[str]) -> bool:
+        if self.rule.literal is not None:
+            return self.rule.literal in components
+        return self.rule.regex.match(path) is not None
+
+    def score(self, measured: bool) -> float:
+        """Expected cost of finding a hit by evaluating this rule: mean cost divided by hit rate"""
+        cost = self.cost / self.timed * 1e6 if measured and self.timed else self.static_cost
+        return cost * (self.evaluations + 2) / (self.hits + 1)
+
+
+class AdaptiveMatcher(Matcher):
+    """Matcher evaluating rules one by one, cheap and frequently matching rules first
+
+    A verdict needs only the first matching ignoring rule and the first matching negated rule, so both kinds are
+    kept in separate lists which are reordered every reorder_interval paths by expected cost of finding a hit.
+    The order changes only the time of matching, verdicts are the same as verdicts of the regex engine. Cost is
+    measured on every timing_interval-th path; in deterministic mode it is estimated from the pattern instead, so the
+    order depends only on matched paths. Negated rules are evaluated by test only when an ignoring rule matched.
+    Statistics are collected per path and added under a lock, so the matcher can be shared by scanning threads.
+    """
+
+    def __init__(self, entries: Tuple[Rule, ...], reorder_interval: int = 1000, timing_interval: int = 8,
+                 deterministic: bool = False):
+        self.ignoring = [AdaptiveRule(rule) for rule in entries if not rule.negated]
+        self.negated = [AdaptiveRule(rule) for rule in entries if rule.negated]
+        self.reorder_interval = reorder_interval
+        self.timing_interval = timing_interval
+        self.deterministic = deterministic
+        self.paths = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def first_hit(rules: List[AdaptiveRule], path: str, components: List[str], timed: bool,
+                  costs: List[float]) -> Optional[int]:
+        """Return index of first rule matching path, appending cost of every evaluated rule to costs when timed"""
+        for index, rule in enumerate(rules):
+            if timed:
+                start = time.perf_counter()
+                matched = rule.match(path, components)
+                costs.append(time.perf_counter() - start)
+            else:
+                matched = rule.match(path, components)
+            if matched:
+                return index
+        return None
+
+    def reorder(self) -> None:
+        measured = not self.deterministic
+        self.ignoring = sorted(self.ignoring, key=lambda rule: rule.score(measured))
+        self.negated = sorted(self.negated, key=lambda rule: rule.score(measured))
+
+    @staticmethod
+    def record(rules: List[AdaptiveRule], hit: Optional[int], costs: List[float]) -> None:
+        """Add evaluations of rules up to hit and their costs to statistics, caller holds the lock"""
+        for rule in rules[:len(rules) if hit is None else hit + 1]:
+            rule.evaluations += 1
+        if hit is not None:
+            rules[hit].hits += 1
+        for rule, cost in zip(rules, costs):
+            rule.cost += cost
+            rule.timed += 1
+
+    def decide(self, path: str, negated_without_hit: bool) -> Optional[bool]:
+        """Return verdict of path, negated rules are evaluated without matching ignoring rule only when requested"""
+        with self._lock:
+            self.paths += 1
+            paths = self.paths
+        timed = not self.deterministic and paths % self.timing_interval == 0
+        components = path.split('/')
+        # Lists are replaced by reorder, not modified, so evaluation uses a consistent order without the lock
+        ignoring, negated = self.ignoring, self.negated
+        ignoring_costs: List[float] = []
+        negated_costs: List[float] = []
+        ignored = self.first_hit(ignoring, path, components, timed, ignoring_costs)
+        evaluate_negated = ignored is not None or negated_without_hit
+        excluded = self.first_hit(negated, path, components, timed, negated_costs) if evaluate_negated else None
+
+        with self._lock:
+            self.record(ignoring, ignored, ignoring_costs)
+            if evaluate_negated:
+                self.record(negated, excluded, negated_costs)
+            if paths % self.reorder_interval == 0:
+                self.reorder()
+
+        if excluded is not None:
+            return False
+        return True if ignored is not None else None
+
+    def verdict(self, path: str) -> Optional[bool]:
+        return self.decide(path, True)
+
+    def test(self, path: str) -> bool:
+        return self.decide(path, False) is True
+
+
+ENGINES = {
+    'regex': RegexMatcher,
+    'trie': TrieMatcher,
+    'adaptive': AdaptiveMatcher,
+}
+
+
+def parse_rules(dropboxignore: List[str]) -> Tuple[Rule, ...]:
+    """Translate lines of .dropboxignore to rules, regexes of rules are compiled lazily
+
+    :param dropboxignore: lines of .dropboxignore
+    :type dropboxignore: List[str]
+    :return: rules in order of lines
+    :rtype: Tuple[Rule, ...]
+    """
+    entries: List[Rule] = []
+    # Rule matching one path component by name, it is tested with set lookup instead of a regex
+    literal_regex = re.compile(r'[^\\*?\[\]/(){}|^$]+')
 
     # Otherwise, Git treats the pattern as a shell glob: "*" matches anything except "/", "?" matches any one
     # character except "/" and "[]" matches one character in a selected range.
     def prepare_regex(split: str) -> str:
         split = re.sub(r'([\.\+])', r'\\\1', split)  # Escape
         split = re.sub(r'\[!(.*?)\]', r'[^\1]', split)  # Escape
-        split = re.sub(r'([^\\\*]|^)\*([^\*]|$)', r'\1([^\/]*)\2', split)  # Single star
-        split = re.sub(r'([^\\]|^)\?', r'\1([^\/])', split)  # Question mark
-        split = re.sub(r'\*\*', r'(.*)', split)  # Double star
-        return rf'{split}(\/|$)'
+        # Generated groups do not capture, so rules combined into one regex do not carry thousands of groups
+        split = re.sub(r'([^\\\*]|^)\*([^\*]|$)', r'\1[^\/]*\2', split)  # Single star
+        split = re.sub(r'([^\\]|^)\?', r'\1[^\/]', split)  # Question mark
+        split = re.sub(r'\*\*', r'.*', split)  # Double star
+        return rf'{split}(?:\/|$)'
 
-    for line in dropboxignore:
+    for lineno, line in enumerate(dropboxignore, 1):
+        source = line.rstrip('\n')
         line = line.lstrip()
         regex = []
         exclude = False
+        literal = None
 
         # A blank line matches no files, so it can serve as a separator for readability.
         if not line:
@@ -116,6 +1345,8 @@ def parse_dropboxignore(dropboxignore: List[str]) -> Rules:
         if line.startswith('\\!'):
             line = f'!{line[2:]}'
 
+        glob = line
+
         if line.startswith('**/'):
             line = line[3:]
 
@@ -138,21 +1369,134 @@ def parse_dropboxignore(dropboxignore: List[str]) -> Rules:
             # but not "mozilla-sha1/sha1.c".
             regex.append(r'^')
             regex.append(r'\/'.join([prepare_regex(split) for split in line[1:].split('/')]))
-            regex.append(r'(.*)')
+            regex.append(r'.*')
         else:
             # If the pattern does not contain a slash /, Git treats it as a shell glob pattern and checks for a match
             # against the pathname relative to the location of the .gitignore file (relative to the toplevel of the work
             # tree if not from a .gitignore file).
-            regex.append(r'(^|(.*)\/)')
+            regex.append(FLOATING_PREFIX)
             regex.append(r'\/'.join([prepare_regex(split) for split in line.split('/')]))
-            regex.append(r'(.*)')
+            regex.append(r'.*')
+            if literal_regex.fullmatch(line):
+                literal = line
 
-        getattr(rules, 'ignored' if not exclude else 'excluded').append(re.compile(r''.join(regex)))
+        entries.append(Rule(source, lineno, glob, exclude, literal, LazyPattern(r''.join(regex))))
 
-    return rules
+    return tuple(entries)
+
+
+def cache_path(name: str, dropbox_path: Optional[str] = None) -> str:
+    """Return path of cache file or directory name in $XDG_CACHE_HOME/dropboxignore
+
+    :param name: name of cached data
+    :type name: str
+    :param dropbox_path: Dropbox directory of cached data, told apart by digest of its real path in a JSON file name
+    :type dropbox_path: Optional[str]
+    :return: path in cache directory
+    :rtype: str
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or p.join(p.expanduser('~'), '.cache')
+    if dropbox_path is not None:
+        name = f'{name}-{hashlib.sha1(p.realpath(dropbox_path).encode("utf-8")).hexdigest()}.json'
+    return p.join(cache_home, 'dropboxignore', name)
+
+
+class RuleCache(object):
+    """Rules parsed from .dropboxignore stored on disk under hash of its content and version of dropboxignore, so
+    unchanged files are loaded instead of parsed again on start and reload"""
+
+    VERSION = 2
+
+    def __init__(self, path: str, max_entries: int = 32):
+        """
+        :param path: directory of cached rules
+        :type path: str
+        :param max_entries: number of cached files kept, the least recently written are removed
+        :type max_entries: int
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def default_path() -> str:
+        return cache_path('rules')
+
+    @staticmethod
+    def key(dropboxignore: List[str]) -> str:
+        return hashlib.sha256(json.dumps([__version__, RuleCache.VERSION, dropboxignore]).encode('utf-8')).hexdigest()
+
+    def entries(self, dropboxignore: List[str]) -> Tuple[Rule, ...]:
+        """Return rules of lines of .dropboxignore, parsing them only when they are not cached"""
+        key = self.key(dropboxignore)
+        entries = self.load(key)
+        if entries is not None:
+            self.hits += 1
+            return entries
+        self.misses += 1
+        entries = parse_rules(dropboxignore)
+        self.save(key, entries)
+        return entries
+
+    def load(self, key: str) -> Optional[Tuple[Rule, ...]]:
+        try:
+            with open(p.join(self.path, f'rules-{key}.json'), 'r') as cache_file:
+                return tuple(Rule(source, lineno, glob, negated, literal, LazyPattern(pattern))
+                             for source, lineno, glob, negated, literal, pattern in json.load(cache_file))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def save(self, key: str, entries: Tuple[Rule, ...]) -> None:
+        path = p.join(self.path, f'rules-{key}.json')
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(f'{path}.tmp', 'w') as cache_file:
+                json.dump([rule[:-1] + (rule.regex.pattern,) for rule in entries], cache_file)
+            os.replace(f'{path}.tmp', path)
+
+            cached = sorted((entry for entry in os.scandir(self.path) if entry.name.startswith('rules-')),
+                            key=lambda entry: entry.stat().st_mtime)
+            for entry in cached[:-self.max_entries]:
+                os.remove(entry.path)
+        except OSError as err:
+            print(f'Cannot save rule cache: {err}')
+
+
+def parse_dropboxignore(dropboxignore: List[str], engine: str = 'regex', nested_root: Optional[str] = None,
+                        profile: bool = False, cache: Optional[RuleCache] = None) -> Rules:
+    """Parse lines of .dropboxignore
+
+    :param dropboxignore: lines of .dropboxignore
+    :type dropboxignore: List[str]
+    :param engine: name of matching engine from ENGINES
+    :type engine: str
+    :param nested_root: directory of parsed .dropboxignore, .dropboxignore files in its subdirectories apply too
+    :type nested_root: Optional[str]
+    :param profile: match by ProfilingMatcher recording cost and hits of every rule
+    :type profile: bool
+    :param cache: cache of parsed rules, used also for nested .dropboxignore files
+    :type cache: Optional[RuleCache]
+    :return: parsed rules
+    :rtype: Rules
+    """
+    dropboxignore = list(dropboxignore)
+    entries = cache.entries(dropboxignore) if cache is not None else parse_rules(dropboxignore)
+    rules = Rules(
+        [rule.regex for rule in entries if not rule.negated],
+        [rule.regex for rule in entries if rule.negated],
+        entries,
+        ProfilingMatcher(entries, engine) if profile else ENGINES[engine](entries),
+    )
+    if nested_root is not None:
+        rules = rules._replace(matcher=RuleLayers(nested_root, rules, engine, profile, cache))
+    return rules
 
 
 def test_if_ignored(path, rules):
+    if rules.matcher is not None:
+        return rules.matcher.test(path)
+
     for rule in rules.ignored:
         if rule.match(path):
             for erule in rules.excluded:
@@ -162,40 +1506,913 @@ def test_if_ignored(path, rules):
     return False
 
 
-def initial_excludes(dropbox_path: str, rules: Rules) -> None:
+class VerdictCache(object):
+    """Bounded LRU cache of verdicts of relative paths for one generation of rules
+
+    A path inside an ignored path is ignored too (Dropbox excludes whole directories), so a cached ignored ancestor
+    answers without matching. The generation is part of the key, so a verdict computed while rules were being
+    replaced is never returned for the new rules.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        """
+        :param maxsize: maximal number of cached verdicts, 0 disables caching
+        :type maxsize: int
+        """
+        self.maxsize = maxsize
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._verdicts: 'collections.OrderedDict[Tuple[int, str], bool]' = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        """Forget all verdicts, called whenever rules change"""
+        with self._lock:
+            self.generation += 1
+            self._verdicts.clear()
+
+    def test(self, relpath: str, rules: Rules) -> bool:
+        """Test if relpath is ignored by rules using cached verdicts of the path and its ancestors"""
+        if self.maxsize <= 0:
+            return observed_test_if_ignored(relpath, rules)
+
+        generation = self.generation
+        with self._lock:
+            key = (generation, relpath)
+            verdict = self._verdicts.get(key)
+            ancestor = relpath
+            while verdict is None and p.sep in ancestor:
+                ancestor = ancestor.rsplit(p.sep, 1)[0]
+                if self._verdicts.get((generation, ancestor)):
+                    key, verdict = (generation, ancestor), True
+            if verdict is not None:
+                self._verdicts.move_to_end(key)
+                self.hits += 1
+                return verdict
+            self.misses += 1
+
+        verdict = observed_test_if_ignored(relpath, rules)
+        with self._lock:
+            self._verdicts[(generation, relpath)] = verdict
+            if len(self._verdicts) > self.maxsize:
+                self._verdicts.popitem(last=False)
+        return verdict
+
+
+def observed_test_if_ignored(path: str, rules: Rules) -> bool:
+    """test_if_ignored measured by match time histogram"""
+    start = time.perf_counter()
+    ignored = test_if_ignored(path, rules)
+    METRICS.observe('dropboxignore_match_seconds', time.perf_counter() - start)
+    return ignored
+
+
+def rules_digest(rules: Rules) -> str:
+    """Hash of rules changing whenever any rule of the root .dropboxignore, matching engine or use of nested
+    .dropboxignore files changes, nested files themselves are checked by ScanIndex"""
+    digest = hashlib.sha1(rules_engine(rules).encode('utf-8'))
+    if isinstance(rules.matcher, RuleLayers):
+        digest.update(b'\0nested\0')
+    for regex in rules.ignored + [None] + rules.excluded:
+        digest.update(b'\0' if regex is None else regex.pattern.encode('utf-8') + b'\n')
+    return digest.hexdigest()
+
+
+def rules_engine(rules: Rules) -> str:
+    """Name of engine which built matcher of rules"""
+    if isinstance(rules.matcher, (RuleLayers, ProfilingMatcher)):
+        return rules.matcher.engine
+    for name, matcher in ENGINES.items():
+        if type(rules.matcher) is matcher:
+            return name
+    return 'regex'
+
+
+def rules_profiled(rules: Rules) -> bool:
+    if isinstance(rules.matcher, RuleLayers):
+        return rules.matcher.profile
+    return isinstance(rules.matcher, ProfilingMatcher)
+
+
+def profile_report(rules: Rules) -> str:
+    """Report of rules profiled by ProfilingMatcher sorted by total time, rules which never matched are marked"""
+    layers = [('', rules)]
+    if isinstance(rules.matcher, RuleLayers):
+        layers = [(relpath, rules.matcher.layer(relpath)) for relpath in [''] + sorted(rules.matcher.layers())]
+
+    profiles = []
+    for relpath, layer in layers:
+        if layer is not None and isinstance(layer.matcher, ProfilingMatcher):
+            profiles.extend((p.join(relpath, '.dropboxignore'), rule, stats)
+                            for rule, _, stats in layer.matcher.profiles)
+    profiles.sort(key=lambda profile: profile[2].total, reverse=True)
+
+    lines = [f'{"total ms":>10} {"max us":>9} {"mean us":>9} {"evaluations":>11} {"hits":>8}  rule']
+    for origin, rule, stats in profiles:
+        mean = stats.total / stats.evaluations if stats.evaluations else 0.0
+        dead = '  (never matched)' if stats.evaluations and not stats.hits else ''
+        lines.append(f'{stats.total * 1e3:>10.3f} {stats.maximum * 1e6:>9.1f} {mean * 1e6:>9.2f} '
+                     f'{stats.evaluations:>11} {stats.hits:>8}  {origin}:{rule.lineno}: {rule.source}{dead}')
+    return '\n'.join(lines)
+
+
+def diff_rules(old_rules: Rules, rules: Rules) -> Tuple[List[Rule], List[Rule]]:
+    """Return rules added to and removed from old_rules"""
+    def key(rule: Rule) -> Tuple[str, bool]:
+        return rule.glob.strip(), rule.negated
+
+    old_keys = {key(rule) for rule in old_rules.entries}
+    keys = {key(rule) for rule in rules.entries}
+    return ([rule for rule in rules.entries if key(rule) not in old_keys],
+            [rule for rule in old_rules.entries if key(rule) not in keys])
+
+
+def scoped_relpath(relpath: str, scope: str) -> Optional[str]:
+    """Return relpath relative to directory scope or None if it is not inside scope"""
+    if not scope:
+        return relpath
+    if relpath.startswith(f'{scope}{p.sep}'):
+        return relpath[len(scope) + 1:]
+    return None
+
+
+def any_rule(entries: List[Rule], engine: str = 'regex') -> Rules:
+    """Rules matching paths matched by any of entries, regardless of their negation"""
+    entries = tuple(rule._replace(negated=False) for rule in entries)
+    return Rules([rule.regex for rule in entries], [], entries, ENGINES[engine](entries))
+
+
+def read_dropboxignore(dropbox_ignore_file: str) -> List[str]:
+    with open(dropbox_ignore_file, 'r') as opened_file:
+        return opened_file.readlines()
+
+
+def join_relpath(relpath: str, name: str) -> str:
+    return f'{relpath}{p.sep}{name}' if relpath else name
+
+
+def relpath_ancestors(relpath: str) -> Iterator[str]:
+    """Yield relpath and its ancestors except the root"""
+    while relpath:
+        yield relpath
+        relpath = p.dirname(relpath)
+
+
+def scan_subdirectories(path: str, relpath: str, follow_symlinks: bool = True, device: Optional[int] = None,
+                        visited: Optional[Set[Tuple[int, int]]] = None) -> List[Tuple[str, os.DirEntry]]:
+    """List subdirectories of path
+
+    :param path: path of listed directory
+    :type path: str
+    :param relpath: path of listed directory relative to scanned root, empty for the root itself
+    :type relpath: str
+    :param follow_symlinks: include symlinks pointing to directories
+    :type follow_symlinks: bool
+    :param device: skip directories from filesystems other than this device
+    :type device: Optional[int]
+    :param visited: (device, inode) of followed symlink targets, used to break symlink loops
+    :type visited: Optional[Set[Tuple[int, int]]]
+    :return: relative paths with directory entries of subdirectories
+    :rtype: List[Tuple[str, os.DirEntry]]
+    """
+    subdirectories = []
+    for subpath_entry in os.scandir(path):
+        if not subpath_entry.is_dir(follow_symlinks=follow_symlinks):
+            continue
+
+        try:
+            if follow_symlinks and visited is not None and subpath_entry.is_symlink():
+                stat = subpath_entry.stat()
+                if (stat.st_dev, stat.st_ino) in visited:
+                    continue
+                visited.add((stat.st_dev, stat.st_ino))
+
+            if device is not None and subpath_entry.stat(follow_symlinks=follow_symlinks).st_dev != device:
+                continue
+        except FileNotFoundError:
+            # Removed after it was listed
+            continue
+
+        subrelpath = join_relpath(relpath, subpath_entry.name)
+        subdirectories.append((subrelpath, subpath_entry))
+    return subdirectories
+
+
+class ScanIndex(object):
+    """Persistent record of scanned directories allowing to skip unchanged subtrees on restart
+
+    Every entered directory is stored with its mtime, inode and names of its subdirectories. If the rules did not
+    change and directory has the same mtime and inode, its subdirectories are known without listing and matching it
+    again. Directories which were not entered (ignored ones) are not stored, so they are not entered on replay
+    either, unless they are not excluded by Dropbox (e.g. their exclusion failed) and their parent is listed again.
+    Unfinished scan is checkpointed with the list of directories still waiting to be scanned.
+
+    With nested rules, mtime and hash of .dropboxignore of every entered directory are stored too. Subtree of
+    directory whose .dropboxignore was added, changed or removed since the last scan is listed and matched again.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path: str, checkpoint_interval: float = 30.0):
+        """
+        :param path: path of index file
+        :type path: str
+        :param checkpoint_interval: seconds between saving progress of unfinished scan
+        :type checkpoint_interval: float
+        """
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.rules_hash: Optional[str] = None
+        self.previous: Dict[str, list] = {}
+        self.current: Dict[str, list] = {}
+        self.pending: List[str] = []
+        self.nested = False
+        self.previous_layers: Dict[str, list] = {}
+        self.current_layers: Dict[str, list] = {}
+        self.changed_layers: Set[str] = set()
+        self.before_save: Optional[Callable[[], None]] = None
+        self._checkpointed = time.monotonic()
+
+    @staticmethod
+    def default_path(dropbox_path: str) -> str:
+        return cache_path('scan', dropbox_path)
+
+    def load(self, rules_hash: str, nested: bool = False) -> None:
+        """Load index written for the same rules, index written for other rules is discarded
+
+        :param rules_hash: digest of rules of the root .dropboxignore
+        :type rules_hash: str
+        :param nested: check .dropboxignore files of entered directories
+        :type nested: bool
+        """
+        self.rules_hash = rules_hash
+        self.nested = nested
+        self.previous, self.current, self.pending = {}, {}, []
+        self.previous_layers, self.current_layers, self.changed_layers = {}, {}, set()
+        self._checkpointed = time.monotonic()
+        try:
+            with open(self.path, 'r') as index_file:
+                data = json.load(index_file)
+        except (OSError, ValueError):
+            return
+
+        if data.get('version') != self.VERSION or data.get('rules_hash') != rules_hash:
+            return
+        self.previous = data.get('dirs', {})
+        self.previous_layers = data.get('layers', {})
+        self.pending = data.get('pending', [])
+        if self.pending:
+            # Resumed scan only finishes pending directories, the rest was already scanned
+            self.current = dict(self.previous)
+            self.current_layers = dict(self.previous_layers)
+
+    def lookup(self, relpath: str, path: str, excluded: Optional[Callable[[str], bool]] = None
+               ) -> Tuple[os.stat_result, Optional[List[str]]]:
+        """Return stat of directory and names of its subdirectories if it did not change since the last scan
+
+        :param relpath: path of directory relative to scanned root
+        :type relpath: str
+        :param path: path of directory
+        :type path: str
+        :param excluded: predicate telling if subdirectory is excluded, directory with a subdirectory which was not
+            entered and is not excluded is reported as changed
+        :type excluded: Optional[Callable[[str], bool]]
+        :return: stat of directory and names of its subdirectories, names are None if directory has to be listed
+        :rtype: Tuple[os.stat_result, Optional[List[str]]]
+        """
+        stat = os.stat(path)
+        if self.nested and relpath and self.layer_changed(relpath, path):
+            self.changed_layers.add(relpath)
+        if self.changed_layers and any(ancestor in self.changed_layers for ancestor in relpath_ancestors(relpath)):
+            return stat, None
+        entry = self.previous.get(relpath)
+        if entry is None or entry[0] != stat.st_mtime_ns or entry[1] != stat.st_ino:
+            return stat, None
+        if excluded is not None and not all(excluded(join_relpath(relpath, name)) for name in entry[2]
+                                            if not self.entered(join_relpath(relpath, name))):
+            return stat, None
+        return stat, entry[2]
+
+    def layer_changed(self, relpath: str, path: str) -> bool:
+        """Test if .dropboxignore in directory was added, changed or removed since the last scan"""
+        layer_path = p.join(path, '.dropboxignore')
+        previous = self.previous_layers.get(relpath)
+        try:
+            mtime = os.stat(layer_path).st_mtime_ns
+            if previous is not None and previous[0] == mtime:
+                self.current_layers[relpath] = previous
+                return False
+            with open(layer_path, 'rb') as layer_file:
+                digest = hashlib.sha1(layer_file.read()).hexdigest()
+        except (FileNotFoundError, NotADirectoryError):
+            self.current_layers.pop(relpath, None)
+            return previous is not None
+        except OSError:
+            return True
+        self.current_layers[relpath] = [mtime, digest]
+        return previous is None or previous[1] != digest
+
+    def entered(self, relpath: str) -> bool:
+        """Test if directory was entered by the last scan"""
+        return relpath in self.previous
+
+    def record(self, relpath: str, stat: os.stat_result, names: List[str]) -> None:
+        self.current[relpath] = [stat.st_mtime_ns, stat.st_ino, names]
+
+    def forget(self, relpaths: List[str]) -> None:
+        """Remove directories and their subdirectories, e.g. after they became ignored"""
+        exact = set(relpaths)
+        prefixes = tuple(f'{relpath}{p.sep}' for relpath in relpaths)
+        for relpath in [relpath for relpath in self.current if relpath in exact or relpath.startswith(prefixes)]:
+            del self.current[relpath]
+
+    def checkpoint_due(self) -> bool:
+        """Test if checkpoint_interval passed since the last save, callers check it before collecting pending"""
+        return time.monotonic() - self._checkpointed >= self.checkpoint_interval
+
+    def checkpoint(self, pending: List[str], force: bool = False) -> None:
+        """Save progress if checkpoint_interval passed since the last save or when forced"""
+        if force or self.checkpoint_due():
+            dirs = dict(self.previous)
+            dirs.update(self.current)
+            layers = dict(self.previous_layers)
+            layers.update(self.current_layers)
+            self.save(dirs, pending, layers)
+
+    def save(self, dirs: Optional[Dict[str, list]] = None, pending: Optional[List[str]] = None,
+             layers: Optional[Dict[str, list]] = None) -> None:
+        if self.before_save is not None:
+            self.before_save()
+
+        os.makedirs(p.dirname(self.path) or '.', exist_ok=True)
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w') as index_file:
+            json.dump({
+                'version': self.VERSION,
+                'rules_hash': self.rules_hash,
+                'dirs': self.current if dirs is None else dirs,
+                'layers': self.current_layers if layers is None else layers,
+                'pending': pending or [],
+            }, index_file, separators=(',', ':'))
+        os.replace(temporary_path, self.path)
+        self._checkpointed = time.monotonic()
+
+
+def walk_directories(path: str, descend: Optional[Callable[[str, os.DirEntry], bool]] = None,
+                     follow_symlinks: bool = True, one_file_system: bool = False,
+                     scan_index: Optional[ScanIndex] = None, pace: Optional[Callable[[], bool]] = None,
+                     onerror: Optional[Callable[[OSError], None]] = None,
+                     excluded: Optional[Callable[[str], bool]] = None) -> Iterator[Tuple[str, os.DirEntry]]:
+    """Iterate over all directories below path without recursion
+
+    descend is called after the consumer has handled the yielded directory, its subdirectories are not visited when
+    it returns False. With scan_index, directories unchanged since the previous scan are not listed and their
+    subdirectories are only entered, not yielded. pace is called before every directory is visited, it may sleep to
+    limit the rate of the walk and stops the walk by returning False, directories not visited yet are then saved to
+    scan_index as pending. Directories below path removed before they are listed (e.g. pending directories of an
+    interrupted scan) are skipped, other errors of listing are passed to onerror and the directory is skipped, or
+    they are raised without onerror.
+
+    :param path: root of iterated tree
+    :type path: str
+    :param descend: predicate deciding if directory should be entered
+    :type descend: Optional[Callable[[str, os.DirEntry], bool]]
+    :param follow_symlinks: enter symlinks pointing to directories
+    :type follow_symlinks: bool
+    :param one_file_system: skip directories on other filesystems than path
+    :type one_file_system: bool
+    :param scan_index: loaded index of the previous scan, updated during the walk
+    :type scan_index: Optional[ScanIndex]
+    :param pace: predicate called before visiting every directory, the walk stops when it returns False
+    :type pace: Optional[Callable[[], bool]]
+    :param onerror: called with error of directory which cannot be listed
+    :type onerror: Optional[Callable[[OSError], None]]
+    :param excluded: predicate telling if directory is excluded, passed to ScanIndex.lookup
+    :type excluded: Optional[Callable[[str], bool]]
+    :return: generator of paths relative to path with directory entries
+    :rtype: Iterator[Tuple[str, os.DirEntry]]
+    """
+    device = os.stat(path).st_dev if one_file_system else None
+    visited: Set[Tuple[int, int]] = set()
+    stack = [('', path)]
+    if scan_index is not None and scan_index.pending:
+        stack = [(relpath, p.join(path, relpath)) for relpath in scan_index.pending]
+
+    while stack:
+        if pace is not None and not pace():
+            if scan_index is not None:
+                scan_index.checkpoint([relpath for relpath, _ in stack], force=True)
+            return
+        if scan_index is not None and scan_index.checkpoint_due():
+            scan_index.checkpoint([relpath for relpath, _ in stack])
+
+        relpath, dirpath = stack.pop()
+        try:
+            if scan_index is not None:
+                stat, names = scan_index.lookup(relpath, dirpath, excluded)
+                if names is not None:
+                    scan_index.record(relpath, stat, names)
+                    stack.extend((join_relpath(relpath, name), p.join(dirpath, name)) for name in names
+                                 if scan_index.entered(join_relpath(relpath, name)))
+                    continue
+
+            subdirectories = scan_subdirectories(dirpath, relpath, follow_symlinks, device, visited)
+        except OSError as err:
+            if relpath and isinstance(err, (FileNotFoundError, NotADirectoryError)):
+                continue
+            if onerror is None:
+                raise
+            onerror(err)
+            continue
+        if scan_index is not None:
+            scan_index.record(relpath, stat, [subpath_entry.name for _, subpath_entry in subdirectories])
+
+        for subrelpath, subpath_entry in subdirectories:
+            yield subrelpath, subpath_entry
+            if descend is None or descend(subrelpath, subpath_entry):
+                stack.append((subrelpath, subpath_entry.path))
+
+
+class ScanStats(object):
+    """Progress of scanning directory tree"""
+
+    def __init__(self):
+        self.directories = 0
+        self.ignored = 0
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished if self.finished is not None else time.monotonic()) - self.started
+
+    @property
+    def rate(self) -> float:
+        """Checked directories per second"""
+        return self.directories / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f'Scanned {self.directories} directories ({self.ignored} ignored) in {self.elapsed:.1f}s '
+                f'({self.rate:.0f} directories/s)')
+
+
+# Listings submitted to the pool per scanning thread, more directories wait on a stack of the scan
+SCAN_JOBS_IN_FLIGHT = 4
+# Maximal number of directories listed by one submitted job
+SCAN_BATCH_SIZE = 64
+
+
+def initial_excludes(dropbox_path: str, rules: Rules, index: Optional[ExclusionIndex] = None,
+                     queue: Optional[ExclusionQueue] = None, jobs: int = 1, follow_symlinks: bool = True,
+                     one_file_system: bool = False, scan_index: Optional[ScanIndex] = None,
+                     executor: Optional[concurrent.futures.Executor] = None) -> ScanStats:
     """First run to exclude all paths matching rules
 
+    Directories are listed by a pool of jobs threads, matched paths are excluded from calling thread only.
+
     :param dropbox_path: path synchronized by dropbox
     :type dropbox_path: str
     :param rules: list of rules
     :type rules: List[str]
-    :return: tree of ignored paths
-    :rtype: [type]
+    :param index: index of paths already excluded by Dropbox
+    :type index: Optional[ExclusionIndex]
+    :param queue: queue batching exclusions, paths are excluded one by one if not given
+    :type queue: Optional[ExclusionQueue]
+    :param jobs: number of threads listing directories
+    :type jobs: int
+    :param follow_symlinks: enter symlinks pointing to directories
+    :type follow_symlinks: bool
+    :param one_file_system: skip directories on other filesystems than dropbox_path
+    :type one_file_system: bool
+    :param scan_index: index of the previous scan used to skip unchanged directories, saved after the scan
+    :type scan_index: Optional[ScanIndex]
+    :param executor: pool listing directories shared with scans of other paths, created for jobs if not given
+    :type executor: Optional[concurrent.futures.Executor]
+    :return: statistics of the scan
+    :rtype: ScanStats
     """
+    stats = ScanStats()
+    METRICS.set_function('dropboxignore_scan_directories', lambda: stats.directories, root=dropbox_path)
+    METRICS.set_function('dropboxignore_scan_ignored', lambda: stats.ignored, root=dropbox_path)
+    METRICS.set_function('dropboxignore_scan_seconds', lambda: stats.elapsed, root=dropbox_path)
+    METRICS.set_function('dropboxignore_scan_running', lambda: 0 if stats.finished is not None else 1,
+                         root=dropbox_path)
 
-    def iterate_over_path(path):
-        for subpath_entry in os.scandir(path):
-            subpath = subpath_entry.path
-            if not subpath_entry.is_dir():
-                continue
+    def exclude(subrelpath: str) -> None:
+        stats.ignored += 1
+        dropbox_exclude(subrelpath, dropbox_path, index, queue)
 
-            subrelpath = p.relpath(p.normpath(subpath), dropbox_path)
-            if test_if_ignored(subrelpath, rules):
-                dropbox_exclude(subrelpath, dropbox_path)
-            else:
-                iterate_over_path(subpath)
+    # Ignored directories whose exclusion failed are matched again, though their parent did not change
+    known = exclusion_index(index, queue)
+    excluded = (lambda subrelpath: known.find(subrelpath) is not None) if known is not None else None
+
+    if scan_index is not None:
+        scan_index.load(rules_digest(rules), nested=isinstance(rules.matcher, RuleLayers))
+        scan_index.before_save = queue.flush if queue is not None else None
+        if scan_index.pending:
+            print(f'Resuming scan with {len(scan_index.pending)} pending directories')
+
+    if jobs <= 1 and executor is None:
+        ignored: Set[str] = set()
+
+        def descend(subrelpath: str, _: os.DirEntry) -> bool:
+            if subrelpath in ignored:
+                ignored.discard(subrelpath)
+                return False
+            return True
+
+        for subrelpath, _ in walk_directories(dropbox_path, descend, follow_symlinks, one_file_system, scan_index,
+                                              excluded=excluded):
+            stats.directories += 1
+            if observed_test_if_ignored(subrelpath, rules):
+                ignored.add(subrelpath)
+                exclude(subrelpath)
+    else:
+        device = os.stat(dropbox_path).st_dev if one_file_system else None
+        visited: Set[Tuple[int, int]] = set()
+
+        def scan_directory(path: str, relpath: str) -> Tuple[Optional[os.stat_result], List[str],
+                                                              List[Tuple[str, str, Optional[bool]]]]:
+            """Return stat, subdirectory names and relative path, path and verdict of subdirectories to check
+
+            Verdict is None for subdirectories of directory which did not change since the previous scan. Directory
+            removed before it was listed is returned without stat and subdirectories.
+            """
+            stat = None
+            try:
+                if scan_index is not None:
+                    stat, names = scan_index.lookup(relpath, path, excluded)
+                    if names is not None:
+                        return stat, names, [(join_relpath(relpath, name), p.join(path, name), None) for name in names
+                                             if scan_index.entered(join_relpath(relpath, name))]
 
-    iterate_over_path(dropbox_path)
+                subdirectories = scan_subdirectories(path, relpath, follow_symlinks, device, visited)
+            except (FileNotFoundError, NotADirectoryError):
+                if not relpath:
+                    raise
+                return None, [], []
+            return stat, [subpath_entry.name for _, subpath_entry in subdirectories], [
+                (subrelpath, subpath_entry.path, observed_test_if_ignored(subrelpath, rules))
+                for subrelpath, subpath_entry in subdirectories]
+
+        def scan_batch(batch: List[Tuple[str, str]]) -> List[Tuple[Optional[os.stat_result], List[str],
+                                                                  List[Tuple[str, str, Optional[bool]]]]]:
+            return [scan_directory(path, relpath) for relpath, path in batch]
+
+        own_executor = executor is None
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        try:
+            relpaths = scan_index.pending if scan_index is not None and scan_index.pending else ['']
+            # Directories beyond the bounded number of listings in flight wait on a stack, so waiting for
+            # a finished listing does not go through a future of every known directory
+            waiting = [(relpath, p.join(dropbox_path, relpath)) for relpath in reversed(relpaths)]
+            in_flight: Dict[concurrent.futures.Future, List[str]] = {}
+            limit = max(jobs, 1) * SCAN_JOBS_IN_FLIGHT
+            while in_flight or waiting:
+                while waiting and len(in_flight) < limit:
+                    # Directories are listed in batches, so a cheap listing does not pay for a future of its own
+                    batch = [waiting.pop() for _ in range(min(len(waiting), max(1, len(waiting) // limit),
+                                                              SCAN_BATCH_SIZE))]
+                    in_flight[executor.submit(scan_batch, batch)] = [relpath for relpath, _ in batch]
+                if scan_index is not None and scan_index.checkpoint_due():
+                    scan_index.checkpoint([relpath for batch in in_flight.values() for relpath in batch] +
+                                          [relpath for relpath, _ in waiting])
+
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    for relpath, (stat, names, subdirectories) in zip(in_flight.pop(future), future.result()):
+                        if scan_index is not None and stat is not None:
+                            scan_index.record(relpath, stat, names)
+
+                        for subrelpath, subpath, is_ignored in subdirectories:
+                            if is_ignored is not None:
+                                stats.directories += 1
+                            if is_ignored:
+                                exclude(subrelpath)
+                            else:
+                                waiting.append((subrelpath, subpath))
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+    if scan_index is not None:
+        scan_index.save()
+
+    stats.finished = time.monotonic()
+    print(stats)
+    return stats
 
 
 class EventHandler(pyinotify.ProcessEvent):
     """Class with implementation of method checking ignored paths"""
 
-    def __init__(self, dropbox_path: str, rules: Rules, pevent=None, **kargs):
+    def __init__(self, dropbox_path: str, rules: Rules, index: Optional[ExclusionIndex] = None,
+                 queue: Optional[ExclusionQueue] = None, watch_manager: Optional[pyinotify.WatchManager] = None,
+                 coalesce_window: float = 0.0, workers: Optional[ExclusionWorkers] = None,
+                 scan_index: Optional[ScanIndex] = None, verdicts: Optional[VerdictCache] = None,
+                 overflow_limit: int = 10000, rule_cache: Optional[RuleCache] = None, pevent=None, **kargs):
+        """
+        :param coalesce_window: seconds events are collected before matching, 0 processes every event immediately
+        :type coalesce_window: float
+        :param workers: pool excluding matched paths, paths are excluded by the notifier thread if not given
+        :type workers: Optional[ExclusionWorkers]
+        :param scan_index: index of the initial scan, updated when .dropboxignore is reloaded
+        :type scan_index: Optional[ScanIndex]
+        :param verdicts: cache of verdicts of event paths
+        :type verdicts: Optional[VerdictCache]
+        :param overflow_limit: maximal number of directories listed to recover events lost by queue overflow
+        :type overflow_limit: int
+        :param rule_cache: cache of parsed rules used when .dropboxignore is reloaded
+        :type rule_cache: Optional[RuleCache]
+        """
         self.dropbox_path = dropbox_path
+        self.dropbox_ignore_file = p.join(dropbox_path, '.dropboxignore')
         self.rules = rules
+        self.scan_index = scan_index
+        self.verdicts = verdicts if verdicts is not None else VerdictCache()
+        self.index = index if index is not None else ExclusionIndex(dropbox_path)
+        self.queue = queue
+        self.watch_manager = watch_manager
+        self.coalesce_window = coalesce_window
+        self.workers = workers
+        self.mask = WATCHED_EVENTS
+        self.overflow_limit = overflow_limit
+        self.rule_cache = rule_cache
+        # Times of the last two checkpoints, queue was read empty after the older one
+        self.checkpoints: Deque[float] = collections.deque([time.time()], maxlen=2)
+        self.counters: collections.Counter = collections.Counter()
+        # Watch descriptors of watched directories by path, WatchManager.get_wd scans all watches of the manager
+        self._wds: Dict[str, int] = {}
+        self._pending: Set[str] = set()
+        self._pending_since: Optional[float] = None
         return super().__init__(pevent=pevent, **kargs)
 
+    def exclude_filter(self, path: str) -> bool:
+        """Watch filter skipping ignored directories, used also for watches added automatically on new directories"""
+        relative_path = p.relpath(path, self.dropbox_path)
+        return relative_path != p.curdir and self.verdicts.test(relative_path, self.rules)
+
+    def watch(self, mask: int) -> int:
+        """Watch dropbox_path and its subdirectories except ignored subtrees
+
+        :param mask: mask of watched events
+        :type mask: int
+        :return: number of watches under dropbox_path
+        :rtype: int
+        """
+        def descend(relpath: str, subpath_entry: os.DirEntry) -> bool:
+            if self.verdicts.test(relpath, self.rules):
+                return False
+            self.add_watch(subpath_entry.path)
+            return True
+
+        self.mask = mask
+        METRICS.set_function('dropboxignore_watched_directories', self.watched_directories, root=self.dropbox_path)
+        self.add_watch(self.dropbox_path)
+        for _ in walk_directories(self.dropbox_path, descend, follow_symlinks=False):
+            pass
+        self.watch_dropboxignore()
+        if isinstance(self.rules.matcher, RuleLayers):
+            for relpath in self.rules.matcher.layers():
+                self.watch_dropboxignore(relpath)
+            self.rules.matcher.on_layer = self.watch_dropboxignore
+        return self.watched_directories()
+
+    def add_watch(self, path: str) -> None:
+        """Watch directory path, new subdirectories are watched by watch_subtree instead of pyinotify auto_add,
+        which does not see ignored directories inside a tree moved in"""
+        wds = self.watch_manager.add_watch(path, self.mask, proc_fun=self, exclude_filter=self.exclude_filter)
+        wd = wds.get(path, -1) if wds else -1
+        if wd >= 0:
+            self._wds[path] = wd
+
+    def watched(self, path: str) -> bool:
+        """Test if directory path is watched by this handler"""
+        return path in self._wds
+
+    def watch_subtree(self, relative_path: str) -> List[str]:
+        """Watch new directory and its subdirectories, return ignored directories found inside
+
+        Every directory is watched before it is listed, so its subdirectories created meanwhile are either listed or
+        reported by the watch. Directory already watched was handled by an earlier scan of its subtree.
+
+        :param relative_path: directory reported by event, relative to dropbox_path
+        :type relative_path: str
+        :return: ignored subdirectories relative to dropbox_path
+        :rtype: List[str]
+        """
+        path = p.join(self.dropbox_path, relative_path)
+        if self.watch_manager is None or self.verdicts.test(relative_path, self.rules) \
+                or self.watched(path) or not p.isdir(path):
+            return []
+
+        ignored: List[str] = []
+
+        def descend(subrelpath: str, subpath_entry: os.DirEntry) -> bool:
+            subrelpath = join_relpath(relative_path, subrelpath)
+            if self.verdicts.test(subrelpath, self.rules):
+                ignored.append(subrelpath)
+                return False
+            if self.watched(subpath_entry.path):
+                return False
+            self.add_watch(subpath_entry.path)
+            return True
+
+        def onerror(err: OSError) -> None:
+            # New directory removed right away, e.g. temporary directory of a build
+            if not isinstance(err, (FileNotFoundError, NotADirectoryError)):
+                print(f'Cannot scan new directory {err.filename}: {err}')
+
+        self.add_watch(path)
+        self.counters['scanned'] += 1
+        for _ in walk_directories(path, descend, follow_symlinks=False, onerror=onerror):
+            pass
+        return ignored
+
+    def watched_directories(self) -> int:
+        """Return number of watched directories under dropbox_path, watch manager may be shared with other Dropbox
+        paths"""
+        return len(self._wds)
+
+    def watch_dropboxignore(self, relpath: str = '') -> None:
+        """Watch .dropboxignore in directory relpath for changes, replacing it by rename is reported by watch of
+        the directory"""
+        path = p.join(self.dropbox_path, relpath, '.dropboxignore')
+        if self.watch_manager is not None and p.exists(path):
+            self.watch_manager.add_watch(path, DROPBOXIGNORE_EVENTS, proc_fun=self)
+
+    def reload(self) -> None:
+        """Read .dropboxignore again and apply rules which were added or removed"""
+        try:
+            rules = parse_dropboxignore(read_dropboxignore(self.dropbox_ignore_file), rules_engine(self.rules),
+                                        profile=rules_profiled(self.rules), cache=self.rule_cache)
+        except (OSError, ParsingException) as err:
+            print(f'Cannot reload .dropboxignore: {err}')
+            return
+        if not rules.entries and self.rules.entries:
+            print('.dropboxignore is empty, keeping its previous rules')
+            return
+
+        self.flush()
+        old_rules = self.rules
+        if isinstance(old_rules.matcher, RuleLayers):
+            rules = rules._replace(matcher=old_rules.matcher.replaced('', rules))
+        self.rules = rules
+        self.verdicts.clear()
+        self.apply_rules_change(old_rules, rules)
+
+    def reload_layer(self, relpath: str) -> None:
+        """Read .dropboxignore in subdirectory relpath again and apply rules which were added or removed inside it"""
+        if not isinstance(self.rules.matcher, RuleLayers):
+            return
+
+        self.flush()
+        old_rules = self.rules
+        old_layer = old_rules.matcher.layer(relpath)
+        layers = old_rules.matcher.replaced(relpath)
+        layer = layers.layer(relpath)
+        # Removed file drops its rules, file which is empty or cannot be read keeps them
+        if old_layer is not None and old_layer.entries and (layer is None or not layer.entries) \
+                and p.exists(p.join(self.dropbox_path, relpath, '.dropboxignore')):
+            print(f'{p.join(relpath, ".dropboxignore")} is empty or unreadable, keeping its previous rules')
+            return
+        self.rules = old_rules._replace(matcher=layers)
+        self.verdicts.clear()
+        empty = parse_dropboxignore([], layers.engine)
+        self.apply_rules_change(old_rules, self.rules, relpath, (old_layer or empty, layer or empty))
+
+    def apply_rules_change(self, old_rules: Rules, rules: Rules, scope: str = '',
+                           changed_rules: Optional[Tuple[Rules, Rules]] = None) -> None:
+        """Exclude directories newly ignored and bring back directories no longer ignored
+
+        Only directories matched by added or removed rules are tested against the whole new rules. Candidates for
+        exclusion are watched directories (or directories of scan index when not watching), candidates for bringing
+        back are paths excluded by Dropbox which were ignored by old rules, so paths excluded by hand stay excluded.
+        Directories brought back are watched and scanned like new directories.
+
+        :param scope: directory of changed .dropboxignore relative to dropbox_path
+        :type scope: str
+        :param changed_rules: old and new rules of changed .dropboxignore, whole rules are compared if not given
+        :type changed_rules: Optional[Tuple[Rules, Rules]]
+        """
+        added, removed = diff_rules(*(changed_rules or (old_rules, rules)))
+        if not added and not removed:
+            return
+        print(f'{p.join(scope, ".dropboxignore")} changed: {len(added)} rules added, {len(removed)} rules removed')
+        engine = rules_engine(rules)
+
+        def matches_changed(relpath: str, changed: Rules) -> bool:
+            subpath = scoped_relpath(relpath, scope)
+            return subpath is not None and test_if_ignored(subpath, changed)
+
+        unignoring = [rule for rule in added if rule.negated] + [rule for rule in removed if not rule.negated]
+        if unignoring:
+            changed = any_rule(unignoring, engine)
+            excluded_paths = [excluded_path for excluded_path in self.index.paths()
+                              if matches_changed(excluded_path, changed) and test_if_ignored(excluded_path, old_rules)
+                              and not test_if_ignored(excluded_path, rules)]
+            if excluded_paths:
+                dropbox_exclude_remove(excluded_paths, self.dropbox_path, self.index)
+                # Subtrees brought back were not watched, ignored directories inside them are excluded again
+                self.process_directories(excluded_paths)
+                if self.scan_index is not None:
+                    # Parents are listed again by the next scan, so directories brought back are entered
+                    for excluded_path in excluded_paths:
+                        self.scan_index.current.pop(p.dirname(excluded_path), None)
+
+        ignoring = [rule for rule in added if not rule.negated] + [rule for rule in removed if rule.negated]
+        if ignoring:
+            changed = any_rule(ignoring, engine)
+            if self.watch_manager is not None and self._wds:
+                candidates = [p.relpath(path, self.dropbox_path) for path in list(self._wds) if p.isdir(path)]
+            elif self.scan_index is not None and self.scan_index.current:
+                candidates = list(self.scan_index.current)
+            else:
+                candidates = [relpath for relpath, _ in walk_directories(self.dropbox_path, follow_symlinks=False)]
+            ignored = [relpath for relpath in candidates
+                       if relpath not in ('', p.curdir) and matches_changed(relpath, changed)]
+            self.process_paths(ignored)
+            if self.scan_index is not None:
+                self.scan_index.forget([relpath for relpath in ignored if test_if_ignored(relpath, rules)])
+
+        if self.scan_index is not None and self.scan_index.rules_hash is not None:
+            self.scan_index.rules_hash = rules_digest(rules)
+            try:
+                self.scan_index.save()
+            except OSError as err:
+                print(f'Cannot save scan index: {err}')
+
+    def unwatch(self, relative_path: str) -> None:
+        """Remove watches of excluded directory and its subdirectories"""
+        path = p.join(self.dropbox_path, relative_path)
+        if self.watch_manager is None or not self.watched(path):
+            return
+        prefix = p.join(path, '')
+        paths = [watched for watched in self._wds if watched == path or watched.startswith(prefix)]
+        self.watch_manager.rm_watch([self._wds.pop(watched) for watched in paths])
+
+    def process_IN_IGNORED(self, event: pyinotify.Event):
+        """Watch was removed with its directory or by unwatch, directory created at its path is watched again"""
+        if self._wds.get(event.path) == event.wd:
+            del self._wds[event.path]
+
+    def process_IN_Q_OVERFLOW(self, event: pyinotify.Event):
+        """Events were lost by overflow of the kernel queue, directories created meanwhile are found by a scan"""
+        print(f'Inotify queue overflow, recovering {self.dropbox_path}')
+        self.counters['overflows'] += 1
+        METRICS.inc('dropboxignore_overflows_total', root=self.dropbox_path)
+        self.recover_overflow()
+
+    def checkpoint(self) -> None:
+        """Record that events read so far were processed, called from notifier loop after processing events"""
+        self.checkpoints.append(time.time())
+
+    def recover_overflow(self) -> int:
+        """Process directories created while events were lost, only directories modified since the queue was last
+        read empty are listed, most recently modified first and at most overflow_limit of them
+
+        New directory changes mtime of its parent, which is watched unless it is new as well, so new directories are
+        found among subdirectories of modified watched directories. Subtrees of new directories are scanned whole.
+
+        :return: number of listed directories
+        :rtype: int
+        """
+        started = time.monotonic()
+        self.flush()
+        # One second of slack for filesystems with coarse timestamps
+        since = self.checkpoints[0] - 1.0
+        modified: List[Tuple[float, str]] = []
+        for path in list(self._wds):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if S_ISDIR(stat.st_mode) and stat.st_mtime >= since:
+                modified.append((stat.st_mtime, path))
+        modified.sort(reverse=True)
+
+        new: List[str] = []
+        for _, path in modified[:self.overflow_limit]:
+            try:
+                with os.scandir(path) as entries:
+                    new.extend(p.relpath(entry.path, self.dropbox_path) for entry in entries
+                               if entry.is_dir(follow_symlinks=False) and not self.watched(entry.path))
+            except OSError:
+                continue
+        self.process_directories(new)
+
+        elapsed = time.monotonic() - started
+        METRICS.observe('dropboxignore_overflow_recovery_seconds', elapsed, root=self.dropbox_path)
+        listed = min(len(modified), self.overflow_limit)
+        print(f'Recovered from overflow in {elapsed:.2f} s: {listed} modified directories listed, '
+              f'{len(new)} new directories found')
+        if len(modified) > self.overflow_limit:
+            print(f'Overflow recovery limit reached, {len(modified) - self.overflow_limit} modified directories '
+                  f'were not listed')
+        return listed
+
     def process_default(self, event: pyinotify.Event):
         """Event handler checking if event path is ignored and synced by Dropbox
 
@@ -204,64 +2421,739 @@ class EventHandler(pyinotify.ProcessEvent):
         :param event: Object of raised event
         :type event: pyinotify.Event
         """
+        if p.basename(event.pathname) == '.dropboxignore':
+            relative_path = '' if event.pathname == self.dropbox_ignore_file else \
+                p.relpath(p.dirname(p.normpath(event.pathname)), self.dropbox_path)
+            if event.mask & pyinotify.IN_CREATE:
+                # Created file is usually still empty, it is read when its writer closes it
+                self.watch_dropboxignore(relative_path)
+                return
+            if event.mask & pyinotify.IN_MOVED_TO:
+                self.watch_dropboxignore(relative_path)
+            if relative_path:
+                self.reload_layer(relative_path)
+            else:
+                self.reload()
+            return
+
+        METRICS.inc('dropboxignore_events_total', type=event.maskname)
+        # Dropbox excludes directories only, so events of files are dropped before any work on their paths
+        if not event.dir:
+            METRICS.inc('dropboxignore_events_dropped_total', reason='not directory')
+            return
+
         relative_path = p.relpath(p.normpath(event.pathname), self.dropbox_path)
+        self.counters['received'] += 1
 
-        # Test if ignored
-        if test_if_ignored(relative_path, self.rules):
-            dropbox_exclude(relative_path, self.dropbox_path)
+        if self.coalesce_window <= 0:
+            self.process_directories([relative_path])
+            return
 
+        if relative_path in self._pending:
+            self.counters['coalesced'] += 1
+            METRICS.inc('dropboxignore_events_dropped_total', reason='duplicate')
+        else:
+            self._pending.add(relative_path)
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        self.poll()
 
-def main() -> None:
-    if len(sys.argv) != 2:
-        print('USAGE: dropboxignore $PATH_TO_DROPBOX_DIRECTORY')
-        sys.exit(RETURN_CODES.WRONG_NUMBER_OF_ARGS)
-    dropbox_path = sys.argv[1]
+    def poll(self) -> None:
+        """Process collected events once coalesce_window passed since the first of them, called from notifier loop"""
+        if self._pending_since is not None and time.monotonic() - self._pending_since >= self.coalesce_window:
+            self.flush()
+
+    def flush(self) -> None:
+        relative_paths, self._pending, self._pending_since = self._pending, set(), None
+        self.process_directories(relative_paths)
+
+    def process_directories(self, relative_paths: Iterable[str]) -> None:
+        """Process directories reported by events, subtrees of new directories are watched and scanned right away, so
+        directories created before their parent was watched (`mkdir -p`, tree moved in) are not missed"""
+        relative_paths = list(relative_paths)
+        self.process_paths(relative_paths)
+        for relative_path in relative_paths:
+            ignored = self.watch_subtree(relative_path)
+            if ignored:
+                self.process_paths(ignored)
+
+    def process_paths(self, relative_paths: Iterable[str]) -> None:
+        """Exclude ignored paths, paths inside an ignored path are skipped without matching"""
+        ignored_path = None
+        for relative_path in sorted(relative_paths, key=lambda path: path.split(p.sep)):
+            if ignored_path is not None and is_subpath(relative_path, ignored_path):
+                self.counters['coalesced'] += 1
+                METRICS.inc('dropboxignore_events_dropped_total', reason='inside ignored')
+                continue
+
+            # Test if ignored
+            self.counters['processed'] += 1
+            if self.verdicts.test(relative_path, self.rules):
+                ignored_path = relative_path
+                if self.workers is not None:
+                    self.workers.submit(dropbox_exclude, relative_path, self.dropbox_path, self.index, self.queue)
+                else:
+                    dropbox_exclude(relative_path, self.dropbox_path, self.index, self.queue)
+                self.unwatch(relative_path)
+
+
+class BackgroundSweep(object):
+    """Periodic walk of Dropbox directory excluding ignored directories missed by events, e.g. created while the
+    daemon was down or mounted into the tree
+
+    The walk visits at most rate directories per second, so it takes only a small share of disk I/O. Its progress is
+    kept in a scan index, so every pass resumes where the previous one stopped and does not list directories which
+    did not change since the previous pass.
+    """
+
+    def __init__(self, handler: EventHandler, rate: float = 100.0, interval: float = 3600.0,
+                 index_path: Optional[str] = None):
+        """
+        :param handler: handler of watched directory, its rules, index and workers are used
+        :type handler: EventHandler
+        :param rate: maximal number of directories visited per second
+        :type rate: float
+        :param interval: seconds between the end of a pass and the start of the next one
+        :type interval: float
+        :param index_path: file storing progress of sweeps (default: file in ~/.cache/dropboxignore)
+        :type index_path: Optional[str]
+        """
+        self.handler = handler
+        self.rate = rate
+        self.interval = interval
+        self.scan_index = ScanIndex(index_path or self.default_path(handler.dropbox_path), checkpoint_interval=10.0)
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.passes = 0
+        self.ignored = 0
+
+    @staticmethod
+    def default_path(dropbox_path: str) -> str:
+        return cache_path('sweep', dropbox_path)
+
+    def sweep(self) -> bool:
+        """Walk the tree once, resuming an interrupted pass
+
+        :return: True if the pass was finished, False if it was stopped
+        :rtype: bool
+        """
+        handler = self.handler
+        rules = handler.rules
+        self.scan_index.load(rules_digest(rules), nested=isinstance(rules.matcher, RuleLayers))
+        ignored: Set[str] = set()
+        next_visit = time.monotonic()
+
+        def pace() -> bool:
+            nonlocal next_visit
+            # Time of directories not visited while waiting is not saved up for bursts
+            next_visit = max(next_visit, time.monotonic()) + 1.0 / self.rate
+            return not self.stopped.wait(next_visit - time.monotonic())
+
+        def descend(subrelpath: str, _: os.DirEntry) -> bool:
+            if subrelpath in ignored:
+                ignored.discard(subrelpath)
+                return False
+            return True
+
+        index = exclusion_index(handler.index, handler.queue)
+        excluded = (lambda subrelpath: index.find(subrelpath) is not None) if index is not None else None
+
+        # Directories removed since the previous pass are skipped by the walk, so every pass makes progress
+        walk = walk_directories(handler.dropbox_path, descend, follow_symlinks=False, scan_index=self.scan_index,
+                                pace=pace, excluded=excluded)
+        for subrelpath, _ in walk:
+            METRICS.inc('dropboxignore_sweep_directories_total', root=handler.dropbox_path)
+            if observed_test_if_ignored(subrelpath, rules):
+                ignored.add(subrelpath)
+                self.ignored += 1
+                METRICS.inc('dropboxignore_sweep_ignored_total', root=handler.dropbox_path)
+                if handler.workers is not None:
+                    handler.workers.submit(dropbox_exclude, subrelpath, handler.dropbox_path, handler.index,
+                                           handler.queue)
+                else:
+                    dropbox_exclude(subrelpath, handler.dropbox_path, handler.index, handler.queue)
+        if self.stopped.is_set():
+            return False
+
+        self.scan_index.save()
+        self.passes += 1
+        METRICS.inc('dropboxignore_sweep_passes_total', root=handler.dropbox_path)
+        return True
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                if self.sweep():
+                    print(f'Background sweep of {self.handler.dropbox_path} finished')
+            except Exception as err:
+                print(f'Exception during background sweep: {err}')
+            self.stopped.wait(self.interval)
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name='dropboxignore-sweep', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop sweeping, progress of unfinished pass is saved"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class OverflowHandler(pyinotify.ProcessEvent):
+    """Default processing of notifier for events without watch, overflow of inotify queue shared by handlers of
+    several Dropbox paths is recovered by all of them"""
+
+    def my_init(self, handlers: List[EventHandler]):
+        self.handlers = handlers
+
+    def process_IN_Q_OVERFLOW(self, event: pyinotify.Event):
+        for handler in self.handlers:
+            handler.process_IN_Q_OVERFLOW(event)
+
+    def process_default(self, event: pyinotify.Event):
+        """Events of removed watches are dropped"""
+
+
+async def dropbox_exclude_async(ignore_path: str, dropbox_path: str, index: ExclusionIndex) -> str:
+    """Exclude path without blocking event loop
+
+    `dropbox` command of CliBackend runs as asyncio subprocess, requests of other backends run in the default
+    executor of the loop.
+
+    :return: action taken: "excluded", "already excluded" or "failed"
+    :rtype: str
+    """
+    cli = isinstance(index.backend, CliBackend)
+    loop = asyncio.get_event_loop()
+    if index.is_stale():
+        if cli:
+            process = await asyncio.create_subprocess_exec('dropbox', 'exclude', 'list',
+                                                           stdout=asyncio.subprocess.PIPE,
+                                                           **index.backend.command_options())
+            already_excluded, _ = await process.communicate()
+            index.load(already_excluded.decode('utf-8'))
+        else:
+            await loop.run_in_executor(None, index.refresh)
+
+    already_excluded_path = index.find(ignore_path)
+    if already_excluded_path is not None:
+        print(f'Path {ignore_path} already excluded by {already_excluded_path}')
+        return 'already excluded'
+
+    absolute_ignore_path = p.join(dropbox_path, ignore_path)
+    print(f'Path {absolute_ignore_path} excluded')
+    if cli:
+        process = await asyncio.create_subprocess_exec('dropbox', 'exclude', 'add', p.abspath(absolute_ignore_path),
+                                                       **index.backend.command_options())
+        succeeded = await process.wait() == 0
+    else:
+        succeeded = await loop.run_in_executor(None, index.backend.add, [absolute_ignore_path])
+    if not succeeded:
+        index.invalidate()
+        return 'failed'
+    index.add(ignore_path)
+    return 'excluded'
+
+
+class AsyncEventHandler(EventHandler):
+    """Event handler passing classified paths to an asyncio queue instead of excluding them"""
+
+    def __init__(self, dropbox_path: str, rules: Rules, results: asyncio.Queue,
+                 index: Optional[ExclusionIndex] = None, watch_manager: Optional[pyinotify.WatchManager] = None,
+                 pevent=None, **kargs):
+        self.results = results
+        super().__init__(dropbox_path, rules, index, watch_manager=watch_manager, pevent=pevent, **kargs)
+
+    def process_paths(self, relative_paths: Iterable[str]) -> None:
+        for relative_path in relative_paths:
+            self.counters['processed'] += 1
+            ignored = self.verdicts.test(relative_path, self.rules)
+            if ignored:
+                self.unwatch(relative_path)
+            self.results.put_nowait((self, relative_path, ignored))
+
+
+class AsyncWatcher(object):
+    """Watcher of any number of Dropbox directories sharing one inotify instance and asyncio event loop
+
+    Asynchronous iteration over watcher yields (path, verdict, action) for every event path, where verdict tells if
+    path is ignored and action is the result of dropbox_exclude_async (None for paths which are not ignored).
+    """
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.watch_manager = pyinotify.WatchManager()
+        self.results: asyncio.Queue = asyncio.Queue()
+        self.handlers: List[AsyncEventHandler] = []
+        self.notifier = pyinotify.AsyncioNotifier(self.watch_manager, self.loop,
+                                                  default_proc_fun=OverflowHandler(handlers=self.handlers))
+
+    def add_root(self, dropbox_path: str, rules: Rules, index: Optional[ExclusionIndex] = None,
+                 mask: int = WATCHED_EVENTS) -> AsyncEventHandler:
+        """Start watching dropbox_path, its directories matching rules are excluded"""
+        handler = AsyncEventHandler(dropbox_path, rules, self.results, index, self.watch_manager)
+        handler.watch(mask)
+        self.handlers.append(handler)
+        return handler
+
+    def close(self) -> None:
+        self.notifier.stop()
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def iterate(self) -> AsyncIterator[Tuple[str, bool, Optional[str]]]:
+        while True:
+            handler, relative_path, ignored = await self.results.get()
+            action = None
+            if ignored:
+                action = await dropbox_exclude_async(relative_path, handler.dropbox_path, handler.index)
+            yield p.join(handler.dropbox_path, relative_path), ignored, action
+
+
+async def watch_async(watcher: AsyncWatcher) -> None:
+    """Run watcher until cancelled, exclusions are reported by dropbox_exclude_async"""
+    async for _ in watcher:
+        pass
+
+
+def parse_arguments(argv: List[str]) -> argparse.Namespace:
+    parser = ArgumentParser(prog='dropboxignore')
+    parser.add_argument('dropbox_path', metavar='$PATH_TO_DROPBOX_DIRECTORY', nargs='+',
+                        help='Dropbox directories watched by this process')
+    parser.add_argument('--dropbox-home', metavar='DIR', action='append',
+                        help='home directory of Dropbox daemon of every Dropbox directory, in their order, used '
+                             'for `dropbox` command and command socket (default: current home)')
+    parser.add_argument('--flush-size', type=int, default=100,
+                        help='maximal number of paths excluded by a single dropbox call (default: %(default)s)')
+    parser.add_argument('--flush-interval', type=float, default=1.0,
+                        help='maximal number of seconds a path waits for exclusion (default: %(default)s)')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='regex',
+                        help='rule matching engine (default: %(default)s)')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='cli',
+                        help='way of talking to Dropbox: `dropbox` command or command socket of Dropbox daemon '
+                             '(default: %(default)s)')
+    parser.add_argument('--command-socket', metavar='PATH',
+                        help='command socket of Dropbox daemon used by socket backend '
+                             '(default: ~/.dropbox/command_socket)')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='number of threads listing directories during initial scan (default: %(default)s)')
+    parser.add_argument('--no-follow-symlinks', action='store_true',
+                        help='do not scan directories behind symlinks')
+    parser.add_argument('--one-file-system', action='store_true',
+                        help='do not scan directories on other filesystems than the Dropbox directory')
+    parser.add_argument('--scan-index', metavar='PATH',
+                        help='file storing scanned directories to skip unchanged ones on restart '
+                             '(default: file in ~/.cache/dropboxignore)')
+    parser.add_argument('--no-scan-index', action='store_true',
+                        help='scan whole directory tree on every start')
+    parser.add_argument('--coalesce-window', type=float, default=0.1, metavar='SECONDS',
+                        help='time events are collected and deduplicated before matching (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='number of threads excluding matched paths while watching (default: %(default)s)')
+    parser.add_argument('--worker-queue-size', type=int, default=1000,
+                        help='number of matched paths waiting for workers before event reading is paused '
+                             '(default: %(default)s)')
+    parser.add_argument('--overflow-scan-limit', type=int, default=10000, metavar='N',
+                        help='maximal number of modified directories listed to recover events lost by overflow of '
+                             'inotify queue (default: %(default)s)')
+    parser.add_argument('--sweep-interval', type=float, default=0.0, metavar='SECONDS',
+                        help='walk watched directories in background every SECONDS, excluding ignored directories '
+                             'missed by events, 0 disables sweeps (default: %(default)s)')
+    parser.add_argument('--sweep-rate', type=float, default=100.0, metavar='DIRS',
+                        help='maximal number of directories visited per second by background sweep '
+                             '(default: %(default)s)')
+    parser.add_argument('--asyncio', action='store_true',
+                        help='watch path on asyncio event loop, calling Dropbox asynchronously')
+    parser.add_argument('--no-nested', action='store_true',
+                        help='apply only the root .dropboxignore, ignoring .dropboxignore files in subdirectories')
+    parser.add_argument('--no-rule-cache', action='store_true',
+                        help='parse .dropboxignore on every start instead of loading rules cached in '
+                             '~/.cache/dropboxignore/rules')
+    parser.add_argument('--verdict-cache-size', type=int, default=10000,
+                        help='number of cached verdicts of watched paths, 0 disables the cache (default: %(default)s)')
+    parser.add_argument('--profile-rules', action='store_true',
+                        help='record evaluations, hits and time of every rule and print report after the initial '
+                             'scan and on exit')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve metrics in Prometheus text format on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--stats-file', metavar='PATH', help='file to which metrics are written periodically')
+    parser.add_argument('--stats-interval', type=float, default=10.0,
+                        help='seconds between writes of --stats-file (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.dropbox_home is not None and len(args.dropbox_home) != len(args.dropbox_path):
+        parser.error('--dropbox-home must be given once for every Dropbox directory')
+    if len(set(map(p.abspath, args.dropbox_path))) != len(args.dropbox_path):
+        parser.error('Dropbox directories must be distinct')
+    if args.scan_index is not None and len(args.dropbox_path) > 1:
+        parser.error('--scan-index can be used with a single Dropbox directory only')
+    if args.command_socket is not None and len(args.dropbox_path) > 1:
+        parser.error('--command-socket can be used with a single Dropbox directory only, use --dropbox-home')
+    if args.stats_interval <= 0:
+        parser.error('--stats-interval must be positive')
+    if args.verdict_cache_size < 0:
+        parser.error('--verdict-cache-size must not be negative')
+    if args.sweep_interval < 0:
+        parser.error('--sweep-interval must not be negative')
+    if args.sweep_rate <= 0:
+        parser.error('--sweep-rate must be positive')
+    if args.sweep_interval > 0 and args.asyncio:
+        parser.error('--sweep-interval cannot be used with --asyncio')
+    if args.overflow_scan_limit < 1:
+        parser.error('--overflow-scan-limit must be at least 1')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.worker_queue_size < 1:
+        parser.error('--worker-queue-size must be at least 1')
+    if args.coalesce_window < 0:
+        parser.error('--coalesce-window must not be negative')
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.flush_size < 1:
+        parser.error('--flush-size must be at least 1')
+    if args.flush_interval <= 0:
+        parser.error('--flush-interval must be positive')
+    return args
+
+
+def watch_asyncio(roots: List['DropboxRoot']) -> None:
+    loop = asyncio.get_event_loop()
+    watcher = AsyncWatcher(loop)
+    try:
+        for root in roots:
+            handler = watcher.add_root(root.path, root.rules, root.index)
+            print(f'Watching path {root.path} ({handler.watched_directories()} directories)')
+        loop.run_until_complete(watch_async(watcher))
+    except (pyinotify.NotifierError, pyinotify.WatchManagerError, OSError) as err:
+        print(f'Cannot watch path: {err}')
+        sys.exit(RETURN_CODES.CANNOT_WATCH_PATH)
+    finally:
+        watcher.close()
+
+
+class RuleExplainer(object):
+    """Finds rule deciding verdict of a path, evaluating rules one by one with their own matchers"""
+
+    def __init__(self):
+        self._matchers: Dict[Tuple[Rule, str], Matcher] = {}
+
+    def rule_matcher(self, rule: Rule, engine: str) -> Matcher:
+        matcher = self._matchers.get((rule, engine))
+        if matcher is None:
+            matcher = self._matchers[(rule, engine)] = ENGINES[engine]((rule,))
+        return matcher
+
+    def explain(self, path: str, rules: Rules, origin: str = '.dropboxignore') -> Optional[Tuple[str, Rule]]:
+        """Return file and rule deciding verdict of path, negated rule for paths brought back, None without match"""
+        if isinstance(rules.matcher, RuleLayers):
+            components = path.split('/')
+            for depth in range(len(components) - 1, -1, -1):
+                relpath = '/'.join(components[:depth])
+                layer = rules.matcher.layer(relpath)
+                if layer is None:
+                    continue
+                explained = self.explain('/'.join(components[depth:]), layer, p.join(relpath, '.dropboxignore'))
+                if explained is not None:
+                    return explained
+            return None
+
+        if rules.matcher is not None:
+            verdict = rules.matcher.verdict(path)
+        else:
+            verdict = True if test_if_ignored(path, rules) else None
+        if verdict is None:
+            return None
+        engine = 'regex' if isinstance(rules.matcher, AdaptiveMatcher) else rules_engine(rules)
+        for rule in rules.entries:
+            if rule.negated == (verdict is False) and self.rule_matcher(rule, engine).verdict(path) is not None:
+                return origin, rule
+        return None
+
+
+def read_paths(stream, delimiter: bytes, chunk_size: int = 65536) -> Iterator[bytes]:
+    """Iterate over delimited paths of binary stream reading it by chunks, returning whatever data is available"""
+    read = getattr(stream, 'read1', stream.read)
+    rest = b''
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+        *paths, rest = (rest + chunk).split(delimiter)
+        yield from paths
+    if rest:
+        yield rest
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+CHECK_MISSING_LAYERS = 1000
+
+
+def parse_check_arguments(argv: List[str]) -> argparse.Namespace:
+    parser = ArgumentParser(prog='dropboxignore check',
+                            description='Print paths ignored by .dropboxignore, like git check-ignore',
+                            error_code=RETURN_CODES.CHECK_USAGE_ERROR)
+    parser.add_argument('paths', nargs='*', metavar='PATH', help='paths relative to directory of .dropboxignore')
+    parser.add_argument('--stdin', action='store_true', help='read paths from standard input, one per line')
+    parser.add_argument('-z', dest='nul', action='store_true',
+                        help='paths are separated by NUL character instead of newline, in input and output')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print file, line and pattern of rule deciding the verdict of every printed path')
+    parser.add_argument('-n', '--non-matching', action='store_true',
+                        help='print also paths not matching any rule (with --verbose)')
+    parser.add_argument('--rules', default='.dropboxignore', metavar='PATH',
+                        help='.dropboxignore to check against (default: %(default)s)')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='regex',
+                        help='rule matching engine (default: %(default)s)')
+    parser.add_argument('--no-nested', action='store_true',
+                        help='apply only --rules, ignoring .dropboxignore files in subdirectories')
+    parser.add_argument('--no-rule-cache', action='store_true',
+                        help='parse rules every time instead of loading them cached in ~/.cache/dropboxignore/rules')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='number of paths matched before output is written (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.stdin == bool(args.paths):
+        parser.error('give paths either as arguments or with --stdin')
+    if args.non_matching and not args.verbose:
+        parser.error('--non-matching is valid only with --verbose')
+    if args.batch_size < 1:
+        parser.error('--batch-size must be at least 1')
+    return args
+
+
+def check(argv: List[str], stdin=None, stdout=None) -> int:
+    """Run `dropboxignore check`, return 0 if any path is ignored and 1 otherwise"""
+    args = parse_check_arguments(argv)
+    stdin = stdin if stdin is not None else sys.stdin.buffer
+    stdout = stdout if stdout is not None else sys.stdout.buffer
+
+    try:
+        lines = read_dropboxignore(args.rules)
+    except OSError as err:
+        print(f'Cannot open {args.rules}: {err}', file=sys.stderr)
+        return RETURN_CODES.CANNOT_READ_DROPBOXIGNORE
+    try:
+        nested_root = None if args.no_nested else p.dirname(p.abspath(args.rules))
+        cache = None if args.no_rule_cache else RuleCache(RuleCache.default_path())
+        rules = parse_dropboxignore(lines, args.engine, nested_root, cache=cache)
+    except ParsingException as err:
+        print(f'Parsing error of {args.rules}: {err}', file=sys.stderr)
+        return RETURN_CODES.PARSING_ERROR
+    if isinstance(rules.matcher, RuleLayers):
+        # Paths of one directory usually come together (e.g. from find), so only few directories without
+        # .dropboxignore need to be remembered and memory does not grow with the number of checked paths
+        rules.matcher.max_missing = CHECK_MISSING_LAYERS
+
+    delimiter = b'\0' if args.nul else b'\n'
+    explainer = RuleExplainer()
+    if args.stdin:
+        paths: Iterable[bytes] = read_paths(stdin, delimiter)
+    else:
+        paths = (os.fsencode(path) for path in args.paths)
+
+    any_ignored = False
+    for batch in batched(paths, args.batch_size):
+        output = []
+        for raw_path in batch:
+            path = raw_path.decode('utf-8', 'surrogateescape')
+            if not args.nul:
+                path = path.rstrip('\r')
+            relative_path = (path[2:] if path.startswith('./') else path).rstrip('/')
+            if not relative_path:
+                continue
+
+            if not args.verbose:
+                if test_if_ignored(relative_path, rules):
+                    any_ignored = True
+                    output.append(raw_path)
+                continue
+
+            explained = explainer.explain(relative_path, rules)
+            if explained is not None:
+                origin, rule = explained
+                any_ignored = any_ignored or not rule.negated
+                fields = [origin, str(rule.lineno), rule.source.strip()]
+            elif args.non_matching:
+                fields = ['', '', '']
+            else:
+                continue
+            fields = [field.encode('utf-8', 'surrogateescape') for field in fields]
+            if args.nul:
+                output.append(b'\0'.join(fields + [raw_path]))
+            else:
+                output.append(b':'.join(fields) + b'\t' + raw_path)
+
+        if output:
+            stdout.write(delimiter.join(output) + delimiter)
+            stdout.flush()
+
+    return 0 if any_ignored else 1
+
+
+class DropboxRoot(NamedTuple):
+    """Watched Dropbox directory with its rules and connection to its Dropbox daemon"""
+    path: str
+    rules: Rules
+    backend: ExclusionBackend
+    index: ExclusionIndex
+    queue: ExclusionQueue
+    scan_index: Optional[ScanIndex]
+
+
+def prepare_root(dropbox_path: str, home: Optional[str], args: argparse.Namespace,
+                 rule_cache: Optional[RuleCache] = None) -> DropboxRoot:
+    """Check dropbox_path, parse its .dropboxignore and connect to its Dropbox daemon, exit on errors
+
+    :param home: home directory of Dropbox daemon of dropbox_path, current one if not given
+    :type home: Optional[str]
+    :param rule_cache: cache of parsed rules
+    :type rule_cache: Optional[RuleCache]
+    """
+    # Paths passed to Dropbox are joined to dropbox_path, which must not depend on working directory of commands
+    dropbox_path = p.abspath(dropbox_path)
 
     # Check if dropbox path is a directory
     if not p.isdir(dropbox_path):
-        print('Dropbox path is not a directory.')
+        print(f'Dropbox path {dropbox_path} is not a directory.')
         sys.exit(RETURN_CODES.PATH_IS_NOT_DIRECTORY)
 
     # Check for .dropboxignore file
     dropbox_ignore_file = p.join(dropbox_path, '.dropboxignore')
     if not p.exists(dropbox_ignore_file):
-        print('.dropboxignore does not exists')
+        print(f'.dropboxignore does not exists in {dropbox_path}')
         sys.exit(RETURN_CODES.DROPBOXIGNORE_DOES_NOT_EXISTS)
 
     try:
-        opened_file = open(dropbox_ignore_file, 'r')
-        lines = opened_file.readlines()
+        lines = read_dropboxignore(dropbox_ignore_file)
     except Exception as err:
         print(f'Cannot open .dropboxignore in path: {err}')
         sys.exit(RETURN_CODES.CANNOT_READ_DROPBOXIGNORE)
 
     # Parse rules
     try:
-        rules = parse_dropboxignore(lines)
+        rules = parse_dropboxignore(lines, args.engine, None if args.no_nested else dropbox_path, args.profile_rules,
+                                    rule_cache)
     except ParsingException as err:
-        print(f'Parsing error of .dropboxignore: {err}')
+        print(f'Parsing error of {dropbox_ignore_file}: {err}')
         sys.exit(RETURN_CODES.PARSING_ERROR)
 
-    # Initial scan of directory and building ignore tree
+    # Paths already excluded are loaded once and kept up to date by dropbox_exclude
+    if args.backend == 'socket':
+        backend: ExclusionBackend = CommandSocketBackend(dropbox_path, args.command_socket, home=home)
+    else:
+        backend = CliBackend(dropbox_path, home)
+    index = ExclusionIndex(dropbox_path, backend=backend)
+    queue = ExclusionQueue(dropbox_path, index, args.flush_size, args.flush_interval)
+    scan_index = None
+    if not args.no_scan_index:
+        scan_index = ScanIndex(args.scan_index or ScanIndex.default_path(dropbox_path))
+    return DropboxRoot(dropbox_path, rules, backend, index, queue, scan_index)
+
+
+def main() -> None:
+    if sys.argv[1:2] == ['check']:
+        sys.exit(check(sys.argv[2:]))
+
+    args = parse_arguments(sys.argv[1:])
+    homes = args.dropbox_home or [None] * len(args.dropbox_path)
+    rule_cache = None if args.no_rule_cache else RuleCache(RuleCache.default_path())
+    roots = [prepare_root(dropbox_path, home, args, rule_cache)
+             for dropbox_path, home in zip(args.dropbox_path, homes)]
+
+    # Metrics cover the initial scan as well
+    if args.metrics_port is not None:
+        try:
+            serve_metrics(args.metrics_port)
+        except OSError as err:
+            print(f'Cannot serve metrics: {err}')
+            sys.exit(RETURN_CODES.CANNOT_SERVE_METRICS)
+    stats_stop = threading.Event()
+    stats_writer = write_stats(args.stats_file, args.stats_interval, stats_stop) if args.stats_file else None
+
+    # Initial scan of directories and building ignore trees, all paths share one pool listing directories
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else None
     try:
-        pass
-        initial_excludes(dropbox_path, rules)
+        for root in roots:
+            initial_excludes(root.path, root.rules, root.index, root.queue, args.jobs, not args.no_follow_symlinks,
+                             args.one_file_system, root.scan_index, executor)
+            root.queue.flush()
     except Exception as err:
         print(f'Exception during scanning path: {err}')
         sys.exit(RETURN_CODES.SCANNING_ERROR)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
-    # Watch directory
-    events = pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM
+    if args.profile_rules:
+        for root in roots:
+            print(f'Rule profile of initial scan of {root.path}:\n{profile_report(root.rules)}')
+
+    if args.asyncio:
+        watch_asyncio(roots)
+        return
+
+    # Watch directories, all paths share one inotify instance, event loop and exclusion workers
+    events = WATCHED_EVENTS
     wm = pyinotify.WatchManager()
-    notifier = pyinotify.Notifier(wm, EventHandler(dropbox_path, rules))
-    wm.add_watch(dropbox_path, events, rec=True)
+    workers = ExclusionWorkers(args.workers, args.worker_queue_size)
+    handlers = [EventHandler(root.path, root.rules, root.index, root.queue, wm, args.coalesce_window, workers,
+                             root.scan_index, VerdictCache(args.verdict_cache_size), args.overflow_scan_limit,
+                             rule_cache)
+                for root in roots]
+    # With coalescing, notifier wakes up at least once per window to process collected events
+    notifier = pyinotify.Notifier(wm, OverflowHandler(handlers=handlers),
+                                  timeout=int(args.coalesce_window * 1000) or None)
+
+    sweeps: List[BackgroundSweep] = []
+
+    def poll(_: pyinotify.Notifier) -> None:
+        for handler in handlers:
+            handler.poll()
+            handler.checkpoint()
 
     try:
-        print('Watching path')
-        notifier.loop()
-    except pyinotify.NotifierError as err:
+        for handler in handlers:
+            watches = handler.watch(events)
+            print(f'Watching path {handler.dropbox_path} ({watches} directories)')
+        if args.sweep_interval > 0:
+            sweeps = [BackgroundSweep(handler, args.sweep_rate, args.sweep_interval) for handler in handlers]
+            for sweep in sweeps:
+                sweep.start()
+        notifier.loop(callback=poll)
+    except (pyinotify.NotifierError, pyinotify.WatchManagerError, OSError) as err:
         print(f'Cannot watch path: {err}')
         sys.exit(RETURN_CODES.CANNOT_WATCH_PATH)
+    finally:
+        for sweep in sweeps:
+            sweep.stop()
+        for handler in handlers:
+            handler.flush()
+        workers.close()
+        for root, handler in zip(roots, handlers):
+            root.queue.flush()
+            print(f'{root.path}: events received: {handler.counters["received"]}, '
+                  f'coalesced: {handler.counters["coalesced"]}, matched: {handler.counters["processed"]}, '
+                  f'overflows: {handler.counters["overflows"]}, '
+                  f'verdict cache hits: {handler.verdicts.hits}, misses: {handler.verdicts.misses}')
+            if args.profile_rules:
+                print(f'Rule profile of {root.path}:\n{profile_report(handler.rules)}')
+            root.backend.close()
+        print(f'Exclusion queue high-water mark: {workers.high_water}, blocked submissions: {workers.blocked}')
+        stats_stop.set()
+        if stats_writer is not None:
+            stats_writer.join()
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 import setuptools
 import os.path as p
+import re
 
 
 with open('README.md', 'r') as fh:
@@ -12,10 +13,13 @@ if p.isfile(requirement_path):
     with open(requirement_path) as f:
         install_requires = f.read().splitlines()
 
+with open(p.join(the_lib_directory, 'dropboxignore.py')) as f:
+    version = re.search(r"^__version__ = '(.*)'$", f.read(), re.MULTILINE).group(1)
+
 
 setuptools.setup(
     name='dropboxignore',
-    version='0.2.0',
+    version=version,
     scripts=['dropboxignore.py'],
     author='Michał Karol',
     author_email='michal.p.karol@gmail.com',
@@ -23,7 +27,7 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url='https://github.com/MichalKarol/dropboxignore',
-    packages=setuptools.find_packages(exclude=['tests']),
+    packages=setuptools.find_packages(exclude=['tests', 'benchmarks']),
     classifiers=[
         'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
@@ -0,0 +1,99 @@
+import concurrent.futures
+import random
+import dropboxignore
+from dropboxignore import AdaptiveMatcher, parse_dropboxignore
+
+LINES = ['project/**/dist\n', '*.egg-info\n', 'build\n', 'node_modules\n', '!keep\n', '!*.important\n']
+
+
+def generate_paths(count, seed=0):
+    rng = random.Random(seed)
+    names = ['src', 'lib', 'node_modules', 'build', 'keep', 'x.important', 'a.egg-info', 'dist', 'project']
+    return ['/'.join(rng.choice(names) for _ in range(rng.randint(1, 4))) for _ in range(count)]
+
+
+def test_adaptive_matcher_same_verdicts():
+    # GIVEN
+    rules = parse_dropboxignore(LINES, 'regex')
+    matcher = AdaptiveMatcher(rules.entries, reorder_interval=10, timing_interval=1)
+    paths = generate_paths(2000)
+
+    # WHEN
+    verdicts = [matcher.verdict(path) for path in paths]
+
+    # THEN
+    assert verdicts == [rules.matcher.verdict(path) for path in paths]
+
+
+def test_adaptive_matcher_reorders_by_hits():
+    # GIVEN
+    rules = parse_dropboxignore(LINES, 'adaptive')
+    matcher = AdaptiveMatcher(rules.entries, reorder_interval=100, deterministic=True)
+
+    # WHEN
+    for _ in range(100):
+        matcher.verdict('a/node_modules')
+
+    # THEN
+    assert [rule.rule.source for rule in matcher.ignoring][:2] == ['node_modules', 'build']
+    assert matcher.ignoring[0].evaluations == 1 + 99
+
+
+def test_adaptive_matcher_deterministic_order():
+    # GIVEN
+    paths = generate_paths(500, seed=1)
+    matchers = [AdaptiveMatcher(parse_dropboxignore(LINES).entries, reorder_interval=50, deterministic=True)
+                for _ in range(2)]
+
+    # WHEN
+    for matcher in matchers:
+        for path in paths:
+            matcher.verdict(path)
+
+    # THEN
+    assert [rule.rule for rule in matchers[0].ignoring] == [rule.rule for rule in matchers[1].ignoring]
+    assert [rule.rule for rule in matchers[0].negated] == [rule.rule for rule in matchers[1].negated]
+
+
+def test_adaptive_engine():
+    # GIVEN
+    rules = parse_dropboxignore(LINES, 'adaptive')
+
+    # WHEN / THEN
+    assert isinstance(rules.matcher, AdaptiveMatcher)
+    assert dropboxignore.test_if_ignored('a/node_modules', rules)
+    assert not dropboxignore.test_if_ignored('build/keep', rules)
+    assert not dropboxignore.test_if_ignored('src', rules)
+
+
+def test_adaptive_matcher_negated_only_after_hit():
+    # GIVEN
+    rules = parse_dropboxignore(LINES, 'regex')
+    matcher = AdaptiveMatcher(rules.entries, deterministic=True)
+
+    # WHEN
+    results = [matcher.test(path) for path in ['src/keep', 'src/lib', 'build/keep']]
+
+    # THEN
+    assert results == [False, False, False]
+    assert sum(rule.evaluations for rule in matcher.negated) == 1
+    assert matcher.verdict('src/keep') is False
+
+
+def test_adaptive_matcher_threads():
+    # GIVEN
+    rules = parse_dropboxignore(LINES, 'regex')
+    matcher = AdaptiveMatcher(rules.entries, reorder_interval=7, timing_interval=3)
+    paths = generate_paths(2000, seed=2)
+    expected = [rules.matcher.verdict(path) for path in paths]
+
+    # WHEN
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda _: [matcher.verdict(path) for path in paths], range(4)))
+
+    # THEN
+    assert results == [expected] * 4
+    assert matcher.paths == 4 * len(paths)
+    ignored = sum(any(rule.match(path, path.split('/')) for rule in matcher.ignoring) for path in paths)
+    assert sum(rule.hits for rule in matcher.ignoring) == 4 * ignored
+    assert sum(rule.evaluations for rule in matcher.ignoring) >= 4 * len(paths)
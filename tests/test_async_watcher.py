@@ -0,0 +1,104 @@
+import asyncio
+from unittest.mock import patch, MagicMock
+from dropboxignore import AsyncWatcher, ExclusionIndex, FakeBackend, dropbox_exclude_async, parse_dropboxignore
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(asyncio.wait_for(coroutine, 5))
+    finally:
+        loop.close()
+
+
+async def fake_dropbox_exclude_async(ignore_path, dropbox_path, index):
+    return 'excluded'
+
+
+@patch('dropboxignore.dropbox_exclude_async', fake_dropbox_exclude_async)
+def test_async_watcher_yields_results(tmp_path):
+    # GIVEN
+    async def watch():
+        watcher = AsyncWatcher()
+        watcher.add_root(str(tmp_path), parse_dropboxignore(['node_modules']), MagicMock())
+        (tmp_path / 'node_modules').mkdir()
+        (tmp_path / 'src').mkdir()
+        results = []
+        async for result in watcher:
+            results.append(result)
+            if len(results) == 2:
+                break
+        watcher.close()
+        return results
+
+    # WHEN
+    results = run(watch())
+
+    # THEN
+    assert sorted(results) == [(str(tmp_path / 'node_modules'), True, 'excluded'), (str(tmp_path / 'src'), False, None)]
+
+
+def fake_process(returncode, stdout=b''):
+    process = MagicMock()
+
+    async def wait():
+        return returncode
+
+    async def communicate():
+        return stdout, b''
+
+    process.wait = wait
+    process.communicate = communicate
+    return process
+
+
+def test_dropbox_exclude_async_excluded():
+    # GIVEN
+    processes = [fake_process(0, b'Excluded:\n'), fake_process(0)]
+    calls = []
+
+    async def create_subprocess_exec(*args, **kwargs):
+        calls.append(args)
+        return processes.pop(0)
+
+    # WHEN
+    with patch('asyncio.create_subprocess_exec', create_subprocess_exec):
+        index = ExclusionIndex('/root')
+        action = run(dropbox_exclude_async('node_modules', '/root', index))
+
+    # THEN
+    assert action == 'excluded'
+    assert calls == [('dropbox', 'exclude', 'list'), ('dropbox', 'exclude', 'add', '/root/node_modules')]
+    assert index.find('node_modules') == 'node_modules'
+
+
+def test_dropbox_exclude_async_already_excluded():
+    # GIVEN
+    calls = []
+
+    async def create_subprocess_exec(*args, **kwargs):
+        calls.append(args)
+        return fake_process(0, b'Excluded:\nnode_modules\n')
+
+    # WHEN
+    with patch('asyncio.create_subprocess_exec', create_subprocess_exec):
+        action = run(dropbox_exclude_async('node_modules', '/root', ExclusionIndex('/root')))
+
+    # THEN
+    assert action == 'already excluded'
+    assert calls == [('dropbox', 'exclude', 'list')]
+
+
+@patch('asyncio.create_subprocess_exec')
+def test_dropbox_exclude_async_backend(create_subprocess_exec_mock):
+    # GIVEN
+    index = ExclusionIndex('/root', backend=FakeBackend('/root'))
+
+    # WHEN
+    action = run(dropbox_exclude_async('node_modules', '/root', index))
+
+    # THEN
+    assert action == 'excluded'
+    assert not create_subprocess_exec_mock.called
+    assert index.backend.calls == [('list', []), ('add', ['/root/node_modules'])]
+    assert index.find('node_modules') == 'node_modules'
@@ -0,0 +1,160 @@
+import os
+import socket
+import threading
+from unittest.mock import patch
+import pytest
+from dropboxignore import (BackendException, CliBackend, CommandSocketBackend, ExclusionBackend, ExclusionIndex,
+                           FakeBackend, dropbox_exclude)
+
+
+def serve_command_socket(path, responses, requests):
+    """Accept connections on unix socket path answering each request with the next of responses"""
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+
+    def serve():
+        while responses:
+            connection, _ = server.accept()
+            with connection, connection.makefile('rwb') as stream:
+                while responses:
+                    request = []
+                    for line in iter(stream.readline, b''):
+                        line = line.decode('utf-8').rstrip('\n')
+                        request.append(line)
+                        if line == 'done':
+                            break
+                    if not request:
+                        break
+                    requests.append(request)
+                    response = responses.pop(0)
+                    if response is None:
+                        break
+                    stream.write(response.encode('utf-8'))
+                    stream.flush()
+        server.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return thread
+
+
+@patch('subprocess.check_output')
+def test_cli_backend_list(check_output_mock):
+    # GIVEN
+    check_output_mock.return_value = b'Excluded:\na/node_modules\nb/build\n'
+
+    # WHEN
+    excluded = CliBackend('/root').list()
+
+    # THEN
+    assert excluded == ['a/node_modules', 'b/build']
+    check_output_mock.assert_called_once_with(['dropbox', 'exclude', 'list'], cwd='/root')
+
+
+def test_command_socket_backend_single_connection(tmp_path):
+    # GIVEN
+    socket_path = str(tmp_path / 'command_socket')
+    requests = []
+    thread = serve_command_socket(socket_path, [
+        f'ok\nignore_set\t{tmp_path}/a/node_modules\t{tmp_path}/b\ndone\n',
+        'ok\ndone\n',
+    ], requests)
+    backend = CommandSocketBackend(str(tmp_path), socket_path)
+
+    # WHEN
+    excluded = backend.list()
+    added = backend.add([f'{tmp_path}/c', f'{tmp_path}/d'])
+    backend.close()
+    thread.join(5)
+
+    # THEN
+    assert excluded == ['a/node_modules', 'b']
+    assert added
+    assert requests == [['get_ignore_set', 'done'],
+                        ['ignore_set_add', f'paths\t{tmp_path}/c\t{tmp_path}/d', 'done']]
+
+
+def test_command_socket_backend_reconnects(tmp_path):
+    # GIVEN
+    socket_path = str(tmp_path / 'command_socket')
+    requests = []
+    thread = serve_command_socket(socket_path, ['ok\ndone\n', None, 'ok\ndone\n'], requests)
+    backend = CommandSocketBackend(str(tmp_path), socket_path)
+    assert backend.remove([f'{tmp_path}/a'])
+
+    # WHEN
+    removed = backend.remove([f'{tmp_path}/b'])
+    backend.close()
+    thread.join(5)
+
+    # THEN
+    assert removed
+    assert len(requests) == 3
+
+
+def test_command_socket_backend_refused(tmp_path):
+    # GIVEN
+    socket_path = str(tmp_path / 'command_socket')
+    thread = serve_command_socket(socket_path, ['notok\nerror\tnot running\ndone\n'], [])
+    backend = CommandSocketBackend(str(tmp_path), socket_path)
+
+    # WHEN
+    added = backend.add([f'{tmp_path}/a'])
+    backend.close()
+    thread.join(5)
+
+    # THEN
+    assert not added
+
+
+def test_command_socket_backend_not_running(tmp_path):
+    # GIVEN
+    backend = CommandSocketBackend(str(tmp_path), str(tmp_path / 'missing'))
+
+    # WHEN / THEN
+    with pytest.raises(BackendException):
+        backend.list()
+
+
+def test_fake_backend_dropbox_exclude():
+    # GIVEN
+    backend = FakeBackend('/root', ['a'])
+    index = ExclusionIndex('/root', backend=backend)
+
+    # WHEN
+    dropbox_exclude('a/node_modules', '/root', index)
+    dropbox_exclude('b/node_modules', '/root', index)
+
+    # THEN
+    assert backend.excluded == {'a', 'b/node_modules'}
+    assert backend.calls == [('list', []), ('add', ['/root/b/node_modules'])]
+    assert index.find('b/node_modules/lib') == 'b/node_modules'
+
+
+@patch('subprocess.call', return_value=0)
+def test_cli_backend_relative_root(call_mock):
+    # GIVEN
+    backend = CliBackend(os.path.join('e2e', 'Dropbox'))
+
+    # WHEN
+    backend.add([os.path.join('e2e', 'Dropbox', 'node_modules')])
+    backend.remove([os.path.join('e2e', 'Dropbox', 'build')])
+
+    # THEN
+    assert [call[0][0][3:] for call in call_mock.call_args_list] == [
+        [os.path.abspath(os.path.join('e2e', 'Dropbox', 'node_modules'))],
+        [os.path.abspath(os.path.join('e2e', 'Dropbox', 'build'))],
+    ]
+    assert call_mock.call_args[1]['cwd'] == os.path.join('e2e', 'Dropbox')
+
+
+def test_backend_requests_abstract():
+    # GIVEN
+    class ListingBackend(ExclusionBackend):
+        def list(self):
+            return []
+
+    # WHEN / THEN
+    with pytest.raises(TypeError):
+        ListingBackend('/dropbox')
@@ -0,0 +1,162 @@
+import json
+import shutil
+import threading
+import time
+import pytest
+import dropboxignore
+from dropboxignore import (METRICS, BackgroundSweep, EventHandler, ExclusionIndex, FakeBackend, parse_arguments,
+                           parse_dropboxignore)
+
+
+@pytest.fixture
+def handler(tmp_path):
+    root = tmp_path / 'Dropbox'
+    for name in ['a', 'b', 'c']:
+        (root / name / 'src').mkdir(parents=True)
+        (root / name / 'node_modules' / 'lib').mkdir(parents=True)
+    index = ExclusionIndex(str(root), backend=FakeBackend(str(root)))
+    return EventHandler(str(root), parse_dropboxignore(['node_modules\n']), index)
+
+
+def test_background_sweep(handler, tmp_path):
+    # GIVEN
+    METRICS.reset()
+    sweep = BackgroundSweep(handler, rate=10000, index_path=str(tmp_path / 'sweep.json'))
+
+    # WHEN
+    finished = sweep.sweep()
+
+    # THEN
+    assert finished
+    assert handler.index.backend.excluded == {'a/node_modules', 'b/node_modules', 'c/node_modules'}
+    assert (sweep.passes, sweep.ignored) == (1, 3)
+    assert METRICS.value('dropboxignore_sweep_directories_total', root=handler.dropbox_path) == 9
+    assert (tmp_path / 'sweep.json').exists()
+
+
+def test_background_sweep_resumes(handler, tmp_path, monkeypatch):
+    # GIVEN
+    METRICS.reset()
+    sweep = BackgroundSweep(handler, rate=10000, index_path=str(tmp_path / 'sweep.json'))
+    test_if_ignored = dropboxignore.observed_test_if_ignored
+    checked = []
+
+    def stopping_test_if_ignored(path, rules):
+        checked.append(path)
+        if len(checked) == 5:
+            sweep.stopped.set()
+        return test_if_ignored(path, rules)
+
+    monkeypatch.setattr(dropboxignore, 'observed_test_if_ignored', stopping_test_if_ignored)
+
+    # WHEN
+    stopped = sweep.sweep()
+    sweep.stopped = threading.Event()
+    finished = sweep.sweep()
+
+    # THEN
+    assert not stopped
+    assert finished
+    assert len(checked) == len(set(checked)) == 9
+    assert handler.index.backend.excluded == {'a/node_modules', 'b/node_modules', 'c/node_modules'}
+
+
+def test_background_sweep_skips_unchanged(handler, tmp_path):
+    # GIVEN
+    METRICS.reset()
+    sweep = BackgroundSweep(handler, rate=10000, index_path=str(tmp_path / 'sweep.json'))
+    sweep.sweep()
+
+    # WHEN
+    (tmp_path / 'Dropbox' / 'a' / 'src' / 'node_modules').mkdir()
+    sweep.sweep()
+
+    # THEN
+    assert METRICS.value('dropboxignore_sweep_directories_total', root=handler.dropbox_path) == 9 + 1
+    assert 'a/src/node_modules' in handler.index.backend.excluded
+
+
+def test_background_sweep_rate(handler, tmp_path):
+    # GIVEN
+    sweep = BackgroundSweep(handler, rate=100, index_path=str(tmp_path / 'sweep.json'))
+
+    # WHEN
+    start = time.monotonic()
+    sweep.sweep()
+    elapsed = time.monotonic() - start
+
+    # THEN
+    assert elapsed >= 7 / 100
+
+
+def test_background_sweep_thread_stop(handler, tmp_path):
+    # GIVEN
+    sweep = BackgroundSweep(handler, rate=1, index_path=str(tmp_path / 'sweep.json'))
+
+    # WHEN
+    sweep.start()
+    time.sleep(0.1)
+    sweep.stop()
+
+    # THEN
+    assert not sweep.thread.is_alive()
+    assert sweep.passes == 0
+    assert (tmp_path / 'sweep.json').exists()
+
+
+@pytest.mark.parametrize('argv', [
+    ['path', '--sweep-interval', '-1'],
+    ['path', '--sweep-interval', '60', '--sweep-rate', '0'],
+    ['path', '--sweep-interval', '60', '--asyncio'],
+])
+def test_parse_arguments_sweep_errors(argv):
+    # GIVEN
+
+    # WHEN
+    with pytest.raises(SystemExit) as exit_exception:
+        parse_arguments(argv)
+
+    # THEN
+    assert exit_exception.value.code != 0
+
+
+def test_background_sweep_skips_removed_pending(handler, tmp_path, monkeypatch):
+    # GIVEN
+    sweep = BackgroundSweep(handler, rate=10000, index_path=str(tmp_path / 'sweep.json'))
+    test_if_ignored = dropboxignore.observed_test_if_ignored
+
+    def stopping_test_if_ignored(path, rules):
+        sweep.stopped.set()
+        return test_if_ignored(path, rules)
+
+    monkeypatch.setattr(dropboxignore, 'observed_test_if_ignored', stopping_test_if_ignored)
+    sweep.sweep()
+    monkeypatch.setattr(dropboxignore, 'observed_test_if_ignored', test_if_ignored)
+    pending = json.loads((tmp_path / 'sweep.json').read_text())['pending']
+    for relpath in pending:
+        shutil.rmtree(str(tmp_path / 'Dropbox' / relpath))
+
+    # WHEN
+    sweep.stopped = threading.Event()
+    finished = sweep.sweep()
+
+    # THEN
+    assert pending
+    assert finished
+    assert sweep.passes == 1
+    assert json.loads((tmp_path / 'sweep.json').read_text())['pending'] == []
+
+
+def test_background_sweep_retries_failed_exclusions(handler, tmp_path, monkeypatch):
+    # GIVEN
+    sweep = BackgroundSweep(handler, rate=10000, index_path=str(tmp_path / 'sweep.json'))
+    backend = handler.index.backend
+    with monkeypatch.context() as context:
+        context.setattr(backend, 'add', lambda paths: False)
+        sweep.sweep()
+
+    # WHEN
+    sweep.sweep()
+
+    # THEN
+    assert backend.excluded == {'a/node_modules', 'b/node_modules', 'c/node_modules'}
@@ -0,0 +1,57 @@
+import os
+from dropboxignore import ENGINES
+from benchmarks.run import bench_combined, generate_rules, generate_tree, parse_arguments, run_benchmarks
+
+
+def test_generate_tree(tmp_path):
+    # GIVEN
+
+    # WHEN
+    relpaths = generate_tree(str(tmp_path), 50, fanout=5)
+
+    # THEN
+    assert len(relpaths) == 50
+    assert all((tmp_path / relpath).is_dir() for relpath in relpaths)
+
+
+def test_generate_rules():
+    # GIVEN
+
+    # WHEN
+    lines = generate_rules(40)
+
+    # THEN
+    assert len(lines) == 40
+    assert 'node_modules\n' in lines
+
+
+def test_bench_combined_not_slower_than_per_rule():
+    # GIVEN
+    lines = [f'*.glob_{number}\n' for number in range(1000)]
+    relpaths = [f'home/user/project_{number}/src/lib/file.glob_x' for number in range(20)]
+
+    # WHEN
+    results = bench_combined(lines, relpaths, repeat=3)
+
+    # THEN
+    assert results['rules'] == 1000
+    assert results['combined_seconds'] <= results['per_rule_seconds']
+
+
+def test_run_benchmarks():
+    # GIVEN
+    path = os.environ.get('PATH')
+    args = parse_arguments(['--directories', '200', '--rules', '20', '--events', '3', '--repeat', '1',
+                            '--jobs', '1', '2', '--coalesce-window', '0.01', '--flush-interval', '0.05'])
+
+    # WHEN
+    results = run_benchmarks(args)
+
+    # THEN
+    assert results['results']['tree']['directories'] == 200
+    assert set(results['results']['match']) == set(ENGINES)
+    assert results['results']['combined']['rules'] > 0
+    assert results['results']['initial_excludes']['1']['ignored'] == \
+        results['results']['initial_excludes']['2']['ignored'] > 0
+    assert results['results']['events']['excluded'] == 3
+    assert os.environ.get('PATH') == path
@@ -0,0 +1,124 @@
+import io
+from unittest.mock import patch
+import pytest
+from dropboxignore import CHECK_MISSING_LAYERS, RETURN_CODES, check, parse_dropboxignore, read_paths
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+
+
+@pytest.fixture
+def rules_path(tmp_path):
+    (tmp_path / 'project').mkdir()
+    (tmp_path / '.dropboxignore').write_text('node_modules\n!keep\n')
+    (tmp_path / 'project' / '.dropboxignore').write_text('dist\n')
+    return str(tmp_path / '.dropboxignore')
+
+
+def test_read_paths_across_chunks():
+    # GIVEN
+    stream = io.BytesIO(b'a/node_modules\nsrc\nlast')
+
+    # WHEN
+    paths = list(read_paths(stream, b'\n', chunk_size=4))
+
+    # THEN
+    assert paths == [b'a/node_modules', b'src', b'last']
+
+
+def test_check_stdin(rules_path):
+    # GIVEN
+    stdin = io.BytesIO(b'a/node_modules\nsrc\n./project/dist/\nnode_modules/keep\n')
+    stdout = io.BytesIO()
+
+    # WHEN
+    code = check(['--stdin', '--rules', rules_path, '--batch-size', '2'], stdin, stdout)
+
+    # THEN
+    assert code == 0
+    assert stdout.getvalue() == b'a/node_modules\n./project/dist/\n'
+
+
+def test_check_stdin_nul_verbose(rules_path):
+    # GIVEN
+    stdin = io.BytesIO(b'a/node_modules\0src\0project/dist\0x/keep')
+    stdout = io.BytesIO()
+
+    # WHEN
+    code = check(['--stdin', '-z', '-v', '-n', '--rules', rules_path], stdin, stdout)
+
+    # THEN
+    assert code == 0
+    assert stdout.getvalue().split(b'\0') == [
+        b'.dropboxignore', b'1', b'node_modules', b'a/node_modules',
+        b'', b'', b'', b'src',
+        b'project/.dropboxignore', b'1', b'dist', b'project/dist',
+        b'.dropboxignore', b'2', b'!keep', b'x/keep',
+        b'',
+    ]
+
+
+def test_check_nothing_ignored(rules_path):
+    # GIVEN
+    stdout = io.BytesIO()
+
+    # WHEN
+    code = check(['--rules', rules_path, '--no-nested', 'src', 'project/dist'], stdout=stdout)
+
+    # THEN
+    assert code == 1
+    assert stdout.getvalue() == b''
+
+
+def test_check_missing_rules(tmp_path):
+    # GIVEN
+
+    # WHEN
+    code = check(['--rules', str(tmp_path / '.dropboxignore'), 'src'], stdout=io.BytesIO())
+
+    # THEN
+    assert code == RETURN_CODES.CANNOT_READ_DROPBOXIGNORE
+
+
+def test_check_rule_cache(rules_path, tmp_path):
+    # GIVEN
+    stdout = io.BytesIO()
+
+    # WHEN
+    codes = [check(['--rules', rules_path, 'a/node_modules'], stdout=stdout) for _ in range(2)]
+
+    # THEN
+    assert codes == [0, 0]
+    assert stdout.getvalue() == b'a/node_modules\n' * 2
+    assert len(list((tmp_path / 'cache' / 'dropboxignore' / 'rules').iterdir())) == 1
+
+
+def test_check_requires_paths():
+    # GIVEN
+
+    # WHEN
+    with pytest.raises(SystemExit) as exit_exception:
+        check([])
+
+    # THEN
+    assert exit_exception.value.code == RETURN_CODES.CHECK_USAGE_ERROR
+
+
+def test_check_nested_layers_bounded(rules_path):
+    # GIVEN
+    stdin = io.BytesIO(b''.join(f'dir{number}/sub\n'.encode() for number in range(3 * CHECK_MISSING_LAYERS)))
+    parsed = []
+
+    def parsing(*args, **kwargs):
+        parsed.append(parse_dropboxignore(*args, **kwargs))
+        return parsed[-1]
+
+    # WHEN
+    with patch('dropboxignore.parse_dropboxignore', side_effect=parsing):
+        code = check(['--stdin', '--rules', rules_path], stdin, io.BytesIO())
+
+    # THEN
+    assert code == 1
+    assert len(parsed[0].matcher._missing) == CHECK_MISSING_LAYERS
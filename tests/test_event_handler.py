@@ -1,5 +1,7 @@
+import time
 from unittest.mock import patch, MagicMock
-from dropboxignore import EventHandler, Rules
+import pyinotify
+from dropboxignore import EventHandler, Rules, parse_dropboxignore
 
 
 @patch('dropboxignore.test_if_ignored', lambda *_, **__: True)
@@ -26,3 +28,77 @@ def test_event_handler_negative(dropbox_exclude_mock):
 
     # THEN
     assert not dropbox_exclude_mock.called
+
+
+def test_event_handler_watch_skips_ignored(tmp_path):
+    # GIVEN
+    (tmp_path / 'project' / 'node_modules' / 'lib').mkdir(parents=True)
+    (tmp_path / 'project' / 'src').mkdir()
+    wm = pyinotify.WatchManager()
+    ev = EventHandler(str(tmp_path), parse_dropboxignore(['node_modules']), MagicMock(), watch_manager=wm)
+
+    # WHEN
+    watches = ev.watch(pyinotify.IN_CREATE)
+
+    # THEN
+    watched = sorted(watch.path for watch in wm.watches.values())
+    assert watches == 3
+    assert watched == sorted([str(tmp_path), str(tmp_path / 'project'), str(tmp_path / 'project' / 'src')])
+    assert ev.exclude_filter(str(tmp_path / 'project' / 'src' / 'node_modules'))
+    assert not ev.exclude_filter(str(tmp_path))
+    wm.close()
+
+
+@patch('dropboxignore.test_if_ignored', lambda *_, **__: True)
+@patch('dropboxignore.dropbox_exclude')
+def test_event_handler_unwatch_excluded(dropbox_exclude_mock):
+    # GIVEN
+    wm = MagicMock(add_watch=MagicMock(side_effect=lambda path, *_, **__: {path: len(path)}))
+    ev = EventHandler('/root', Rules([], []), watch_manager=wm)
+    for path in ['/root/node_modules', '/root/node_modules/lib', '/root/node_modules_other']:
+        ev.add_watch(path)
+
+    # WHEN
+    ev.process_default(MagicMock(pathname='/root/node_modules'))
+
+    # THEN
+    assert not wm.get_wd.called
+    wm.rm_watch.assert_called_once_with([len('/root/node_modules'), len('/root/node_modules/lib')])
+    assert ev.watched('/root/node_modules_other')
+    assert not ev.watched('/root/node_modules')
+
+
+@patch('os.path.sep', '/')
+@patch('dropboxignore.dropbox_exclude')
+def test_event_handler_coalesce(dropbox_exclude_mock):
+    # GIVEN
+    ev = EventHandler('/root', parse_dropboxignore(['node_modules']), MagicMock(), coalesce_window=60)
+    paths = ['a/node_modules', 'a/node_modules/lib', 'a/node_modules', 'a/src', 'a/node_modules/lib/x']
+
+    # WHEN
+    for path in paths:
+        ev.process_default(MagicMock(pathname=f'/root/{path}'))
+    called_before_flush = dropbox_exclude_mock.called
+    ev.flush()
+
+    # THEN
+    assert not called_before_flush
+    dropbox_exclude_mock.assert_called_once()
+    assert dropbox_exclude_mock.call_args[0][0] == 'a/node_modules'
+    assert ev.counters == {'received': 5, 'coalesced': 3, 'processed': 2}
+
+
+@patch('dropboxignore.dropbox_exclude')
+def test_event_handler_coalesce_poll(dropbox_exclude_mock):
+    # GIVEN
+    ev = EventHandler('/root', parse_dropboxignore(['node_modules']), MagicMock(), coalesce_window=0.01)
+
+    # WHEN
+    ev.process_default(MagicMock(pathname='/root/node_modules'))
+    called_before_poll = dropbox_exclude_mock.called
+    time.sleep(0.02)
+    ev.poll()
+
+    # THEN
+    assert not called_before_poll
+    dropbox_exclude_mock.assert_called_once()
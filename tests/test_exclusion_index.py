@@ -0,0 +1,71 @@
+import threading
+from unittest.mock import patch
+from dropboxignore import ExclusionIndex, FakeBackend
+
+
+@patch('subprocess.check_output')
+@patch('os.path.sep', '/')
+def test_exclusion_index_finds_ancestor(check_output_mock):
+    # GIVEN
+    check_output_mock.return_value = b'Excluded:\nproject/node_modules\n'
+
+    # WHEN
+    index = ExclusionIndex('')
+
+    # THEN
+    assert index.find('project/node_modules') == 'project/node_modules'
+    assert index.find('Project/Node_Modules/lib') == 'project/node_modules'
+    assert index.find('project') is None
+    assert index.find('project/node_modules_other') is None
+
+
+@patch('subprocess.check_output')
+@patch('os.path.sep', '/')
+def test_exclusion_index_loaded_once(check_output_mock):
+    # GIVEN
+    check_output_mock.return_value = b'Excluded:\n'
+    index = ExclusionIndex('')
+
+    # WHEN
+    index.find('a')
+    index.add('a')
+    result = index.find('a/b')
+
+    # THEN
+    assert result == 'a'
+    assert check_output_mock.call_count == 1
+
+
+@patch('subprocess.check_output')
+@patch('os.path.sep', '/')
+def test_exclusion_index_refreshed_when_stale(check_output_mock):
+    # GIVEN
+    check_output_mock.return_value = b'Excluded:\n'
+    index = ExclusionIndex('', max_age=-1)
+
+    # WHEN
+    index.find('a')
+    check_output_mock.return_value = b'Excluded:\na\n'
+    result = index.find('a')
+
+    # THEN
+    assert result == 'a'
+    assert check_output_mock.call_count == 2
+
+
+def test_exclusion_index_paths_while_adding():
+    # GIVEN
+    index = ExclusionIndex('/root', backend=FakeBackend('/root'))
+    index.load('Excluded:\n')
+    thread = threading.Thread(target=lambda: [index.add(f'dir{number}/node_modules') for number in range(20000)])
+
+    # WHEN
+    thread.start()
+    listed = []
+    while thread.is_alive():
+        listed.append(len(index.paths()))
+    thread.join()
+
+    # THEN
+    assert listed == sorted(listed)
+    assert len(index.paths()) == 20000
@@ -0,0 +1,81 @@
+from unittest.mock import patch, MagicMock
+from dropboxignore import CliBackend, ExclusionQueue, dropbox_exclude
+
+
+@patch('os.path.sep', '/')
+@patch('subprocess.call')
+def test_exclusion_queue_single_call(call_mock):
+    # GIVEN
+    call_mock.return_value = 0
+    queue = ExclusionQueue('/root', MagicMock(backend=CliBackend('/root')), flush_size=10, flush_interval=60)
+
+    # WHEN
+    queue.put('a/node_modules')
+    queue.put('b/node_modules')
+    queue.flush()
+
+    # THEN
+    call_mock.assert_called_once_with(['dropbox', 'exclude', 'add', '/root/a/node_modules', '/root/b/node_modules'],
+                                      cwd='/root')
+
+
+@patch('os.path.sep', '/')
+@patch('subprocess.call')
+def test_exclusion_queue_drops_subpaths(call_mock):
+    # GIVEN
+    call_mock.return_value = 0
+    queue = ExclusionQueue('/root', MagicMock(backend=CliBackend('/root')), flush_size=10, flush_interval=60)
+
+    # WHEN
+    queue.put('a/b/c')
+    queue.put('a')
+    queue.put('a/d')
+    queue.flush()
+
+    # THEN
+    call_mock.assert_called_once_with(['dropbox', 'exclude', 'add', '/root/a'], cwd='/root')
+
+
+@patch('os.path.sep', '/')
+@patch('subprocess.call')
+def test_exclusion_queue_flush_on_size(call_mock):
+    # GIVEN
+    call_mock.return_value = 0
+    queue = ExclusionQueue('/root', MagicMock(backend=CliBackend('/root')), flush_size=2, flush_interval=60)
+
+    # WHEN
+    queue.put('a')
+    queue.put('b')
+
+    # THEN
+    assert call_mock.call_count == 1
+    assert len(queue) == 0
+
+
+@patch('subprocess.call')
+def test_exclusion_queue_flush_on_interval(call_mock):
+    # GIVEN
+    call_mock.return_value = 0
+    queue = ExclusionQueue('/root', MagicMock(backend=CliBackend('/root')), flush_size=10, flush_interval=0.01)
+
+    # WHEN
+    queue.put('a')
+    timer = queue._timer
+    timer.join()
+
+    # THEN
+    assert call_mock.call_count == 1
+
+
+@patch('subprocess.call')
+def test_dropbox_exclude_already_excluded_queued(call_mock):
+    # GIVEN
+    index = MagicMock(find=MagicMock(return_value=None))
+    queue = ExclusionQueue('/root', index, flush_size=10, flush_interval=60)
+
+    # WHEN
+    dropbox_exclude('a', '/root', index, queue)
+
+    # THEN
+    assert not call_mock.called
+    assert queue.find('a') == 'a'
@@ -0,0 +1,64 @@
+import threading
+from unittest.mock import patch, MagicMock
+from dropboxignore import EventHandler, ExclusionWorkers, Rules
+
+
+def test_exclusion_workers_run_jobs():
+    # GIVEN
+    workers = ExclusionWorkers(workers=2, maxsize=10)
+    done = []
+
+    # WHEN
+    for number in range(5):
+        workers.submit(done.append, number)
+    workers.join()
+    workers.close()
+
+    # THEN
+    assert sorted(done) == [0, 1, 2, 3, 4]
+
+
+def test_exclusion_workers_high_water_mark():
+    # GIVEN
+    workers = ExclusionWorkers(workers=1, maxsize=10)
+    release = threading.Event()
+    workers.submit(release.wait)
+
+    # WHEN
+    for _ in range(3):
+        workers.submit(lambda: None)
+    high_water = workers.high_water
+    release.set()
+    workers.close()
+
+    # THEN
+    assert high_water >= 3
+
+
+def test_exclusion_workers_survive_exception():
+    # GIVEN
+    workers = ExclusionWorkers(workers=1, maxsize=10)
+    done = []
+
+    # WHEN
+    workers.submit(MagicMock(side_effect=Exception('error')))
+    workers.submit(done.append, 1)
+    workers.close()
+
+    # THEN
+    assert done == [1]
+
+
+@patch('dropboxignore.test_if_ignored', lambda *_, **__: True)
+@patch('dropboxignore.dropbox_exclude')
+def test_event_handler_submits_to_workers(dropbox_exclude_mock):
+    # GIVEN
+    workers = MagicMock()
+
+    # WHEN
+    ev = EventHandler('/root', Rules([], []), workers=workers)
+    ev.process_default(MagicMock(pathname='/root/node_modules'))
+
+    # THEN
+    assert not dropbox_exclude_mock.called
+    workers.submit.assert_called_once_with(dropbox_exclude_mock, 'node_modules', '/root', ev.index, None)
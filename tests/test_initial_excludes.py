@@ -1,5 +1,7 @@
 from unittest.mock import patch, MagicMock
-from dropboxignore import initial_excludes, Rules
+import concurrent.futures
+import threading
+from dropboxignore import SCAN_JOBS_IN_FLIGHT, initial_excludes, parse_dropboxignore, Rules
 
 
 @patch('dropboxignore.test_if_ignored', lambda *_, **__: False)
@@ -50,3 +52,59 @@ def test_initial_excludes_file_ignored(scandir_mock, dropbox_exclude_mock):
     # THEN
     assert file_entry.is_dir.called
     assert not dropbox_exclude_mock.called
+
+
+@patch('dropboxignore.dropbox_exclude')
+def test_initial_excludes_parallel(dropbox_exclude_mock, tmp_path):
+    # GIVEN
+    for project in range(20):
+        (tmp_path / f'project{project}' / 'node_modules' / 'lib').mkdir(parents=True)
+        (tmp_path / f'project{project}' / 'src').mkdir()
+    rules = parse_dropboxignore(['node_modules'])
+
+    # WHEN
+    stats = initial_excludes(str(tmp_path), rules, jobs=4)
+
+    # THEN
+    excluded = sorted(call[0][0] for call in dropbox_exclude_mock.call_args_list)
+    assert excluded == sorted(f'project{project}/node_modules' for project in range(20))
+    assert stats.directories == 60
+    assert stats.ignored == 20
+
+
+class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.in_flight = self.maximum = self.submitted = 0
+
+    def finished(self, _):
+        with self.lock:
+            self.in_flight -= 1
+
+    def submit(self, *args, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.submitted += 1
+            self.maximum = max(self.maximum, self.in_flight)
+        future = super().submit(*args, **kwargs)
+        future.add_done_callback(self.finished)
+        return future
+
+
+@patch('dropboxignore.dropbox_exclude')
+def test_initial_excludes_parallel_bounded(dropbox_exclude_mock, tmp_path):
+    # GIVEN
+    for project in range(300):
+        (tmp_path / f'project{project}' / 'node_modules').mkdir(parents=True)
+    executor = CountingExecutor(max_workers=2)
+
+    # WHEN
+    stats = initial_excludes(str(tmp_path), parse_dropboxignore(['node_modules']), jobs=2, executor=executor)
+    executor.shutdown()
+
+    # THEN
+    assert dropbox_exclude_mock.call_count == 300
+    assert stats.directories == 600
+    assert executor.maximum <= 2 * SCAN_JOBS_IN_FLIGHT
+    assert executor.submitted < 301
@@ -0,0 +1,101 @@
+import threading
+import urllib.request
+from unittest.mock import patch, MagicMock
+from dropboxignore import (METRICS, EventHandler, ExclusionIndex, FakeBackend, Metrics, Rules, dropbox_exclude_add,
+                           serve_metrics, write_stats)
+
+
+def test_metrics_render():
+    # GIVEN
+    metrics = Metrics({
+        'events_total': ('counter', 'Events', ()),
+        'depth': ('gauge', 'Depth', ()),
+        'seconds': ('histogram', 'Time', (0.1, 1.0)),
+        'unused': ('gauge', 'Never set', ()),
+    })
+
+    # WHEN
+    metrics.inc('events_total', type='IN_CREATE')
+    metrics.inc('events_total', type='IN_CREATE')
+    metrics.set_function('depth', lambda: 3)
+    metrics.observe('seconds', 0.5)
+    metrics.observe('seconds', 2.0)
+
+    # THEN
+    assert metrics.render() == (
+        '# HELP depth Depth\n'
+        '# TYPE depth gauge\n'
+        'depth 3\n'
+        '# HELP events_total Events\n'
+        '# TYPE events_total counter\n'
+        'events_total{type="IN_CREATE"} 2\n'
+        '# HELP seconds Time\n'
+        '# TYPE seconds histogram\n'
+        'seconds_bucket{le="0.1"} 0\n'
+        'seconds_bucket{le="1.0"} 1\n'
+        'seconds_bucket{le="+Inf"} 2\n'
+        'seconds_sum 2.5\n'
+        'seconds_count 2\n'
+    )
+
+
+@patch('dropboxignore.test_if_ignored', lambda *_, **__: False)
+def test_event_handler_metrics():
+    # GIVEN
+    METRICS.reset()
+    ev = EventHandler('/root', Rules([], []), MagicMock(), coalesce_window=60)
+
+    # WHEN
+    ev.process_default(MagicMock(pathname='/root/a', maskname='IN_CREATE|IN_ISDIR'))
+    ev.process_default(MagicMock(pathname='/root/a', maskname='IN_MOVED_TO|IN_ISDIR'))
+    ev.flush()
+
+    # THEN
+    assert METRICS.value('dropboxignore_events_total', type='IN_CREATE|IN_ISDIR') == 1
+    assert METRICS.value('dropboxignore_events_total', type='IN_MOVED_TO|IN_ISDIR') == 1
+    assert METRICS.value('dropboxignore_events_dropped_total', reason='duplicate') == 1
+    assert 'dropboxignore_match_seconds_count 1\n' in METRICS.render()
+
+
+def test_dropbox_exclude_add_metrics():
+    # GIVEN
+    METRICS.reset()
+    index = ExclusionIndex('/root', backend=FakeBackend('/root'))
+
+    # WHEN
+    dropbox_exclude_add(['a', 'b'], '/root', index)
+
+    # THEN
+    assert METRICS.value('dropboxignore_exclusion_calls_total', command='add', result='ok') == 1
+    assert 'dropboxignore_exclusion_seconds_count{command="add"} 1\n' in METRICS.render()
+
+
+def test_serve_metrics():
+    # GIVEN
+    METRICS.reset()
+    METRICS.set('dropboxignore_watched_directories', 7, root='/root')
+    server = serve_metrics(0)
+
+    # WHEN
+    with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/metrics') as response:
+        body = response.read().decode('utf-8')
+    server.shutdown()
+    server.server_close()
+
+    # THEN
+    assert 'dropboxignore_watched_directories{root="/root"} 7\n' in body
+
+
+def test_write_stats(tmp_path):
+    # GIVEN
+    METRICS.reset()
+    METRICS.set('dropboxignore_scan_directories', 42)
+    stop = threading.Event()
+
+    # WHEN
+    writer = write_stats(str(tmp_path / 'stats.prom'), 60, stop)
+    stop.set()
+    writer.join(5)
+
+    # THEN
+    assert 'dropboxignore_scan_directories 42\n' in (tmp_path / 'stats.prom').read_text()
@@ -0,0 +1,118 @@
+import concurrent.futures
+from unittest.mock import patch
+import pyinotify
+import pytest
+from dropboxignore import (WATCHED_EVENTS, CliBackend, CommandSocketBackend, EventHandler, ExclusionIndex,
+                           FakeBackend, initial_excludes, parse_arguments, parse_dropboxignore, prepare_root)
+
+
+@pytest.fixture
+def roots(tmp_path):
+    paths = []
+    for name in ['first', 'second']:
+        (tmp_path / name / 'src').mkdir(parents=True)
+        (tmp_path / name / 'src' / 'node_modules').mkdir()
+        paths.append(str(tmp_path / name))
+    return paths
+
+
+def test_parse_arguments_multiple_roots():
+    # GIVEN
+
+    # WHEN
+    args = parse_arguments(['first', 'second', '--dropbox-home', '/home/a', '--dropbox-home', '/home/b'])
+
+    # THEN
+    assert args.dropbox_path == ['first', 'second']
+    assert args.dropbox_home == ['/home/a', '/home/b']
+
+
+@pytest.mark.parametrize('argv', [
+    ['first', 'second', '--dropbox-home', '/home/a'],
+    ['first', './first'],
+    ['first', 'second', '--scan-index', 'index.json'],
+])
+def test_parse_arguments_multiple_roots_errors(argv):
+    # GIVEN
+
+    # WHEN
+    with pytest.raises(SystemExit) as exit_exception:
+        parse_arguments(argv)
+
+    # THEN
+    assert exit_exception.value.code != 0
+
+
+@patch('subprocess.call', return_value=0)
+def test_cli_backend_home(call_mock):
+    # GIVEN
+    backend = CliBackend('/root/Dropbox', home='/home/a')
+
+    # WHEN
+    backend.add(['/root/Dropbox/node_modules'])
+
+    # THEN
+    _, kwargs = call_mock.call_args
+    assert kwargs['cwd'] == '/root/Dropbox'
+    assert kwargs['env']['HOME'] == '/home/a'
+
+
+def test_command_socket_backend_home():
+    # GIVEN
+
+    # WHEN
+    backend = CommandSocketBackend('/root/Dropbox', home='/home/a')
+
+    # THEN
+    assert backend.socket_path == '/home/a/.dropbox/command_socket'
+
+
+def test_initial_excludes_shared_executor(roots):
+    # GIVEN
+    rules = parse_dropboxignore(['node_modules\n'])
+    indexes = [ExclusionIndex(root, backend=FakeBackend(root)) for root in roots]
+
+    # WHEN
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        for root, index in zip(roots, indexes):
+            initial_excludes(root, rules, index, jobs=2, executor=executor)
+
+    # THEN
+    assert [index.backend.excluded for index in indexes] == [{'src/node_modules'}, {'src/node_modules'}]
+
+
+def test_event_handlers_shared_watch_manager(roots, tmp_path):
+    # GIVEN
+    wm = pyinotify.WatchManager()
+    indexes = [ExclusionIndex(root, backend=FakeBackend(root)) for root in roots]
+    handlers = [EventHandler(root, parse_dropboxignore(['build\n']), index, watch_manager=wm)
+                for root, index in zip(roots, indexes)]
+    notifier = pyinotify.Notifier(wm, handlers[0], timeout=100)
+    watches = [handler.watch(WATCHED_EVENTS) for handler in handlers]
+
+    # WHEN
+    (tmp_path / 'second' / 'src' / 'build').mkdir()
+    while notifier.check_events():
+        notifier.read_events()
+        notifier.process_events()
+    notifier.stop()
+
+    # THEN
+    assert watches == [3, 3]
+    assert indexes[0].backend.calls == []
+    assert indexes[1].backend.excluded == {'src/build'}
+
+
+def test_prepare_root_relative_path(tmp_path, monkeypatch):
+    # GIVEN
+    (tmp_path / 'e2e' / 'Dropbox').mkdir(parents=True)
+    (tmp_path / 'e2e' / 'Dropbox' / '.dropboxignore').write_text('node_modules\n')
+    monkeypatch.chdir(tmp_path)
+    args = parse_arguments(['e2e/Dropbox', '--no-scan-index'])
+
+    # WHEN
+    root = prepare_root('e2e/Dropbox', None, args)
+
+    # THEN
+    assert root.path == str(tmp_path / 'e2e' / 'Dropbox')
+    assert root.backend.dropbox_path == root.index.dropbox_path == root.path
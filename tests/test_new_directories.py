@@ -0,0 +1,142 @@
+import os
+import shutil
+from unittest.mock import patch, MagicMock
+import pyinotify
+from dropboxignore import (METRICS, WATCHED_EVENTS, EventHandler, ExclusionIndex, FakeBackend,
+                           parse_dropboxignore)
+
+
+def watch(tmp_path, lines):
+    wm = pyinotify.WatchManager()
+    index = ExclusionIndex(str(tmp_path), backend=FakeBackend(str(tmp_path)))
+    handler = EventHandler(str(tmp_path), parse_dropboxignore(lines), index, watch_manager=wm)
+    notifier = pyinotify.Notifier(wm, handler, timeout=100)
+    handler.watch(WATCHED_EVENTS)
+    return handler, notifier
+
+
+def process_events(notifier):
+    while notifier.check_events():
+        notifier.read_events()
+        notifier.process_events()
+    notifier.stop()
+
+
+@patch('dropboxignore.test_if_ignored')
+def test_event_handler_skips_files(test_if_ignored_mock):
+    # GIVEN
+    METRICS.reset()
+    ev = EventHandler('/root', parse_dropboxignore(['node_modules']), MagicMock())
+
+    # WHEN
+    ev.process_default(MagicMock(pathname='/root/node_modules', maskname='IN_CREATE', dir=False))
+
+    # THEN
+    assert not test_if_ignored_mock.called
+    assert ev.counters['received'] == 0
+    assert METRICS.value('dropboxignore_events_dropped_total', reason='not directory') == 1
+
+
+def test_event_handler_mkdir_parents(tmp_path):
+    # GIVEN
+    handler, notifier = watch(tmp_path, ['node_modules\n'])
+
+    # WHEN
+    os.makedirs(str(tmp_path / 'a' / 'b' / 'node_modules' / 'lib'))
+    (tmp_path / 'a' / 'b' / 'file').write_text('')
+    process_events(notifier)
+
+    # THEN
+    assert handler.index.backend.excluded == {'a/b/node_modules'}
+    assert sorted(watch.path for watch in handler.watch_manager.watches.values()) == \
+        [str(tmp_path), str(tmp_path / 'a'), str(tmp_path / 'a' / 'b')]
+
+
+def test_event_handler_tree_moved_in(tmp_path):
+    # GIVEN
+    (tmp_path / 'root').mkdir()
+    (tmp_path / 'outside' / 'project' / 'build').mkdir(parents=True)
+    (tmp_path / 'outside' / 'project' / 'src').mkdir()
+    handler, notifier = watch(tmp_path / 'root', ['build\n'])
+
+    # WHEN
+    os.rename(str(tmp_path / 'outside' / 'project'), str(tmp_path / 'root' / 'project'))
+    process_events(notifier)
+
+    # THEN
+    assert handler.index.backend.excluded == {'project/build'}
+    assert handler.counters['scanned'] == 1
+    assert handler.watch_manager.get_wd(str(tmp_path / 'root' / 'project' / 'src')) is not None
+
+
+def test_event_handler_subtree_removed_while_scanned(tmp_path):
+    # GIVEN
+    handler, notifier = watch(tmp_path, ['node_modules\n'])
+    os.makedirs(str(tmp_path / 'new' / 'removed' / 'deep'))
+    os.makedirs(str(tmp_path / 'new' / 'src' / 'node_modules'))
+    add_watch = handler.add_watch
+
+    def removing_add_watch(path):
+        add_watch(path)
+        if path.endswith('removed'):
+            shutil.rmtree(path)
+
+    handler.add_watch = removing_add_watch
+
+    # WHEN
+    ignored = handler.watch_subtree('new')
+
+    # THEN
+    assert ignored == ['new/src/node_modules']
+    assert handler.watch_manager.get_wd(str(tmp_path / 'new' / 'src')) is not None
+    notifier.stop()
+
+
+def test_event_handler_subtree_unreadable(tmp_path, capsys):
+    # GIVEN
+    handler, notifier = watch(tmp_path, ['node_modules\n'])
+    os.makedirs(str(tmp_path / 'new' / 'src'))
+
+    # WHEN
+    with patch('dropboxignore.scan_subdirectories', side_effect=PermissionError(13, 'Permission denied',
+                                                                                 str(tmp_path / 'new'))):
+        ignored = handler.watch_subtree('new')
+
+    # THEN
+    assert ignored == []
+    assert f'Cannot scan new directory {tmp_path / "new"}' in capsys.readouterr().out
+    notifier.stop()
+
+
+def test_event_handler_recreated_directory_watched(tmp_path):
+    # GIVEN
+    (tmp_path / 'a').mkdir()
+    handler, notifier = watch(tmp_path, ['node_modules\n'])
+
+    # WHEN
+    (tmp_path / 'a').rmdir()
+    while notifier.check_events():
+        notifier.read_events()
+        notifier.process_events()
+    os.makedirs(str(tmp_path / 'a' / 'node_modules'))
+    process_events(notifier)
+
+    # THEN
+    assert handler.index.backend.excluded == {'a/node_modules'}
+    assert handler.watched(str(tmp_path / 'a'))
+    assert handler.watched_directories() == 2
+
+
+def test_event_handler_watch_subtree_without_get_wd(tmp_path):
+    # GIVEN
+    handler, notifier = watch(tmp_path, ['node_modules\n'])
+    os.makedirs(str(tmp_path / 'new' / 'a' / 'node_modules'))
+
+    # WHEN
+    with patch.object(handler.watch_manager, 'get_wd', side_effect=AssertionError('linear scan of watches')):
+        ignored = handler.watch_subtree('new')
+
+    # THEN
+    assert ignored == ['new/a/node_modules']
+    assert handler.watched(str(tmp_path / 'new' / 'a'))
+    notifier.stop()
@@ -0,0 +1,82 @@
+import collections
+import os
+import time
+from unittest.mock import MagicMock
+import pyinotify
+import pytest
+from dropboxignore import (METRICS, WATCHED_EVENTS, EventHandler, ExclusionIndex, FakeBackend, OverflowHandler,
+                           parse_dropboxignore)
+
+
+@pytest.fixture
+def handler(tmp_path):
+    for name in ['a', 'b', 'old']:
+        (tmp_path / name).mkdir()
+    wm = pyinotify.WatchManager()
+    index = ExclusionIndex(str(tmp_path), backend=FakeBackend(str(tmp_path)))
+    handler = EventHandler(str(tmp_path), parse_dropboxignore(['node_modules\n']), index, watch_manager=wm)
+    handler.watch(WATCHED_EVENTS)
+    past = time.time() - 100
+    for path in [tmp_path, tmp_path / 'a', tmp_path / 'b', tmp_path / 'old']:
+        os.utime(str(path), (past, past))
+    handler.checkpoints = collections.deque([time.time()], maxlen=2)
+    yield handler
+    wm.close()
+
+
+def test_overflow_recovery(handler, tmp_path):
+    # GIVEN
+    METRICS.reset()
+    os.makedirs(str(tmp_path / 'a' / 'new' / 'node_modules'))
+    os.makedirs(str(tmp_path / 'a' / 'new' / 'src'))
+
+    # WHEN
+    handler.process_IN_Q_OVERFLOW(MagicMock())
+
+    # THEN
+    assert handler.index.backend.excluded == {'a/new/node_modules'}
+    assert handler.watch_manager.get_wd(str(tmp_path / 'a' / 'new' / 'src')) is not None
+    assert handler.counters['overflows'] == 1
+    assert METRICS.value('dropboxignore_overflows_total', root=str(tmp_path)) == 1
+    assert f'dropboxignore_overflow_recovery_seconds_count{{root="{tmp_path}"}} 1\n' in METRICS.render()
+
+
+def test_overflow_recovery_lists_modified_only(handler, tmp_path):
+    # GIVEN
+    (tmp_path / 'a' / 'node_modules').mkdir()
+
+    # WHEN
+    listed = handler.recover_overflow()
+
+    # THEN
+    assert listed == 1
+    assert handler.index.backend.excluded == {'a/node_modules'}
+
+
+def test_overflow_recovery_limit_newest_first(handler, tmp_path):
+    # GIVEN
+    handler.overflow_limit = 1
+    (tmp_path / 'a' / 'node_modules').mkdir()
+    (tmp_path / 'b' / 'node_modules').mkdir()
+    future = time.time() + 10
+    os.utime(str(tmp_path / 'b'), (future, future))
+
+    # WHEN
+    listed = handler.recover_overflow()
+
+    # THEN
+    assert listed == 1
+    assert handler.index.backend.excluded == {'b/node_modules'}
+
+
+def test_overflow_handler_recovers_all_roots():
+    # GIVEN
+    handlers = [MagicMock(), MagicMock()]
+    event = MagicMock()
+
+    # WHEN
+    OverflowHandler(handlers=handlers).process_IN_Q_OVERFLOW(event)
+
+    # THEN
+    for handler in handlers:
+        handler.process_IN_Q_OVERFLOW.assert_called_once_with(event)
@@ -326,3 +326,15 @@ def test_exclude_basic():
     assert rules.excluded[0].match('test')
     assert rules.excluded[0].match('a/test')
     assert rules.excluded[0].match('a/test/more')
+
+
+def test_literal_rule():
+    # GIVEN
+    patterns = ['node_modules', '*.log', 'a/b', '!keep']
+
+    # WHEN
+    rules = parse_dropboxignore(patterns)
+
+    # THEN
+    assert [rule.literal for rule in rules.entries] == ['node_modules', None, None, 'keep']
+    assert [rule.lineno for rule in rules.entries] == [1, 2, 3, 4]
@@ -0,0 +1,66 @@
+import pytest
+import dropboxignore
+from dropboxignore import ProfilingMatcher, parse_arguments, parse_dropboxignore, profile_report
+
+LINES = ['node_modules\n', '*.egg-info\n', 'project/**/dist\n', '!keep\n', 'never_matching\n']
+PATHS = ['a/node_modules', 'lib.egg-info', 'project/x/dist', 'project/dist', 'node_modules/keep', 'src', 'a/b/c']
+
+
+@pytest.mark.parametrize('engine', ['regex', 'trie'])
+def test_profiling_matcher_verdicts(engine):
+    # GIVEN
+    rules = parse_dropboxignore(LINES, engine)
+    profiled = parse_dropboxignore(LINES, engine, profile=True)
+
+    # WHEN
+    verdicts = [dropboxignore.test_if_ignored(path, profiled) for path in PATHS]
+
+    # THEN
+    assert isinstance(profiled.matcher, ProfilingMatcher)
+    assert verdicts == [dropboxignore.test_if_ignored(path, rules) for path in PATHS]
+
+
+def test_profiling_matcher_stats():
+    # GIVEN
+    rules = parse_dropboxignore(LINES, profile=True)
+
+    # WHEN
+    for path in PATHS:
+        dropboxignore.test_if_ignored(path, rules)
+
+    # THEN
+    stats = {rule.source: stats for rule, _, stats in rules.matcher.profiles}
+    assert all(rule_stats.evaluations == len(PATHS) for rule_stats in stats.values())
+    assert stats['node_modules'].hits == 2
+    assert stats['!keep'].hits == 1
+    assert stats['never_matching'].hits == 0
+    assert stats['node_modules'].maximum <= stats['node_modules'].total
+
+
+def test_profile_report(tmp_path):
+    # GIVEN
+    (tmp_path / 'project').mkdir()
+    (tmp_path / 'project' / '.dropboxignore').write_text('build\n')
+    rules = parse_dropboxignore(['node_modules\n', 'never_matching\n'], nested_root=str(tmp_path), profile=True)
+    for path in ['a/node_modules', 'project/build']:
+        dropboxignore.test_if_ignored(path, rules)
+
+    # WHEN
+    report = profile_report(rules).split('\n')
+
+    # THEN
+    assert len(report) == 4
+    assert report[0].split() == ['total', 'ms', 'max', 'us', 'mean', 'us', 'evaluations', 'hits', 'rule']
+    assert sorted(line.split('  ')[-1].strip() for line in report[1:] if 'never matched' not in line) == \
+        ['.dropboxignore:1: node_modules', 'project/.dropboxignore:1: build']
+    assert any(line.endswith('.dropboxignore:2: never_matching  (never matched)') for line in report)
+
+
+def test_parse_arguments_profile_rules():
+    # GIVEN
+
+    # WHEN
+    args = parse_arguments(['path', '--profile-rules'])
+
+    # THEN
+    assert args.profile_rules
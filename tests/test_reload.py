@@ -0,0 +1,116 @@
+from unittest.mock import patch, MagicMock
+import pyinotify
+import pytest
+from dropboxignore import WATCHED_EVENTS, EventHandler, ExclusionIndex, FakeBackend, diff_rules, parse_dropboxignore
+
+
+def test_diff_rules():
+    # GIVEN
+    old_rules = parse_dropboxignore(['node_modules\n', 'build\n'])
+    rules = parse_dropboxignore(['build\n', '!build/keep\n', '.venv\n'])
+
+    # WHEN
+    added, removed = diff_rules(old_rules, rules)
+
+    # THEN
+    assert [(rule.glob.strip(), rule.negated) for rule in added] == [('build/keep', True), ('.venv', False)]
+    assert [(rule.glob.strip(), rule.negated) for rule in removed] == [('node_modules', False)]
+
+
+@patch('dropboxignore.dropbox_exclude')
+@patch('dropboxignore.dropbox_exclude_remove')
+def test_reload_excludes_newly_ignored(dropbox_exclude_remove_mock, dropbox_exclude_mock, tmp_path):
+    # GIVEN
+    (tmp_path / 'project' / '.venv').mkdir(parents=True)
+    (tmp_path / 'project' / 'src').mkdir()
+    (tmp_path / '.dropboxignore').write_text('node_modules\n')
+    wm = pyinotify.WatchManager()
+    index = ExclusionIndex(str(tmp_path))
+    index.load('')
+    ev = EventHandler(str(tmp_path), parse_dropboxignore(['node_modules\n']), index, watch_manager=wm)
+    ev.watch(pyinotify.IN_CREATE)
+
+    # WHEN
+    (tmp_path / '.dropboxignore').write_text('node_modules\n.venv\n')
+    ev.process_default(MagicMock(pathname=str(tmp_path / '.dropboxignore'), mask=pyinotify.IN_CLOSE_WRITE))
+
+    # THEN
+    dropbox_exclude_mock.assert_called_once_with('project/.venv', str(tmp_path), index, None)
+    assert not dropbox_exclude_remove_mock.called
+    wm.close()
+
+
+@patch('dropboxignore.dropbox_exclude')
+@patch('dropboxignore.dropbox_exclude_remove')
+def test_reload_brings_back_no_longer_ignored(dropbox_exclude_remove_mock, dropbox_exclude_mock, tmp_path):
+    # GIVEN
+    (tmp_path / '.dropboxignore').write_text('build\n')
+    index = ExclusionIndex(str(tmp_path))
+    index.load('Excluded:\na/node_modules\nb/build\nprivate\n')
+    ev = EventHandler(str(tmp_path), parse_dropboxignore(['node_modules\n', 'build\n']), index)
+
+    # WHEN
+    ev.reload()
+
+    # THEN
+    dropbox_exclude_remove_mock.assert_called_once_with(['a/node_modules'], str(tmp_path), index)
+    assert not dropbox_exclude_mock.called
+
+
+def test_reload_watches_brought_back(tmp_path):
+    # GIVEN
+    (tmp_path / 'a' / 'node_modules' / 'pkg' / 'build').mkdir(parents=True)
+    (tmp_path / '.dropboxignore').write_text('build\n')
+    wm = pyinotify.WatchManager()
+    index = ExclusionIndex(str(tmp_path), backend=FakeBackend(str(tmp_path), excluded=['a/node_modules']))
+    ev = EventHandler(str(tmp_path), parse_dropboxignore(['node_modules\n', 'build\n']), index, watch_manager=wm)
+    ev.watch(WATCHED_EVENTS)
+
+    # WHEN
+    ev.reload()
+
+    # THEN
+    assert index.backend.excluded == {'a/node_modules/pkg/build'}
+    assert wm.get_wd(str(tmp_path / 'a' / 'node_modules' / 'pkg')) is not None
+    assert wm.get_wd(str(tmp_path / 'a' / 'node_modules' / 'pkg' / 'build')) is None
+    wm.close()
+
+
+@pytest.mark.parametrize('mask, watched', [(pyinotify.IN_CREATE, True), (pyinotify.IN_CLOSE_WRITE, False)])
+def test_reload_skips_empty_recreated_file(tmp_path, mask, watched):
+    # GIVEN
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    wm = pyinotify.WatchManager()
+    index = ExclusionIndex(str(tmp_path), backend=FakeBackend(str(tmp_path), excluded=['a/node_modules',
+                                                                                        'b/node_modules']))
+    rules = parse_dropboxignore(['node_modules\n'])
+    ev = EventHandler(str(tmp_path), rules, index, watch_manager=wm)
+    ev.watch(WATCHED_EVENTS)
+
+    # WHEN
+    (tmp_path / '.dropboxignore').write_text('')
+    ev.process_default(MagicMock(pathname=str(tmp_path / '.dropboxignore'), mask=mask))
+
+    # THEN
+    assert ev.rules is rules
+    assert index.backend.excluded == {'a/node_modules', 'b/node_modules'}
+    assert all(command != 'remove' for command, _ in index.backend.calls)
+    assert (wm.get_wd(str(tmp_path / '.dropboxignore')) is not None) == watched
+    wm.close()
+
+
+@patch('dropboxignore.dropbox_exclude')
+@patch('dropboxignore.dropbox_exclude_remove')
+def test_reload_keeps_rules_on_error(dropbox_exclude_remove_mock, dropbox_exclude_mock, tmp_path):
+    # GIVEN
+    rules = parse_dropboxignore(['node_modules\n'])
+    ev = EventHandler(str(tmp_path), rules, MagicMock())
+
+    # WHEN
+    ev.reload()
+
+    # THEN
+    assert ev.rules is rules
+    assert not dropbox_exclude_mock.called
+    assert not dropbox_exclude_remove_mock.called
@@ -0,0 +1,122 @@
+import os
+from unittest.mock import patch
+import dropboxignore
+from dropboxignore import LazyPattern, RegexMatcher, RuleCache, parse_dropboxignore
+
+LINES = ['node_modules\n', '*.egg-info\n', 'project/**/dist\n', '!keep\n']
+PATHS = ['a/node_modules', 'lib.egg-info', 'project/x/dist', 'node_modules/keep', 'src']
+
+
+def test_rule_cache_hit(tmp_path):
+    # GIVEN
+    cache = RuleCache(str(tmp_path))
+    parsed = parse_dropboxignore(LINES, cache=cache)
+
+    # WHEN
+    with patch('dropboxignore.parse_rules') as parse_rules_mock:
+        rules = parse_dropboxignore(LINES, cache=cache)
+
+    # THEN
+    assert not parse_rules_mock.called
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert rules.entries == parsed.entries
+    assert [dropboxignore.test_if_ignored(path, rules) for path in PATHS] == [True, True, True, False, False]
+
+
+def test_rule_cache_key():
+    # GIVEN
+    key = RuleCache.key(LINES)
+
+    # WHEN
+    changed = RuleCache.key(LINES[:-1] + ['!keep_me\n'])
+    joined = RuleCache.key([''.join(LINES)])
+    with patch('dropboxignore.__version__', '999'):
+        other_version = RuleCache.key(LINES)
+    with patch.object(RuleCache, 'VERSION', RuleCache.VERSION + 1):
+        other_format = RuleCache.key(LINES)
+
+    # THEN
+    assert len({key, changed, joined, other_version, other_format}) == 5
+
+
+def test_rule_cache_corrupted(tmp_path):
+    # GIVEN
+    cache = RuleCache(str(tmp_path))
+    (tmp_path / f'rules-{RuleCache.key(LINES)}.json').write_text('[["node_modules"')
+
+    # WHEN
+    entries = cache.entries(LINES)
+
+    # THEN
+    assert cache.misses == 1
+    assert [rule.source for rule in entries] == [line.rstrip('\n') for line in LINES]
+
+
+def test_rule_cache_keeps_max_entries(tmp_path):
+    # GIVEN
+    cache = RuleCache(str(tmp_path), max_entries=2)
+    names = [f'rules-{RuleCache.key([line])}.json' for line in ['first\n', 'second\n', 'third\n']]
+
+    # WHEN
+    for index, line in enumerate(['first\n', 'second\n', 'third\n']):
+        cache.entries([line])
+        if index < 2:
+            os.utime(str(tmp_path / names[index]), (index, index))
+
+    # THEN
+    assert sorted(os.listdir(str(tmp_path))) == sorted(names[1:])
+
+
+def test_rule_cache_nested(tmp_path):
+    # GIVEN
+    (tmp_path / 'project').mkdir()
+    (tmp_path / 'project' / '.dropboxignore').write_text('build\n')
+    cache = RuleCache(str(tmp_path / 'cache'))
+    rules = parse_dropboxignore(LINES, nested_root=str(tmp_path), cache=cache)
+
+    # WHEN
+    ignored = dropboxignore.test_if_ignored('project/build', rules)
+
+    # THEN
+    assert ignored
+    assert cache.misses == 2
+
+
+def test_lazy_pattern_not_compiled_by_regex_matcher():
+    # GIVEN
+    rules = parse_dropboxignore(LINES)
+
+    # WHEN
+    dropboxignore.test_if_ignored('project/x/dist', rules)
+
+    # THEN
+    assert all(rule.regex._compiled is None for rule in rules.entries)
+    assert rules.ignored[1].match('lib.egg-info')
+    assert rules.ignored[1] == LazyPattern(rules.entries[1].regex.pattern)
+
+
+def test_regex_matcher_combined_not_capturing():
+    # GIVEN
+    rules = parse_dropboxignore(LINES)
+
+    # WHEN
+    combined = RegexMatcher.combine([rule.regex for rule in rules.entries])
+
+    # THEN
+    assert combined.groups == 0
+
+
+def test_cache_paths_share_directory(monkeypatch, tmp_path):
+    # GIVEN
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    dropbox_path = str(tmp_path / 'Dropbox')
+
+    # WHEN
+    paths = [RuleCache.default_path(), dropboxignore.ScanIndex.default_path(dropbox_path),
+             dropboxignore.BackgroundSweep.default_path(dropbox_path)]
+
+    # THEN
+    assert [os.path.dirname(path) for path in paths] == [str(tmp_path / 'cache' / 'dropboxignore')] * 3
+    assert os.path.basename(paths[0]) == 'rules'
+    assert os.path.basename(paths[1]).startswith('scan-') and paths[1].endswith('.json')
+    assert os.path.basename(paths[2]) == os.path.basename(paths[1]).replace('scan-', 'sweep-')
@@ -0,0 +1,98 @@
+from unittest.mock import patch, MagicMock
+import pyinotify
+import dropboxignore
+from dropboxignore import EventHandler, ExclusionIndex, RuleLayers, parse_dropboxignore
+
+
+def test_rule_layers_scope_nested_rules(tmp_path):
+    # GIVEN
+    (tmp_path / 'project').mkdir()
+    (tmp_path / 'project' / '.dropboxignore').write_text('dist\n!keep\n')
+    rules = parse_dropboxignore(['keep\n', 'node_modules\n'], nested_root=str(tmp_path))
+
+    # WHEN / THEN
+    assert isinstance(rules.matcher, RuleLayers)
+    assert dropboxignore.test_if_ignored('project/dist', rules)
+    assert dropboxignore.test_if_ignored('project/src/dist', rules)
+    assert not dropboxignore.test_if_ignored('other/dist', rules)
+    assert dropboxignore.test_if_ignored('other/keep', rules)
+    assert not dropboxignore.test_if_ignored('project/keep', rules)
+    assert dropboxignore.test_if_ignored('project/node_modules', rules)
+    assert rules.matcher.layers() == ['project']
+
+
+def test_rule_layers_read_once(tmp_path):
+    # GIVEN
+    (tmp_path / 'project').mkdir()
+    (tmp_path / 'project' / '.dropboxignore').write_text('dist\n')
+    rules = parse_dropboxignore([], nested_root=str(tmp_path))
+    on_layer = MagicMock()
+    rules.matcher.on_layer = on_layer
+
+    # WHEN
+    with patch('dropboxignore.read_dropboxignore', wraps=dropboxignore.read_dropboxignore) as read_mock:
+        for _ in range(3):
+            dropboxignore.test_if_ignored('project/dist', rules)
+
+    # THEN
+    assert read_mock.call_count == 1
+    on_layer.assert_called_once_with('project')
+
+
+def test_rule_layers_replaced(tmp_path):
+    # GIVEN
+    (tmp_path / 'project').mkdir()
+    (tmp_path / 'project' / '.dropboxignore').write_text('dist\n')
+    layers = parse_dropboxignore([], nested_root=str(tmp_path)).matcher
+    assert layers.test('project/dist')
+
+    # WHEN
+    (tmp_path / 'project' / '.dropboxignore').write_text('build\n')
+    replaced = layers.replaced('project')
+
+    # THEN
+    assert layers.test('project/dist')
+    assert not replaced.test('project/dist')
+    assert replaced.test('project/build')
+
+
+def test_rule_layers_bounded_missing(tmp_path):
+    # GIVEN
+    (tmp_path / 'project').mkdir()
+    (tmp_path / 'project' / '.dropboxignore').write_text('dist\n')
+    layers = parse_dropboxignore([], nested_root=str(tmp_path)).matcher
+    layers.max_missing = 2
+
+    # WHEN
+    verdicts = [layers.test(f'other{number}/dist') for number in range(5)] + [layers.test('project/dist')]
+
+    # THEN
+    assert verdicts == [False] * 5 + [True]
+    assert len(layers._missing) == 2
+    assert layers.layers() == ['project']
+
+
+@patch('dropboxignore.dropbox_exclude')
+@patch('dropboxignore.dropbox_exclude_remove')
+def test_event_handler_reloads_nested_layer(dropbox_exclude_remove_mock, dropbox_exclude_mock, tmp_path):
+    # GIVEN
+    (tmp_path / 'project' / 'dist').mkdir(parents=True)
+    (tmp_path / 'project' / 'build').mkdir()
+    (tmp_path / 'other' / 'dist').mkdir(parents=True)
+    (tmp_path / 'project' / '.dropboxignore').write_text('build\n')
+    wm = pyinotify.WatchManager()
+    index = ExclusionIndex(str(tmp_path))
+    index.load('Excluded:\nproject/build\n')
+    ev = EventHandler(str(tmp_path), parse_dropboxignore([], nested_root=str(tmp_path)), index, watch_manager=wm)
+    ev.watch(pyinotify.IN_CREATE)
+    assert wm.get_wd(str(tmp_path / 'project' / '.dropboxignore')) is not None
+
+    # WHEN
+    (tmp_path / 'project' / '.dropboxignore').write_text('dist\n')
+    ev.process_default(MagicMock(pathname=str(tmp_path / 'project' / '.dropboxignore'),
+                                 mask=pyinotify.IN_CLOSE_WRITE))
+
+    # THEN
+    dropbox_exclude_mock.assert_called_once_with('project/dist', str(tmp_path), index, None)
+    dropbox_exclude_remove_mock.assert_called_once_with(['project/build'], str(tmp_path), index)
+    wm.close()
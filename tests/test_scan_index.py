@@ -0,0 +1,173 @@
+import json
+import os
+from unittest.mock import patch
+import pytest
+from dropboxignore import ExclusionIndex, FakeBackend, initial_excludes, parse_dropboxignore, ScanIndex
+
+
+def make_tree(root):
+    for project in range(3):
+        (root / f'project{project}' / 'node_modules').mkdir(parents=True)
+        (root / f'project{project}' / 'src' / 'lib').mkdir(parents=True)
+
+
+@patch('dropboxignore.dropbox_exclude')
+def test_scan_index_skips_unchanged_directories(dropbox_exclude_mock, tmp_path):
+    # GIVEN
+    make_tree(tmp_path / 'root')
+    rules = parse_dropboxignore(['node_modules'])
+    initial_excludes(str(tmp_path / 'root'), rules, scan_index=ScanIndex(str(tmp_path / 'index.json')))
+    dropbox_exclude_mock.reset_mock()
+
+    # WHEN
+    with patch('os.scandir', wraps=os.scandir) as scandir_mock:
+        stats = initial_excludes(str(tmp_path / 'root'), rules, scan_index=ScanIndex(str(tmp_path / 'index.json')))
+
+    # THEN
+    assert not scandir_mock.called
+    assert not dropbox_exclude_mock.called
+    assert stats.directories == 0
+
+
+@patch('dropboxignore.dropbox_exclude')
+def test_scan_index_rescans_changed_directories(dropbox_exclude_mock, tmp_path):
+    # GIVEN
+    make_tree(tmp_path / 'root')
+    rules = parse_dropboxignore(['node_modules'])
+    initial_excludes(str(tmp_path / 'root'), rules, scan_index=ScanIndex(str(tmp_path / 'index.json')))
+    dropbox_exclude_mock.reset_mock()
+    (tmp_path / 'root' / 'project1' / 'src' / 'lib' / 'node_modules').mkdir()
+
+    # WHEN
+    with patch('os.scandir', wraps=os.scandir) as scandir_mock:
+        initial_excludes(str(tmp_path / 'root'), rules, jobs=2, scan_index=ScanIndex(str(tmp_path / 'index.json')))
+
+    # THEN
+    assert scandir_mock.call_count == 1
+    dropbox_exclude_mock.assert_called_once()
+    assert dropbox_exclude_mock.call_args[0][0] == os.path.join('project1', 'src', 'lib', 'node_modules')
+
+
+@patch('dropboxignore.dropbox_exclude')
+def test_scan_index_discarded_for_other_rules(dropbox_exclude_mock, tmp_path):
+    # GIVEN
+    make_tree(tmp_path / 'root')
+    initial_excludes(str(tmp_path / 'root'), parse_dropboxignore(['node_modules']),
+                     scan_index=ScanIndex(str(tmp_path / 'index.json')))
+    dropbox_exclude_mock.reset_mock()
+
+    # WHEN
+    initial_excludes(str(tmp_path / 'root'), parse_dropboxignore(['lib']),
+                     scan_index=ScanIndex(str(tmp_path / 'index.json')))
+
+    # THEN
+    assert dropbox_exclude_mock.call_count == 3
+
+
+@patch('dropboxignore.dropbox_exclude')
+def test_scan_index_resumes_from_checkpoint(dropbox_exclude_mock, tmp_path):
+    # GIVEN
+    make_tree(tmp_path / 'root')
+    rules = parse_dropboxignore(['node_modules'])
+    initial_excludes(str(tmp_path / 'root'), rules, scan_index=ScanIndex(str(tmp_path / 'index.json')))
+    with open(tmp_path / 'index.json') as index_file:
+        data = json.load(index_file)
+    data['dirs'] = {'': data['dirs']['']}
+    data['pending'] = ['project2']
+    with open(tmp_path / 'index.json', 'w') as index_file:
+        json.dump(data, index_file)
+    dropbox_exclude_mock.reset_mock()
+
+    # WHEN
+    initial_excludes(str(tmp_path / 'root'), rules, scan_index=ScanIndex(str(tmp_path / 'index.json')))
+
+    # THEN
+    dropbox_exclude_mock.assert_called_once()
+    assert dropbox_exclude_mock.call_args[0][0] == os.path.join('project2', 'node_modules')
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+@patch('dropboxignore.dropbox_exclude')
+def test_scan_index_resumes_without_removed_pending(dropbox_exclude_mock, tmp_path, jobs):
+    # GIVEN
+    make_tree(tmp_path / 'root')
+    rules = parse_dropboxignore(['node_modules'])
+    initial_excludes(str(tmp_path / 'root'), rules, scan_index=ScanIndex(str(tmp_path / 'index.json')))
+    with open(tmp_path / 'index.json') as index_file:
+        data = json.load(index_file)
+    data['dirs'] = {'': data['dirs']['']}
+    data['pending'] = ['removed', os.path.join('project0', 'removed'), 'project2']
+    with open(tmp_path / 'index.json', 'w') as index_file:
+        json.dump(data, index_file)
+    dropbox_exclude_mock.reset_mock()
+
+    # WHEN
+    initial_excludes(str(tmp_path / 'root'), rules, jobs=jobs, scan_index=ScanIndex(str(tmp_path / 'index.json')))
+
+    # THEN
+    assert [call[0][0] for call in dropbox_exclude_mock.call_args_list] == [os.path.join('project2', 'node_modules')]
+    with open(tmp_path / 'index.json') as index_file:
+        assert json.load(index_file)['pending'] == []
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_scan_index_retries_failed_exclusions(tmp_path, jobs):
+    # GIVEN
+    make_tree(tmp_path / 'root')
+    rules = parse_dropboxignore(['node_modules'])
+    backend = FakeBackend(str(tmp_path / 'root'))
+    with patch.object(backend, 'add', return_value=False):
+        initial_excludes(str(tmp_path / 'root'), rules, ExclusionIndex(str(tmp_path / 'root'), backend=backend),
+                         jobs=jobs, scan_index=ScanIndex(str(tmp_path / 'index.json')))
+
+    # WHEN
+    with patch('os.scandir', wraps=os.scandir) as scandir_mock:
+        stats = initial_excludes(str(tmp_path / 'root'), rules,
+                                 ExclusionIndex(str(tmp_path / 'root'), backend=backend), jobs=jobs,
+                                 scan_index=ScanIndex(str(tmp_path / 'index.json')))
+
+    # THEN
+    assert backend.excluded == {os.path.join(f'project{project}', 'node_modules') for project in range(3)}
+    assert scandir_mock.call_count == 3
+    assert stats.ignored == 3
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+@patch('dropboxignore.dropbox_exclude')
+def test_scan_index_rescans_changed_nested_rules(dropbox_exclude_mock, tmp_path, jobs):
+    # GIVEN
+    root = tmp_path / 'root'
+    make_tree(root)
+    (root / 'project0' / '.dropboxignore').write_text('dist\n')
+    initial_excludes(str(root), parse_dropboxignore(['node_modules'], nested_root=str(root)),
+                     scan_index=ScanIndex(str(tmp_path / 'index.json')))
+    dropbox_exclude_mock.reset_mock()
+
+    # WHEN
+    (root / 'project0' / '.dropboxignore').write_text('lib\n')
+    os.utime(str(root / 'project0' / '.dropboxignore'), ns=(0, 0))
+    (root / 'project1' / '.dropboxignore').write_text('src\n')
+    initial_excludes(str(root), parse_dropboxignore(['node_modules'], nested_root=str(root)), jobs=jobs,
+                     scan_index=ScanIndex(str(tmp_path / 'index.json')))
+
+    # THEN
+    assert sorted(call[0][0] for call in dropbox_exclude_mock.call_args_list) == \
+        [os.path.join('project0', 'node_modules'), os.path.join('project0', 'src', 'lib'),
+         os.path.join('project1', 'node_modules'), os.path.join('project1', 'src')]
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+@patch('dropboxignore.dropbox_exclude')
+def test_scan_index_checkpoint_only_when_due(dropbox_exclude_mock, tmp_path, jobs):
+    # GIVEN
+    make_tree(tmp_path / 'root')
+    scan_index = ScanIndex(str(tmp_path / 'index.json'), checkpoint_interval=3600)
+
+    # WHEN
+    with patch.object(scan_index, 'checkpoint', wraps=scan_index.checkpoint) as checkpoint_mock:
+        initial_excludes(str(tmp_path / 'root'), parse_dropboxignore(['node_modules']), jobs=jobs,
+                         scan_index=scan_index)
+
+    # THEN
+    assert not checkpoint_mock.called
+    assert dropbox_exclude_mock.call_count == 3
@@ -38,3 +38,31 @@ def test_test_if_ignored_excluded():
 
     # THEN
     assert not result
+
+
+def test_test_if_ignored_literal_rules():
+    # GIVEN
+    rules = dropboxignore.parse_dropboxignore(['node_modules', '!keep'])
+
+    # WHEN
+    results = [dropboxignore.test_if_ignored(path, rules)
+               for path in ['a/node_modules/b', 'node_modules_b', 'keep/node_modules']]
+
+    # THEN
+    assert rules.matcher.literal_ignored == {'node_modules'}
+    assert rules.matcher.literal_excluded == {'keep'}
+    assert results == [True, False, False]
+
+
+def test_test_if_ignored_combined_rules_match_rule_by_rule():
+    # GIVEN
+    rules = dropboxignore.parse_dropboxignore(['*.log', 'te?t', '/build', 'node_modules', '!*keep*'])
+    paths = ['a.log', 'x/a.log/y', 'test', 'x/tent', 'build', 'x/build', 'node_modules/keep', 'keep.log', 'a/b']
+
+    # WHEN
+    results = [dropboxignore.test_if_ignored(path, rules) for path in paths]
+    expected = [dropboxignore.test_if_ignored(path, Rules(rules.ignored, rules.excluded)) for path in paths]
+
+    # THEN
+    assert results == expected
+    assert results == [True, True, True, True, True, False, False, False, False]
@@ -0,0 +1,111 @@
+import pytest
+
+import dropboxignore
+from dropboxignore import parse_dropboxignore, TrieMatcher
+
+
+def test_trie_literal_pattern():
+    # GIVEN
+    rules = parse_dropboxignore(['node_modules'], 'trie')
+
+    # WHEN
+    paths = ['node_modules', 'a/node_modules/b', 'a/node_modules_b']
+    results = [dropboxignore.test_if_ignored(path, rules) for path in paths]
+
+    # THEN
+    assert isinstance(rules.matcher, TrieMatcher)
+    assert results == [True, True, False]
+
+
+def test_trie_glob_pattern():
+    # GIVEN
+    rules = parse_dropboxignore(['*.log', 'te?t', 'x[!0-9]', 'foo\\ bar'], 'trie')
+
+    # WHEN
+    paths = ['a/b.log', 'b.log/c', 'tent', 'teest', 'xa', 'x1', 'foo bar']
+    results = [dropboxignore.test_if_ignored(path, rules) for path in paths]
+
+    # THEN
+    assert results == [True, True, True, False, True, False, True]
+
+
+def test_trie_anchored_pattern():
+    # GIVEN
+    rules = parse_dropboxignore(['/build', 'src/*/gen', 'docs/'], 'trie')
+
+    # WHEN
+    paths = ['build', 'a/build', 'src/a/gen/x', 'src/gen', 'a/docs']
+    results = [dropboxignore.test_if_ignored(path, rules) for path in paths]
+
+    # THEN
+    assert results == [True, False, True, False, True]
+
+
+def test_trie_double_star_pattern():
+    # GIVEN
+    rules = parse_dropboxignore(['a/**/test', '**/hide/**'], 'trie')
+
+    # WHEN
+    paths = ['a/test', 'a/x/y/test/z', 'b/a/test', 'x/hide', 'x/hide/y']
+    results = [dropboxignore.test_if_ignored(path, rules) for path in paths]
+
+    # THEN
+    assert results == [True, True, False, True, True]
+
+
+def test_trie_negated_pattern():
+    # GIVEN
+    rules = parse_dropboxignore(['*cache*', '!keep_cache'], 'trie')
+
+    # WHEN
+    paths = ['a/.mypy_cache', 'keep_cache', 'keep_cache/a_cache']
+    results = [dropboxignore.test_if_ignored(path, rules) for path in paths]
+
+    # THEN
+    assert results == [True, False, False]
+
+
+def test_trie_deep_path():
+    # GIVEN
+    rules = parse_dropboxignore(['**/a/**/b/**/c'], 'trie')
+
+    # WHEN
+    result = dropboxignore.test_if_ignored('/'.join(['a'] * 5000), rules)
+
+    # THEN
+    assert not result
+
+
+def test_trie_sibling_glob_segments():
+    # GIVEN
+    rules = parse_dropboxignore(['src/*.gen/a', 'src/x*/b', 'src/?.gen/c', '!src/x*/b/keep', 'src/*'], 'trie')
+
+    # WHEN
+    paths = ['src/x.gen/a', 'src/x.gen/b', 'src/x.gen/c', 'src/x.gen/b/keep', 'src/xy.gen/c', 'src/y']
+    results = [rules.matcher.verdict(path) for path in paths]
+
+    # THEN
+    assert results == [True, True, True, False, True, True]
+
+
+def test_trie_suffix_segments():
+    # GIVEN
+    rules = parse_dropboxignore(['a/*.log/x', 'a/*log/y', 'a/**.tmp', 'a/*/z'], 'trie')
+
+    # WHEN
+    paths = ['a/b.log/x', 'a/b.log/y', 'a/blog/x', 'a/blog/y', 'a/.tmp', 'a/b.tmp/c', 'a/b/z', 'a/b.log/w']
+    results = [rules.matcher.verdict(path) for path in paths]
+
+    # THEN
+    assert results == [True, True, None, True, True, True, True, None]
+    assert set(rules.matcher.anchored.literals['a'].suffixes) == {'.log', 'log', '.tmp', ''}
+
+
+def test_matcher_verdict_abstract():
+    # GIVEN
+    class IncompleteMatcher(dropboxignore.Matcher):
+        pass
+
+    # WHEN / THEN
+    with pytest.raises(TypeError):
+        IncompleteMatcher()
@@ -0,0 +1,80 @@
+from unittest.mock import patch, MagicMock
+from dropboxignore import EventHandler, VerdictCache, parse_dropboxignore
+
+
+def test_verdict_cache_hit_and_miss():
+    # GIVEN
+    cache = VerdictCache()
+    rules = parse_dropboxignore(['node_modules\n'])
+
+    # WHEN
+    with patch('dropboxignore.test_if_ignored', return_value=False) as test_if_ignored_mock:
+        verdicts = [cache.test('project/src', rules) for _ in range(3)]
+
+    # THEN
+    assert verdicts == [False, False, False]
+    test_if_ignored_mock.assert_called_once_with('project/src', rules)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_verdict_cache_ignored_ancestor():
+    # GIVEN
+    cache = VerdictCache()
+    rules = parse_dropboxignore(['node_modules\n'])
+    assert cache.test('project/node_modules', rules)
+
+    # WHEN
+    with patch('dropboxignore.test_if_ignored') as test_if_ignored_mock:
+        verdict = cache.test('project/node_modules/lib/dist', rules)
+
+    # THEN
+    assert verdict
+    assert not test_if_ignored_mock.called
+    assert cache.hits == 1
+
+
+def test_verdict_cache_evicts_least_recently_used():
+    # GIVEN
+    cache = VerdictCache(maxsize=2)
+    rules = parse_dropboxignore([])
+    cache.test('a', rules)
+    cache.test('b', rules)
+    cache.test('a', rules)
+
+    # WHEN
+    cache.test('c', rules)
+    cache.test('a', rules)
+    cache.test('b', rules)
+
+    # THEN
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_verdict_cache_clear():
+    # GIVEN
+    cache = VerdictCache()
+    cache.test('build', parse_dropboxignore(['build\n']))
+
+    # WHEN
+    cache.clear()
+
+    # THEN
+    assert not cache.test('build', parse_dropboxignore([]))
+    assert cache.generation == 1
+    assert cache.misses == 2
+
+
+@patch('dropboxignore.dropbox_exclude')
+def test_event_handler_clears_verdicts_on_reload(dropbox_exclude_mock, tmp_path):
+    # GIVEN
+    (tmp_path / '.dropboxignore').write_text('build\n')
+    ev = EventHandler(str(tmp_path), parse_dropboxignore([]), MagicMock())
+    ev.process_paths(['build'])
+
+    # WHEN
+    ev.reload()
+    ev.process_paths(['build'])
+
+    # THEN
+    dropbox_exclude_mock.assert_called_once()
+    assert ev.verdicts.generation == 1
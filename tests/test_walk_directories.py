@@ -0,0 +1,51 @@
+import os
+from dropboxignore import walk_directories
+
+
+def test_walk_directories_relative_paths(tmp_path):
+    # GIVEN
+    (tmp_path / 'a' / 'b' / 'c').mkdir(parents=True)
+    (tmp_path / 'd').mkdir()
+    (tmp_path / 'a' / 'file').write_text('')
+
+    # WHEN
+    result = sorted(relpath for relpath, _ in walk_directories(str(tmp_path)))
+
+    # THEN
+    assert result == ['a', os.path.join('a', 'b'), os.path.join('a', 'b', 'c'), 'd']
+
+
+def test_walk_directories_descend(tmp_path):
+    # GIVEN
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'd' / 'e').mkdir(parents=True)
+
+    # WHEN
+    result = sorted(relpath for relpath, _ in walk_directories(str(tmp_path), lambda relpath, _: relpath != 'a'))
+
+    # THEN
+    assert result == ['a', 'd', os.path.join('d', 'e')]
+
+
+def test_walk_directories_symlink_loop(tmp_path):
+    # GIVEN
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'loop').symlink_to(tmp_path / 'a')
+
+    # WHEN
+    result = sorted(relpath for relpath, _ in walk_directories(str(tmp_path)))
+
+    # THEN
+    assert result == ['a', os.path.join('a', 'loop')]
+
+
+def test_walk_directories_no_follow_symlinks(tmp_path):
+    # GIVEN
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'link').symlink_to(tmp_path / 'a')
+
+    # WHEN
+    result = [relpath for relpath, _ in walk_directories(str(tmp_path), follow_symlinks=False)]
+
+    # THEN
+    assert result == ['a']